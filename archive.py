@@ -0,0 +1,260 @@
+from datetime import datetime, timedelta
+from pathlib import Path
+from tortoise import connections, timezone
+from tortoise.transactions import in_transaction
+from db import WRITE_CONNECTION, read_connection, dialect_sql, db_datetime, is_postgres
+from export import TABLES, format_rows
+from models import Bot as BotModel
+from outbox import QUEUED
+from metrics import DB_QUERY_SECONDS
+from config import (
+    RETENTION_DAYS, ARCHIVE_DIR, RETENTION_INTERVAL, RETENTION_BATCH_SIZE, RETENTION_BATCH_PAUSE,
+    VACUUM_STEP_PAGES
+)
+import asyncio
+import gzip
+import json
+import logging
+import os
+import zlib
+
+# Колонки сообщения в архиве - те же, что в выгрузке (export.py)
+COLUMNS = TABLES["messages"][1]
+
+# Старые сообщения бота по индексу (bot_id, timestamp); продолжение после (timestamp, id)
+# прошлой пачки - строки, которые не удаляются (queued), не выбираются повторно
+SELECT_SQL = (
+    'SELECT ' + ", ".join(f'"{column}"' for column in COLUMNS) + ' FROM "messages" '
+    'WHERE "bot_id" = ? AND "timestamp" < ? {after}ORDER BY "timestamp", "id" LIMIT ?'
+)
+AFTER_SQL = 'AND ("timestamp", "id") > (?, ?) '
+
+
+def bot_dir(bot_id: int) -> Path:
+    return Path(ARCHIVE_DIR) / f"bot{bot_id}"
+
+
+def month_path(bot_id: int, month: str) -> Path:
+    """Архив бота за месяц (YYYY-MM): NDJSON в gzip, по одному сжатому блоку на пачку"""
+    return bot_dir(bot_id) / f"{month}.ndjson.gz"
+
+
+def chats_path(bot_id: int, month: str) -> Path:
+    """Список чатов, сообщения которых есть в архиве месяца"""
+    return bot_dir(bot_id) / f"{month}.chats.json"
+
+
+# Кэш списков чатов по месяцам: путь -> (mtime, set)
+chat_index_cache = {}
+
+
+def archived_chats(bot_id: int, month: str) -> set:
+    path = chats_path(bot_id, month)
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return set()
+    cached = chat_index_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    chats = set(json.loads(path.read_text()))
+    chat_index_cache[path] = (mtime, chats)
+    return chats
+
+
+def archive_months(bot_id: int) -> list:
+    """Месяцы, за которые у бота есть архив, от новых к старым"""
+    return sorted((path.name[:7] for path in bot_dir(bot_id).glob("*.ndjson.gz")), reverse=True)
+
+
+def write_month(bot_id: int, month: str, rows: list):
+    """Дописывание пачки в архив месяца; возвращается после fsync, до удаления из базы.
+
+    Если процесс упадёт после записи, но до удаления, пачка попадёт в архив ещё раз -
+    при чтении повторы отбрасываются по id.
+    """
+    path = month_path(bot_id, month)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = format_rows(rows, COLUMNS, "ndjson").encode()
+    with open(path, "ab") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="ab") as archive:
+            archive.write(data)
+        raw.flush()
+        os.fsync(raw.fileno())
+
+    chats = archived_chats(bot_id, month)
+    new_chats = {row[COLUMNS.index("chat_id")] for row in rows} - chats
+    if new_chats:
+        index = chats_path(bot_id, month)
+        temporary = index.with_suffix(".tmp")
+        temporary.write_text(json.dumps(sorted(chats | new_chats)))
+        os.replace(temporary, index)
+
+
+def read_month(bot_id: int, chat_id: int, month: str):
+    """Сообщения чата из архива месяца"""
+    # Быстрая проверка строки до разбора JSON: формат строк задаёт format_rows
+    marker = f'"chat_id": {chat_id},'.encode()
+    try:
+        with gzip.open(month_path(bot_id, month)) as archive:
+            for line in archive:
+                if marker in line:
+                    yield json.loads(line)
+    except (EOFError, gzip.BadGzipFile, zlib.error):
+        # Недописанный последний блок (сбой во время записи): эти строки остались в базе
+        logging.warning(f"Archive {month_path(bot_id, month)} ends with an incomplete block")
+
+
+def archive_cursor(record: dict) -> str:
+    """Позиция в архивной истории: дата и id сообщения"""
+    return f"{record['timestamp']}_{record['id']}"
+
+
+def read_chat_archive(bot_id: int, chat_id: int, before: str = None, limit: int = 50) -> tuple:
+    """Страница архивной истории чата до позиции before: (сообщения от старых к новым, есть ли ещё).
+
+    Порядок - по дате, как и разбиение на месяцы: месяцы читаются от новых к старым, пока
+    не наберётся страница; месяцы без этого чата пропускаются по списку чатов.
+    """
+    if before:
+        timestamp, _, message_id = before.rpartition("_")
+        before = (datetime.fromisoformat(timestamp), int(message_id))
+    months = [
+        month for month in archive_months(bot_id)
+        if chat_id in archived_chats(bot_id, month) and (not before or month <= before[0].strftime("%Y-%m"))
+    ]
+    found = {}
+    for position, month in enumerate(months):
+        for record in read_month(bot_id, chat_id, month):
+            key = (datetime.fromisoformat(record["timestamp"]), record["id"])
+            if not before or key < before:
+                found[key] = record
+        if len(found) > limit:
+            break
+    else:
+        position = len(months)
+    page = [found[key] for key in sorted(found)[-limit:]]
+    return page, len(found) > limit or position < len(months) - 1
+
+
+def has_archive(bot_id: int, chat_id: int) -> bool:
+    return any(chat_id in archived_chats(bot_id, month) for month in archive_months(bot_id))
+
+
+def month_of(value) -> str:
+    """YYYY-MM даты сообщения: PostgreSQL отдаёт datetime, SQLite - строку str(datetime)"""
+    return value.strftime("%Y-%m") if isinstance(value, datetime) else value[:7]
+
+
+class Archiver:
+    """Фоновый перенос сообщений старше срока хранения бота в архивы по месяцам.
+
+    Сообщения удаляются небольшими пачками отдельными транзакциями с паузой между ними,
+    чтобы запись входящих не ждала долгую транзакцию. Неотправленные (queued) остаются
+    в базе. После удаления SQLite возвращает освободившиеся страницы ОС шагами
+    incremental_vacuum; в PostgreSQL место переиспользует autovacuum.
+    """
+
+    def __init__(self, days: int = RETENTION_DAYS, interval: float = RETENTION_INTERVAL,
+                 batch_size: int = RETENTION_BATCH_SIZE, pause: float = RETENTION_BATCH_PAUSE,
+                 vacuum_pages: int = VACUUM_STEP_PAGES):
+        self.days = days
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        # В режиме шардирования - функция, возвращающая id ботов этого процесса
+        self.owned = None
+        self.task = None
+        self.archived = 0
+
+    def start(self):
+        """Запуск периодической архивации"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run(), name="archiver")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.error(f"Archiving failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """Один проход по всем ботам; возвращает число перенесённых сообщений"""
+        bots = await BotModel.all().values_list("id", "retention_days")
+        owned = set(self.owned()) if self.owned is not None else None
+        archived = 0
+        for bot_id, days in bots:
+            days = self.days if days is None else days
+            if days <= 0 or (owned is not None and bot_id not in owned):
+                continue
+            count = await self.archive_bot(bot_id, timezone.now() - timedelta(days=days))
+            if count:
+                logging.info(f"Archived {count} messages of bot {bot_id} older than {days} days")
+            archived += count
+        if archived:
+            await self.vacuum()
+        self.archived += archived
+        return archived
+
+    async def archive_bot(self, bot_id: int, cutoff: datetime) -> int:
+        """Перенос сообщений бота старше cutoff в архив; число перенесённых"""
+        archived, after = 0, None
+        while True:
+            connection = read_connection()
+            sql = SELECT_SQL.format(after=AFTER_SQL if after else "")
+            params = [bot_id, db_datetime(connection, cutoff), *(after or []), self.batch_size]
+            with DB_QUERY_SECONDS.time("archive_select"):
+                _, rows = await connection.execute_query(dialect_sql(connection, sql), params)
+            if not rows:
+                return archived
+            after = [rows[-1]["timestamp"], rows[-1]["id"]]
+            rows = [row for row in rows if row["status"] != QUEUED]
+
+            months = {}
+            for row in rows:
+                months.setdefault(month_of(row["timestamp"]), []).append([row[column] for column in COLUMNS])
+            for month, month_rows in months.items():
+                await asyncio.to_thread(write_month, bot_id, month, month_rows)
+
+            ids = [row["id"] for row in rows]
+            if ids:
+                with DB_QUERY_SECONDS.time("archive_delete"):
+                    async with in_transaction(WRITE_CONNECTION) as conn:
+                        await conn.execute_query(dialect_sql(
+                            conn, f'DELETE FROM "messages" WHERE "id" IN ({", ".join("?" for _ in ids)})'
+                        ), ids)
+            archived += len(ids)
+            await asyncio.sleep(self.pause)
+
+    async def vacuum(self):
+        """Возврат свободных страниц SQLite ОС шагами по vacuum_pages"""
+        conn = connections.get(WRITE_CONNECTION)
+        if is_postgres(conn):
+            return
+        _, rows = await conn.execute_query("PRAGMA auto_vacuum")
+        if rows[0][0] != 2:
+            logging.warning("SQLite auto_vacuum is not INCREMENTAL, run python archive_messages.py --vacuum once")
+            return
+        while True:
+            _, rows = await conn.execute_query("PRAGMA freelist_count")
+            if not rows[0][0]:
+                return
+            # Через execute (не script) sqlite3 делает один шаг - одна страница за вызов
+            await conn.execute_script(f"PRAGMA incremental_vacuum({self.vacuum_pages})")
+            await asyncio.sleep(self.pause)
+
+    def stats(self) -> dict:
+        return {"archived": self.archived}
+
+
+# Архиватор процесса
+archiver = Archiver()
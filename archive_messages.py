@@ -0,0 +1,49 @@
+# archive_messages.py
+from datetime import timedelta
+from tortoise import Tortoise, connections, run_async, timezone
+from db import TORTOISE_CONFIG, WRITE_CONNECTION, apply_migrations, is_postgres
+from archive import archiver
+import argparse
+import time
+
+
+async def enable_incremental_vacuum():
+    """Перевод существующей базы SQLite на auto_vacuum=INCREMENTAL (полный VACUUM, один раз).
+
+    VACUUM переписывает весь файл и держит блокировку записи, поэтому приложение
+    на это время лучше остановить.
+    """
+    conn = connections.get(WRITE_CONNECTION)
+    if is_postgres(conn):
+        print("PostgreSQL reclaims space with autovacuum, nothing to do")
+        return
+    await conn.execute_script("PRAGMA auto_vacuum = INCREMENTAL")
+    started = time.perf_counter()
+    await conn.execute_script("VACUUM")
+    print(f"VACUUM done in {time.perf_counter() - started:.1f}s")
+
+
+async def archive_messages(args):
+    """Архивация сразу, не дожидаясь фонового прохода приложения"""
+    await Tortoise.init(config=TORTOISE_CONFIG)
+    await apply_migrations()
+    if args.vacuum:
+        await enable_incremental_vacuum()
+        return
+    started = time.perf_counter()
+    if args.bot is not None:
+        days = archiver.days if args.days is None else args.days
+        archived = await archiver.archive_bot(args.bot, timezone.now() - timedelta(days=days))
+        await archiver.vacuum()
+    else:
+        if args.days is not None:
+            archiver.days = args.days
+        archived = await archiver.run_once()
+    print(f"Archived {archived} messages in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bot", type=int, help="только этот бот")
+    parser.add_argument("--days", type=int, help="срок хранения вместо RETENTION_DAYS (для ботов без своего срока)")
+    parser.add_argument("--vacuum", action="store_true", help="включить incremental vacuum для старой базы")
+    run_async(archive_messages(parser.parse_args()))
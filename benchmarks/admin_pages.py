@@ -0,0 +1,141 @@
+"""Задержка страниц админки (/login, /admin/bots, /chats) при одновременной работе
+нескольких операторов и потоке входящих сообщений: без кэша страниц и с кэшем.
+
+Запуск из корня репозитория:
+    python -m benchmarks.admin_pages --operators 20 --seconds 10
+
+Операторы - отдельные клиенты со своей сессией; как браузер, они повторяют запрос
+с If-None-Match, если уже получали страницу. Входящие сообщения идут через ingestor
+и сбрасывают версии данных, как в приложении. Запросы идут через ASGI в том же
+процессе (без сети), поэтому время - это работа приложения: БД, шаблон, сжатие.
+"""
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+from benchmarks.fake_telegram import print_result, rss_mb
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+CHAT_INSERT_SQL = (
+    'INSERT INTO "chats" ("id", "title", "last_message", "unread", "updated", "bot_id") '
+    'VALUES (?, ?, ?, ?, ?, ?)'
+)
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+async def operator(client, bot_id: int, deadline: float, latencies: dict, statuses: dict):
+    """Оператор переходит между страницами; сессия - своя у каждого клиента"""
+    await client.post("/login", data={"bot_id": bot_id})
+    etags = {}
+    while time.perf_counter() < deadline:
+        url = random.choice(("/chats", "/chats", "/admin/bots", "/login"))
+        headers = {"accept-encoding": "gzip"}
+        if url in etags:
+            headers["if-none-match"] = etags[url]
+        started = time.perf_counter()
+        response = await client.get(url, headers=headers)
+        latencies.setdefault(url, []).append(time.perf_counter() - started)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        if "etag" in response.headers:
+            etags[url] = response.headers["etag"]
+        # Ответ из кэша проходит через ASGI без переключения задач; по сети клиент уступил бы цикл
+        await asyncio.sleep(0)
+
+
+async def incoming(ingestor, bot_ids: list, chats: int, interval: float, deadline: float):
+    """Поток входящих сообщений в случайные чаты"""
+    from ingest import IncomingMessage
+    while time.perf_counter() < deadline:
+        bot_index = random.randrange(len(bot_ids))
+        chat_id = (bot_index + 1) * 1_000_000 + random.randrange(chats)
+        await ingestor.put(IncomingMessage(bot_id=bot_ids[bot_index], chat_id=chat_id,
+                                           chat_title=f"chat {chat_id}", text="new message"))
+        await asyncio.sleep(interval)
+
+
+async def run_mode(app, ttl: float, args, bot_ids: list) -> dict:
+    import httpx
+    from ingest import ingestor
+    from pages import page_cache
+
+    page_cache.ttl = ttl
+    page_cache.entries.clear()
+    page_cache.hits = page_cache.misses = 0
+    latencies, statuses = {}, {}
+    deadline = time.perf_counter() + args.seconds
+    transport = httpx.ASGITransport(app=app)
+    clients = [httpx.AsyncClient(transport=transport, base_url="http://bench") for _ in range(args.operators)]
+    writer = asyncio.create_task(incoming(ingestor, bot_ids, args.chats, args.message_interval, deadline))
+    await asyncio.gather(*(
+        operator(client, bot_ids[i % len(bot_ids)], deadline, latencies, statuses)
+        for i, client in enumerate(clients)
+    ))
+    await writer
+    for client in clients:
+        await client.aclose()
+
+    everything = [value for values in latencies.values() for value in values]
+    result = {
+        "requests_per_s": len(everything) / args.seconds,
+        "p50_ms": percentile(everything, 0.5),
+        "p99_ms": percentile(everything, 0.99),
+        "not_modified_share": statuses.get(304, 0) / len(everything),
+        "cache_hit_share": page_cache.hits / max(1, page_cache.hits + page_cache.misses),
+    }
+    for url, values in latencies.items():
+        name = url.strip("/").replace("/", "_")
+        result[f"{name}_p99_ms"] = percentile(values, 0.99)
+    return result
+
+
+async def main(args):
+    from db import init_db, get_tortoise_config, WRITE_CONNECTION
+    from models import Bot as BotModel
+    from counters import rebuild_unread_totals
+    import main as app_module
+
+    random.seed(args.seed)
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    await init_db(get_tortoise_config(db_path, args.readers, database_url=""))
+    bots = [await BotModel.create(token=f"{i}:bench{'x' * 30}", name=f"bench {i}", bot_type="shop")
+            for i in range(1, args.bots + 1)]
+    async with in_transaction(WRITE_CONNECTION) as conn:
+        for index, bot in enumerate(bots):
+            await conn.execute_many(CHAT_INSERT_SQL, [
+                [(index + 1) * 1_000_000 + i, f"chat {i}", "last message " * 5, random.randrange(5),
+                 f"2025-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}+00:00", bot.id]
+                for i in range(args.chats)
+            ])
+    await rebuild_unread_totals()
+    app_module.ingestor.start()
+
+    bot_ids = [bot.id for bot in bots]
+    result = {"benchmark": "admin_pages", "operators": args.operators, "bots": args.bots, "chats": args.chats}
+    for mode, ttl in (("no_cache", 0), ("cache", args.ttl)):
+        for key, value in (await run_mode(app_module.app, ttl, args, bot_ids)).items():
+            result[f"{mode}_{key}"] = value
+
+    await app_module.ingestor.stop()
+    await Tortoise.close_connections()
+    result["rss_mb"] = rss_mb()
+    print_result(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--operators", type=int, default=20)
+    parser.add_argument("--bots", type=int, default=30)
+    parser.add_argument("--chats", type=int, default=1000)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--message-interval", type=float, default=0.02, help="пауза между входящими сообщениями")
+    parser.add_argument("--ttl", type=float, default=5)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,158 @@
+"""Запуск N настроенных ботов: когда приложение готово отвечать, когда все боты на связи
+и насколько при этом занят цикл событий.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bot_startup --bots 500 --mode parallel --latency 0.05 --bad-tokens 10
+    python -m benchmarks.bot_startup --bots 500 --mode tasks --latency 0.05 --bad-tokens 10
+    python -m benchmarks.bot_startup --bots 50 --mode threads
+
+parallel - как startup в main.py: BotManager.start_background, проверка токенов и запуск
+параллельно с ограничением BOT_START_CONCURRENCY; tasks - прежний startup: start_bot
+по одному; threads - старая схема с потоком на бота. Боты - строки в временной SQLite,
+--bad-tokens последних ботов заглушка отвергает (401), --latency - задержка ответа
+заглушки на каждый запрос, как у сети до api.telegram.org.
+"""
+from tortoise import Tortoise
+from benchmarks.fake_telegram import FakeTelegram, make_token, print_result, rss_mb
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import threading
+import time
+
+
+async def wait_online(server: FakeTelegram, count: int, timeout: float = 60):
+    """Ждём, пока каждый бот с рабочим токеном сделает первый getUpdates"""
+    deadline = time.perf_counter() + timeout
+    while len(server.first_poll) < count and time.perf_counter() < deadline:
+        await asyncio.sleep(0.01)
+
+
+async def wait_deactivated(count: int, timeout: float = 30) -> int:
+    """Ждём, пока боты с отвергнутыми токенами будут отключены в БД"""
+    from models import Bot as BotModel
+
+    deadline = time.perf_counter() + timeout
+    while True:
+        deactivated = await BotModel.filter(is_active=False).count()
+        if deactivated >= count or time.perf_counter() > deadline:
+            return deactivated
+        await asyncio.sleep(0.05)
+
+
+async def measure_lag(lags: list, interval: float = 0.005):
+    """Задержка срабатывания таймера: сколько цикл событий был занят без переключений"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(loop.time() - expected)
+
+
+async def run_manager(server: FakeTelegram, bots: list, good: int, mode: str) -> dict:
+    from manager import BotManager
+
+    manager = BotManager()
+    started = time.perf_counter()
+    if mode == "parallel":
+        startup = manager.start_background(bots)
+    else:
+        for bot in bots:
+            await manager.start_bot(bot)
+    ready = time.perf_counter() - started
+    await wait_online(server, good)
+    online = time.perf_counter() - started
+    if mode == "parallel":
+        await startup
+    result = {"ready_s": ready, "online_s": online, "running": len(manager.bots)}
+    result["deactivated"] = await wait_deactivated(len(bots) - good)
+    result["rss_mb"] = rss_mb()
+    result["threads"] = threading.active_count()
+    await manager.stop_all()
+    return result
+
+
+async def run_threads(server: FakeTelegram, bots: list, good: int) -> dict:
+    """Старая схема: отдельный поток со своим циклом событий на каждого бота"""
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from bot import ShopBot
+
+    def worker(bot_instance, stop_event):
+        async def main():
+            polling = asyncio.create_task(bot_instance.start())
+            while not stop_event.is_set():
+                await asyncio.sleep(0.05)
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
+            await bot_instance.stop()
+        asyncio.run(main())
+
+    stop_event = threading.Event()
+    threads = []
+    started = time.perf_counter()
+    for bot in bots:
+        bot_instance = ShopBot(bot.token, bot.id)
+        # Общий пул соединений привязан к циклу событий приложения - в потоках у каждого свой
+        bot_instance.bot.session = AiohttpSession(api=TelegramAPIServer.from_base(server.url))
+        thread = threading.Thread(target=worker, args=(bot_instance, stop_event), daemon=True)
+        thread.start()
+        threads.append(thread)
+    ready = time.perf_counter() - started
+    await wait_online(server, good)
+    result = {"ready_s": ready, "online_s": time.perf_counter() - started, "running": len(threads),
+              "deactivated": 0, "rss_mb": rss_mb(), "threads": threading.active_count()}
+    stop_event.set()
+    await asyncio.get_running_loop().run_in_executor(None, lambda: [t.join(5) for t in threads])
+    return result
+
+
+async def main(args):
+    good = args.bots - args.bad_tokens
+    tokens = [make_token(100000 + i) for i in range(args.bots)]
+    server = FakeTelegram(latency=args.latency, rejected_tokens=tokens[good:])
+    os.environ["TELEGRAM_API_URL"] = await server.start()
+    from db import init_db, get_tortoise_config
+    from models import Bot as BotModel
+    from telegram_client import telegram_client
+
+    await init_db(get_tortoise_config(os.path.join(tempfile.mkdtemp(), "bench.sqlite3"), 1, database_url=""))
+    for token in tokens:
+        await BotModel.create(token=token, name=f"bench {token[:6]}", bot_type="shop")
+    # Как startup: строки активных ботов одним запросом
+    bots = await BotModel.filter(is_active=True).order_by("id")
+
+    baseline = rss_mb()
+    lags = []
+    lag_task = asyncio.create_task(measure_lag(lags))
+    if args.mode == "threads":
+        result = await run_threads(server, bots, good)
+    else:
+        result = await run_manager(server, bots, good, args.mode)
+    lag_task.cancel()
+    online_times = sorted(at - min(server.first_poll.values()) for at in server.first_poll.values())
+    await telegram_client.close()
+    await server.stop()
+    await Tortoise.close_connections()
+    result.update({
+        "benchmark": "bot_startup", "mode": args.mode, "bots": args.bots, "bad_tokens": args.bad_tokens,
+        "latency_s": args.latency, "online": len(server.first_poll),
+        "online_spread_s": online_times[-1] if online_times else None,
+        "max_loop_lag_ms": max(lags, default=0) * 1000,
+        "get_me_calls": server.calls.get("getMe", 0),
+        "rss_baseline_mb": baseline,
+    })
+    print_result(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bots", type=int, default=500)
+    parser.add_argument("--mode", choices=["parallel", "tasks", "threads"], default="parallel")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа заглушки, с")
+    parser.add_argument("--bad-tokens", type=int, default=10, help="ботов с отвергнутым токеном")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(args))
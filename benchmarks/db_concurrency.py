@@ -0,0 +1,113 @@
+"""Смешанная нагрузка на SQLite: запись входящих сообщений и одновременное чтение
+страниц веб-интерфейса (список чатов, история, счётчики непрочитанных).
+
+single - одно соединение с настройками Tortoise по умолчанию (как было раньше),
+tuned  - конфигурация db.py: писатель, пул читателей и PRAGMA.
+
+Запуск из корня репозитория:
+    python -m benchmarks.db_concurrency --profile single
+    python -m benchmarks.db_concurrency --profile tuned --readers 4
+"""
+from tortoise import Tortoise
+from benchmarks.fake_telegram import print_result, rss_mb
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+
+async def main(args):
+    from models import Message, Bot as BotModel
+    from ingest import MessageIngestor, IncomingMessage
+    from counters import unread_totals
+    from db import get_tortoise_config, init_db
+    from main import get_chats_page, get_messages_page
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    if args.profile == "single":
+        await Tortoise.init(db_url=f"sqlite://{db_path}", modules={"models": ["models"]})
+        await Tortoise.generate_schemas()
+    else:
+        await init_db(get_tortoise_config(db_path, args.readers))
+    bot = await BotModel.create(token="1:bench", name="bench", bot_type="shop")
+
+    # Предварительно наполняем базу, чтобы чтение шло не по пустым таблицам
+    ingestor = MessageIngestor()
+    ingestor.start()
+    for i in range(args.preload):
+        chat_id = 1000 + i % args.chats
+        await ingestor.put(IncomingMessage(bot.id, chat_id, f"User #{chat_id}", f"old {i}"))
+    await ingestor.stop()
+
+    ingestor = MessageIngestor()
+    ingestor.start()
+    deadline = time.perf_counter() + args.duration
+    write_latencies = []
+    read_latencies = []
+    written = 0
+
+    async def producer():
+        nonlocal written
+        i = 0
+        while time.perf_counter() < deadline:
+            chat_id = 1000 + random.randrange(args.chats)
+            started = time.perf_counter()
+            await ingestor.put(IncomingMessage(bot.id, chat_id, f"User #{chat_id}", f"new {i}"))
+            write_latencies.append(time.perf_counter() - started)
+            written += 1
+            i += 1
+            await asyncio.sleep(args.write_pause)
+
+    async def admin():
+        # Один открытый в браузере интерфейс: список чатов, затем история случайного чата
+        while time.perf_counter() < deadline:
+            chat_id = 1000 + random.randrange(args.chats)
+            started = time.perf_counter()
+            await get_chats_page(bot.id)
+            await get_messages_page(bot.id, chat_id)
+            await unread_totals()
+            read_latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(producer() for _ in range(args.writers)),
+        *(admin() for _ in range(args.admins))
+    )
+    await ingestor.stop()
+    elapsed = time.perf_counter() - started
+
+    saved = await Message.all().count()
+    await Tortoise.close_connections()
+
+    write_latencies.sort()
+    read_latencies.sort()
+    print_result({
+        "benchmark": "db_concurrency",
+        "profile": args.profile,
+        "readers": args.readers if args.profile == "tuned" else 0,
+        "elapsed_s": elapsed,
+        "saved": saved,
+        "expected": args.preload + written,
+        "writes_per_s": written / elapsed,
+        "write_p99_ms": write_latencies[int(len(write_latencies) * 0.99)] * 1000,
+        "page_loads": len(read_latencies),
+        "page_loads_per_s": len(read_latencies) / elapsed,
+        "page_p50_ms": read_latencies[len(read_latencies) // 2] * 1000,
+        "page_p99_ms": read_latencies[int(len(read_latencies) * 0.99)] * 1000,
+        "rss_mb": rss_mb(),
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", choices=["single", "tuned"], default="tuned")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--preload", type=int, default=50000)
+    parser.add_argument("--chats", type=int, default=500)
+    parser.add_argument("--writers", type=int, default=50)
+    parser.add_argument("--write-pause", type=float, default=0.005)
+    parser.add_argument("--admins", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
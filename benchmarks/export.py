@@ -0,0 +1,108 @@
+"""Выгрузка сообщений в NDJSON/CSV: скорость и память на миллионах строк, затем загрузка
+части выгрузки обратно пачками.
+
+Запуск из корня репозитория:
+    python -m benchmarks.export --messages 5000000
+    python -m benchmarks.export --messages 5000000 --format csv
+
+RSS снимается после каждой пачки: при постраничном чтении он не должен расти с объёмом.
+Файловая часть RSS - это mmap базы SQLite (до SQLITE_MMAP_SIZE), анонимная включает кэш
+страниц SQLite (до SQLITE_CACHE_SIZE_KB на соединение); обе упираются в свои лимиты.
+"""
+from tortoise import Tortoise, connections
+from benchmarks.fake_telegram import print_result, rss_mb
+import argparse
+import asyncio
+import itertools
+import os
+import tempfile
+import time
+
+# Генерация сообщений одним запросом SQLite, без Python в цикле
+GENERATE_SQL = '''
+WITH RECURSIVE seq("n") AS (SELECT ? UNION ALL SELECT "n" + 1 FROM seq WHERE "n" < ?)
+INSERT INTO "messages" ("chat_id", "text", "direction", "timestamp", "bot_id", "status", "attempts")
+SELECT 10000 + "n" % ?, 'message ' || "n" || ' ' || hex(randomblob(12)),
+       CASE "n" % 3 WHEN 0 THEN 'outgoing' ELSE 'incoming' END,
+       datetime('2025-01-01', '+' || ("n" / 10) || ' seconds') || '+00:00', ?,
+       CASE "n" % 3 WHEN 0 THEN 'sent' END, "n" % 3 = 0
+FROM seq
+'''
+
+
+def memory_mb() -> tuple:
+    """(RssAnon, RssFile) процесса в мегабайтах"""
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("RssAnon:", "RssFile:")):
+                name, size, _ = line.split()
+                values[name] = int(size) / 1024
+    return values["RssAnon:"], values["RssFile:"]
+
+
+async def main(args):
+    from db import init_db, get_tortoise_config, WRITE_CONNECTION
+    from models import Bot as BotModel
+    from export import export_rows, import_rows
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    await init_db(get_tortoise_config(db_path, 2, database_url=""))
+    source = await BotModel.create(token="1:export", name="export", bot_type="shop")
+    target = await BotModel.create(token="2:import", name="import", bot_type="shop")
+
+    # Полнотекстовый индекс здесь не нужен, а генерацию он замедляет в разы
+    writer = connections.get(WRITE_CONNECTION)
+    await writer.execute_script('DROP TRIGGER IF EXISTS "messages_fts_insert"')
+    started = time.perf_counter()
+    step = 500_000
+    for first in range(1, args.messages + 1, step):
+        await writer.execute_query(GENERATE_SQL, [first, min(first + step - 1, args.messages), args.chats, source.id])
+    generate_s = time.perf_counter() - started
+
+    export_path = os.path.join(os.path.dirname(db_path), f"messages.{args.format}")
+    rss_start = rss_mb()
+    rss = []
+    started = time.perf_counter()
+    with open(export_path, "w", encoding="utf-8", newline="") as output:
+        async for chunk in export_rows(source.id, "messages", args.format, batch_size=args.batch):
+            output.write(chunk)
+            rss.append(memory_mb())
+    export_s = time.perf_counter() - started
+    rows = args.messages
+    file_mb = os.path.getsize(export_path) / 1024 / 1024
+
+    # Загрузка первых import_rows строк выгрузки в другого бота
+    started = time.perf_counter()
+    with open(export_path, encoding="utf-8", newline="") as source_file:
+        lines = itertools.islice(source_file, args.import_rows + (args.format == "csv"))
+        imported = await import_rows(target.id, "messages", lines, args.format, args.batch)
+    import_s = time.perf_counter() - started
+
+    await Tortoise.close_connections()
+    print_result({
+        "benchmark": "export",
+        "format": args.format,
+        "rows": rows,
+        "batch": args.batch,
+        "generate_s": generate_s,
+        "export_s": export_s,
+        "export_rows_per_s": rows / export_s,
+        "file_mb": file_mb,
+        "rss_before_mb": rss_start,
+        # Память после 0%, 25%, 50%, 75% и 100% выгрузки
+        "rss_anon_mb": [round(rss[int((len(rss) - 1) * part)][0], 1) for part in (0, 0.25, 0.5, 0.75, 1)],
+        "rss_file_mb": [round(rss[int((len(rss) - 1) * part)][1], 1) for part in (0, 0.25, 0.5, 0.75, 1)],
+        "imported": imported,
+        "import_rows_per_s": imported / import_s,
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5_000_000)
+    parser.add_argument("--chats", type=int, default=20000)
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--import-rows", type=int, default=500_000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,234 @@
+"""Локальная заглушка Telegram Bot API для бенчмарков.
+
+Запуск из корня репозитория: python -m benchmarks.fake_telegram --port 8081
+"""
+from aiohttp import web
+import argparse
+import asyncio
+import json
+import time
+
+
+class FakeTelegram:
+    """Минимальный сервер Bot API: getMe, getUpdates, sendMessage, getFile, загрузка файлов
+    и служебные методы"""
+    def __init__(self, poll_timeout: float = 1.0, flood_every: int = 0, retry_after: int = 1,
+                 send_delay: float = 0, latency: float = 0, rejected_tokens=()):
+        self.poll_timeout = poll_timeout  # верхняя граница long-poll, чтобы бенчмарки не висели
+        self.flood_every = flood_every  # каждый N-й sendMessage отвечает 429
+        self.retry_after = retry_after
+        self.send_delay = send_delay  # задержка ответа sendMessage, как у настоящего Telegram
+        self.latency = latency  # задержка перед ответом на любой метод (сеть до Telegram)
+        self.rejected_tokens = set(rejected_tokens)  # токены, на которые Telegram отвечает 401
+        self.first_poll = {}  # token -> время первого getUpdates
+        self.calls = {}  # method -> количество вызовов
+        self.sent = []  # (token, chat_id, text, время отправки)
+        self.updates = {}  # token -> список ожидающих обновлений для getUpdates
+        self.update_events = {}  # token -> asyncio.Event о новых обновлениях
+        self.webhooks = {}  # token -> url
+        self.last_poll = {}  # token -> время последнего getUpdates
+        self.polling = {}  # token -> число незавершённых getUpdates
+        self.conflicts = 0  # одновременные getUpdates одного бота (в Telegram - ошибка 409)
+        self.files = {}  # file_id -> (file_unique_id, размер, байт-заполнитель содержимого)
+        self.downloads = 0  # отданных файлов
+        self.app = web.Application()
+        self.app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        self.app.router.add_get("/file/bot{token}/{path:.+}", self.download)
+        self.runner = None
+        self.url = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        # handler_cancellation: закрытое клиентом соединение завершает long-poll сразу
+        self.runner = web.AppRunner(self.app, access_log=None, handler_cancellation=True)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        data = dict(request.query)
+        data.update(await request.post())
+        return data
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.match_info["token"]
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        data = await self.params(request)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if token in self.rejected_tokens:
+            return web.json_response({"ok": False, "error_code": 401, "description": "Unauthorized"}, status=401)
+        if method == "sendMessage" and self.flood_every and self.calls[method] % self.flood_every == 0:
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        if method == "getUpdates" and self.polling.get(token):
+            self.conflicts += 1
+            return web.json_response({
+                "ok": False, "error_code": 409,
+                "description": "Conflict: terminated by other getUpdates request",
+            }, status=409)
+        handler = getattr(self, f"on_{method}", None)
+        if handler is None:
+            return web.json_response({"ok": True, "result": True})
+        return web.json_response({"ok": True, "result": await handler(token, data)})
+
+    async def on_getMe(self, token: str, data: dict):
+        bot_id = int(token.split(":")[0])
+        return {"id": bot_id, "is_bot": True, "first_name": f"Bot {bot_id}", "username": f"bot{bot_id}"}
+
+    def add_updates(self, token: str, updates: list):
+        """Обновления, которые бот получит через getUpdates"""
+        self.updates.setdefault(token, []).extend(updates)
+        self.update_events.setdefault(token, asyncio.Event()).set()
+
+    async def on_getUpdates(self, token: str, data: dict):
+        self.first_poll.setdefault(token, time.perf_counter())
+        self.last_poll[token] = time.perf_counter()
+        self.polling[token] = self.polling.get(token, 0) + 1
+        try:
+            return await self.wait_updates(token, data)
+        finally:
+            self.polling[token] -= 1
+
+    async def wait_updates(self, token: str, data: dict):
+        pending = self.updates.setdefault(token, [])
+        event = self.update_events.setdefault(token, asyncio.Event())
+        # offset подтверждает все обновления до него
+        offset = int(data.get("offset") or 0)
+        while pending and pending[0]["update_id"] < offset:
+            pending.pop(0)
+        if not pending:
+            event.clear()
+            try:
+                await asyncio.wait_for(event.wait(), min(float(data.get("timeout", 0)), self.poll_timeout))
+            except asyncio.TimeoutError:
+                return []
+        return pending[:int(data.get("limit") or 100)]
+
+    async def on_setWebhook(self, token: str, data: dict):
+        self.webhooks[token] = data.get("url")
+        return True
+
+    async def on_deleteWebhook(self, token: str, data: dict):
+        self.webhooks.pop(token, None)
+        return True
+
+    def add_file(self, file_id: str, file_unique_id: str, size: int, fill: int = 0):
+        """Файл для getFile; одинаковые fill и size - одинаковое содержимое"""
+        self.files[file_id] = (file_unique_id, size, fill)
+
+    async def on_getFile(self, token: str, data: dict):
+        file_unique_id, size, _ = self.files[data["file_id"]]
+        return {"file_id": data["file_id"], "file_unique_id": file_unique_id,
+                "file_size": size, "file_path": f"documents/{data['file_id']}"}
+
+    async def download(self, request: web.Request) -> web.StreamResponse:
+        """Содержимое файла потоком блоками, без буфера на весь файл"""
+        file_id = request.match_info["path"].rsplit("/", 1)[-1]
+        if file_id not in self.files:
+            return web.Response(status=404)
+        _, size, fill = self.files[file_id]
+        response = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+        response.content_length = size
+        await response.prepare(request)
+        block = bytes([fill]) * 65536
+        remaining = size
+        while remaining > 0:
+            await response.write(block[:remaining])
+            remaining -= len(block)
+        await response.write_eof()
+        self.downloads += 1
+        return response
+
+    async def on_sendMessage(self, token: str, data: dict):
+        chat_id = int(data["chat_id"])
+        self.sent.append((token, chat_id, data.get("text", ""), time.perf_counter()))
+        if self.send_delay:
+            await asyncio.sleep(self.send_delay)
+        return {
+            "message_id": len(self.sent),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": data.get("text", ""),
+        }
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    """Обновление с текстовым сообщением из личного чата"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"User {chat_id}"},
+            "text": text,
+        },
+    }
+
+
+def make_media_update(update_id: int, chat_id: int, file_id: str, file_unique_id: str,
+                      size: int, caption: str = None) -> dict:
+    """Обновление с документом из личного чата"""
+    update = make_update(update_id, chat_id, "")
+    message = update["message"]
+    del message["text"]
+    message["document"] = {
+        "file_id": file_id, "file_unique_id": file_unique_id, "file_size": size,
+        "file_name": f"{file_unique_id}.bin", "mime_type": "application/octet-stream",
+    }
+    if caption:
+        message["caption"] = caption
+    return update
+
+
+def make_token(bot_id: int) -> str:
+    """Токен в формате Telegram для фиктивного бота"""
+    return f"{bot_id}:AA{'x' * 33}"
+
+
+def print_result(result: dict, output: str = None):
+    """Результат бенчмарка одной строкой JSON; output - файл истории запусков (JSON Lines),
+    строка дописывается в конец"""
+    line = json.dumps(result, ensure_ascii=False)
+    print(line)
+    if output:
+        with open(output, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+def rss_mb() -> float:
+    """Текущий RSS процесса в мегабайтах"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def serve(port: int):
+    server = FakeTelegram()
+    print(f"Fake Telegram API: {await server.start(port=port)}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    asyncio.run(serve(parser.parse_args().port))
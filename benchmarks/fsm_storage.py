@@ -0,0 +1,144 @@
+"""Хранилище состояний FSM на БД (fsm_storage.DatabaseStorage) на 100 тысячах активных
+пользователей в сравнении с MemoryStorage aiogram: задержка операций, запись пачками,
+память процесса, загрузка после перезапуска и удаление устаревших состояний.
+
+Запуск из корня репозитория:
+    python -m benchmarks.fsm_storage --users 100000
+
+Пользователи обрабатываются параллельно (--concurrency), как обновления разных
+пользователей в поллинге: каждое обновление читает состояние, часть - меняет его.
+"""
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from tortoise import Tortoise
+from benchmarks.fake_telegram import print_result, rss_mb
+import argparse
+import asyncio
+import gc
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+BOT_ID = 123456789
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1e6
+
+
+async def run_workers(keys: list, concurrency: int, operation) -> list:
+    """operation(key) для всех ключей в concurrency задачах; задержки операций"""
+    latencies = []
+    position = iter(keys)
+
+    async def worker():
+        for key in position:
+            started = time.perf_counter()
+            await operation(key)
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+
+async def booking_step(storage, key):
+    """Шаг сценария записи: чтение состояния (как FSMContextMiddleware), смена состояния и данных"""
+    await storage.get_state(key)
+    await storage.set_state(key, "Booking:choose_time")
+    await storage.update_data(key, {"service": "consultation", "slot": f"2025-01-{key.user_id % 28 + 1:02d} 10:00"})
+
+
+async def measure_memory(storage, keys: list, concurrency: int) -> float:
+    """Прирост выделенной памяти на одно состояние, байт"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    await run_workers(keys, concurrency, lambda key: booking_step(storage, key))
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return (after - before) / len(keys)
+
+
+async def main(args):
+    from db import init_db, get_tortoise_config
+    from fsm_storage import DatabaseStorage
+
+    random.seed(args.seed)
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    await init_db(get_tortoise_config(db_path, args.readers, database_url=args.database_url))
+    keys = [StorageKey(bot_id=BOT_ID, chat_id=1_000_000 + i, user_id=1_000_000 + i) for i in range(args.users)]
+    result = {"benchmark": "fsm_storage", "users": args.users, "concurrency": args.concurrency}
+
+    # Память на состояние: MemoryStorage и кэш DatabaseStorage (с учётом очереди записи)
+    result["memory_storage_bytes_per_state"] = await measure_memory(MemoryStorage(), keys[:10000], args.concurrency)
+    memory_probe = DatabaseStorage(flush_interval=3600)
+    result["db_storage_bytes_per_state"] = await measure_memory(memory_probe, keys[:10000], args.concurrency)
+    memory_probe.dirty.clear()
+
+    # Первое обращение всех пользователей: промах кэша, загрузка пачками, изменение
+    storage = DatabaseStorage(flush_interval=args.flush_interval)
+    storage.start()
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    first = await run_workers(keys, args.concurrency, lambda key: booking_step(storage, key))
+    result["first_step_per_s"] = len(keys) / (time.perf_counter() - started)
+    result["first_step_p50_us"] = percentile(first, 0.5)
+    result["first_step_p99_us"] = percentile(first, 0.99)
+
+    # Остаток изменений - одной пачкой
+    dirty = len(storage.dirty)
+    started = time.perf_counter()
+    await storage.flush()
+    result["final_flush_states"] = dirty
+    result["final_flush_s"] = time.perf_counter() - started
+    result["background_flushed"] = storage.flushed - dirty
+    result["rss_growth_mb"] = rss_mb() - rss_before
+
+    # Повторные шаги: всё в памяти
+    sample = random.choices(keys, k=args.operations)
+    hot = await run_workers(sample, args.concurrency, lambda key: booking_step(storage, key))
+    result["hot_step_p50_us"] = percentile(hot, 0.5)
+    result["hot_step_p99_us"] = percentile(hot, 0.99)
+    reads = await run_workers(sample, args.concurrency, storage.get_state)
+    result["hot_get_state_p50_us"] = percentile(reads, 0.5)
+    memory = MemoryStorage()
+    await run_workers(keys, args.concurrency, lambda key: booking_step(memory, key))
+    reads = await run_workers(sample, args.concurrency, memory.get_state)
+    result["memory_storage_get_state_p50_us"] = percentile(reads, 0.5)
+    await storage.stop()
+
+    # Перезапуск: пустой кэш, состояния читаются из БД пачками
+    restarted = DatabaseStorage()
+    started = time.perf_counter()
+    cold = await run_workers(keys, args.concurrency, restarted.get_state)
+    result["restart_load_per_s"] = len(keys) / (time.perf_counter() - started)
+    result["restart_get_state_p99_us"] = percentile(cold, 0.99)
+    states = await asyncio.gather(*(restarted.get_state(key) for key in keys[:1000]))
+    data = await restarted.get_data(keys[0])
+    result["restored"] = all(state == "Booking:choose_time" for state in states) and data["service"] == "consultation"
+
+    # Удаление устаревших: срок в прошлом - устарели все
+    restarted.state_ttl_days = -1
+    started = time.perf_counter()
+    result["expired"] = await restarted.expire()
+    result["expire_s"] = time.perf_counter() - started
+
+    await Tortoise.close_connections()
+    result["rss_mb"] = rss_mb()
+    print_result(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--operations", type=int, default=100_000)
+    parser.add_argument("--flush-interval", type=float, default=1)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--database-url", default="", help="PostgreSQL вместо временной SQLite")
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
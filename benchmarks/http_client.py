@@ -0,0 +1,74 @@
+"""Задержка отправки сообщений: общий TelegramClient против новой ClientSession на каждый вызов.
+
+Запуск из корня репозитория:
+    python -m benchmarks.http_client --requests 2000 --concurrency 20 --mode shared
+    python -m benchmarks.http_client --requests 2000 --concurrency 20 --mode per-call
+
+Заглушка работает по HTTP, поэтому экономия здесь - только TCP-рукопожатие;
+с api.telegram.org добавляется ещё и TLS.
+"""
+from benchmarks.fake_telegram import FakeTelegram, make_token, print_result, rss_mb
+import aiohttp
+import argparse
+import asyncio
+import time
+
+
+async def main(args):
+    from telegram_client import TelegramClient
+
+    server = FakeTelegram(flood_every=args.flood_every, retry_after=0)
+    url = await server.start()
+    client = TelegramClient(api_url=url)
+    token = make_token(1)
+
+    async def send_shared(i):
+        return await client.call(token, "sendMessage", chat_id=i, text="hello")
+
+    async def send_per_call(i):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{url}/bot{token}/sendMessage",
+                                    json={"chat_id": i, "text": "hello"}) as response:
+                return await response.json()
+
+    send = send_shared if args.mode == "shared" else send_per_call
+    counter = iter(range(args.requests))
+    latencies = []
+    failed = 0
+
+    async def worker():
+        nonlocal failed
+        for i in counter:
+            started = time.perf_counter()
+            data = await send(i)
+            latencies.append(time.perf_counter() - started)
+            failed += not data.get("ok")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    await client.close()
+    await server.stop()
+
+    latencies.sort()
+    print_result({
+        "benchmark": "http_client",
+        "mode": args.mode,
+        "requests": args.requests,
+        "failed": failed,
+        "elapsed_s": elapsed,
+        "requests_per_s": args.requests / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "rss_mb": rss_mb(),
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--flood-every", type=int, default=0,
+                        help="каждый N-й ответ заглушки - 429 (проверка повторов)")
+    parser.add_argument("--mode", choices=["shared", "per-call"], default="shared")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,142 @@
+"""Нагрузочный тест отправки событий: N простаивающих SSE-подписчиков на одном воркере.
+
+Запуск из корня репозитория:
+    python -m benchmarks.hub --subscribers 1000 --events 20
+
+Сервер (uvicorn с тем же event_stream, что и в main.py) запускается отдельным процессом,
+чтобы его RSS измерялся без клиентов.
+"""
+from benchmarks.fake_telegram import print_result
+import aiohttp
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def create_app(heartbeat: float):
+    from fastapi import FastAPI
+    from fastapi.responses import StreamingResponse
+    from benchmarks.fake_telegram import rss_mb
+    from hub import hub, event_stream, bot_topic
+
+    app = FastAPI()
+
+    @app.get("/events")
+    async def events():
+        return StreamingResponse(event_stream(hub, bot_topic(1), heartbeat=heartbeat),
+                                 media_type="text/event-stream")
+
+    @app.post("/publish")
+    async def publish():
+        hub.publish(bot_topic(1), {"type": "message", "sent": time.time()})
+        return {"ok": True}
+
+    @app.get("/stats")
+    async def stats():
+        return {"subscribers": hub.subscribers_count(), "dropped": hub.dropped, "rss_mb": rss_mb()}
+
+    return app
+
+
+def serve(port: int, heartbeat: float):
+    import uvicorn
+    uvicorn.run(create_app(heartbeat), host="127.0.0.1", port=port, log_level="warning")
+
+
+async def main(args):
+    url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen([sys.executable, "-m", "benchmarks.hub", "--serve",
+                               "--port", str(args.port), "--heartbeat", str(args.heartbeat)],
+                              cwd=os.getcwd())
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0),
+                                    timeout=aiohttp.ClientTimeout(total=None))
+    latencies = []
+    received = 0
+    pings = 0
+
+    async def subscriber():
+        nonlocal received, pings
+        async with session.get(f"{url}/events") as response:
+            async for line in response.content:
+                if line.startswith(b"data: "):
+                    event = json.loads(line[6:])
+                    latencies.append(time.time() - event["sent"])
+                    received += 1
+                elif line.startswith(b": ping"):
+                    pings += 1
+
+    try:
+        for _ in range(100):
+            try:
+                async with session.get(f"{url}/stats") as response:
+                    idle = await response.json()
+                break
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.1)
+
+        started = time.perf_counter()
+        clients = [asyncio.create_task(subscriber()) for _ in range(args.subscribers)]
+        while True:
+            async with session.get(f"{url}/stats") as response:
+                stats = await response.json()
+            if stats["subscribers"] >= args.subscribers:
+                break
+            await asyncio.sleep(0.05)
+        connect_s = time.perf_counter() - started
+
+        # Простой: соединения держатся только на heartbeat
+        await asyncio.sleep(args.idle)
+        async with session.get(f"{url}/stats") as response:
+            loaded = await response.json()
+
+        for _ in range(args.events):
+            await session.post(f"{url}/publish")
+            await asyncio.sleep(args.interval)
+        await asyncio.sleep(1)
+
+        async with session.get(f"{url}/stats") as response:
+            final = await response.json()
+        for client in clients:
+            client.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+    finally:
+        await session.close()
+        server.terminate()
+        server.wait()
+
+    latencies.sort()
+    print_result({
+        "benchmark": "hub",
+        "subscribers": args.subscribers,
+        "connect_s": connect_s,
+        "server_rss_idle_mb": idle["rss_mb"],
+        "server_rss_subscribed_mb": loaded["rss_mb"],
+        "kb_per_subscriber": (loaded["rss_mb"] - idle["rss_mb"]) * 1024 / args.subscribers,
+        "events": args.events,
+        "delivered": received,
+        "expected": args.events * args.subscribers,
+        "fanout_p50_ms": latencies[len(latencies) // 2] * 1000 if latencies else None,
+        "fanout_p99_ms": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else None,
+        "heartbeats": pings,
+        "dropped": final["dropped"],
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--subscribers", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--idle", type=float, default=5, help="секунд простоя перед рассылкой")
+    parser.add_argument("--heartbeat", type=float, default=2)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.port, args.heartbeat)
+    else:
+        asyncio.run(main(args))
@@ -0,0 +1,96 @@
+"""Пропускная способность записи входящих сообщений: пачками (MessageIngestor) против
+старого пути с отдельными запросами на каждое сообщение.
+
+Запуск из корня репозитория:
+    python -m benchmarks.ingest --messages 5000 --chats 100 --mode batched
+    python -m benchmarks.ingest --messages 5000 --chats 100 --mode direct
+"""
+from tortoise import Tortoise
+from benchmarks.fake_telegram import print_result, rss_mb
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+
+async def direct_path(bot_id: int, chat_id: int, text: str):
+    """Старый handle_message: четыре обращения к БД на сообщение"""
+    from models import Message, Chat, Bot as BotModel
+
+    bot = await BotModel.get(id=bot_id)
+    await Message.create(chat_id=chat_id, text=text, direction='incoming', bot=bot)
+    chat, created = await Chat.get_or_create(
+        id=chat_id, bot=bot,
+        defaults={'title': f"User #{chat_id}", 'last_message': text, 'unread': 1}
+    )
+    if not created:
+        chat.unread += 1
+        chat.last_message = text
+        await chat.save()
+
+
+async def main(args):
+    from models import Message, Chat, Bot as BotModel
+    from ingest import MessageIngestor, IncomingMessage
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    await Tortoise.init(db_url=f"sqlite://{db_path}", modules={"models": ["models"]})
+    await Tortoise.generate_schemas()
+    bot = await BotModel.create(token="1:bench", name="bench", bot_type="shop")
+
+    ingestor = MessageIngestor(batch_size=args.batch_size, flush_interval=args.interval)
+    if args.mode == "batched":
+        ingestor.start()
+
+    counter = iter(range(args.messages))
+    latencies = []
+
+    async def producer():
+        # Как в handle_message: каждое обновление ждёт только своей записи/постановки в очередь
+        for i in counter:
+            chat_id = 1000 + i % args.chats
+            started = time.perf_counter()
+            if args.mode == "batched":
+                await ingestor.put(IncomingMessage(bot.id, chat_id, f"User #{chat_id}", f"message {i}"))
+            else:
+                await direct_path(bot.id, chat_id, f"message {i}")
+            latencies.append(time.perf_counter() - started)
+            # Обновления приходят из сети - отдаём управление циклу событий
+            await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(producer() for _ in range(args.concurrency)))
+    if args.mode == "batched":
+        await ingestor.stop()
+    elapsed = time.perf_counter() - started
+
+    saved = await Message.all().count()
+    unread = sum(await Chat.all().values_list("unread", flat=True))
+    await Tortoise.close_connections()
+
+    latencies.sort()
+    print_result({
+        "benchmark": "ingest",
+        "mode": args.mode,
+        "messages": args.messages,
+        "saved": saved,
+        "unread_total": unread,
+        "elapsed_s": elapsed,
+        "msgs_per_s": args.messages / elapsed,
+        "handler_p50_ms": latencies[len(latencies) // 2] * 1000,
+        "handler_p99_ms": latencies[int(len(latencies) * 0.99)] * 1000,
+        "batches": ingestor.batches,
+        "rss_mb": rss_mb(),
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--mode", choices=["batched", "direct"], default="batched")
+    asyncio.run(main(parser.parse_args()))
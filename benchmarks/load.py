@@ -0,0 +1,304 @@
+"""Нагрузочный тест всего приложения: N ботов получают обновления от локальной заглушки
+Telegram с заданной частотой, а операторы одновременно работают в веб-интерфейсе.
+
+Запуск из корня репозитория:
+    python -m benchmarks.load --bots 20 --rate 20 --operators 10 --seconds 30
+    python -m benchmarks.load --output load.jsonl --baseline load.jsonl
+
+Приложение (main.app) работает в этом же процессе под uvicorn, как в продакшене:
+поллинг getUpdates, BaseBot.handle_message, запись пачками, outbox и sendMessage идут
+через заглушку по HTTP, операторы - отдельные HTTP-клиенты со своей сессией. Измеряются:
+- обновление: от появления в getUpdates до записи в БД (событие в hub, как у SSE);
+- веб-интерфейс: задержка по маршрутам (список чатов, чат - get_chat, история, отправка -
+  send_message, список ботов) и ошибки;
+- отправка оператором: от POST /chat/{id} до sendMessage в заглушке;
+- ожидание соединений SQLite (db_lock_wait_seconds), RSS процесса.
+
+Результат - одна строка JSON с хэшем коммита. --output дописывает её в файл истории,
+--baseline сравнивает с последним запуском с теми же параметрами из такого файла.
+"""
+from tortoise import Tortoise
+from tortoise.transactions import in_transaction
+from benchmarks.fake_telegram import FakeTelegram, make_token, make_update, print_result, rss_mb
+import aiohttp
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import tempfile
+import time
+
+CHAT_INSERT_SQL = (
+    'INSERT INTO "chats" ("id", "title", "last_message", "unread", "updated", "bot_id") '
+    'VALUES (?, ?, ?, ?, ?, ?)'
+)
+
+# Действия оператора и их относительная частота
+ACTIONS = {"chats": 4, "chat": 3, "history": 2, "send": 1, "admin_bots": 1}
+# Параметры, при совпадении которых запуски сравнимы
+PARAMETERS = ("bots", "rate", "operators", "chats", "seconds", "think", "readers")
+# Метрики для сравнения с предыдущим запуском
+TRACKED = (
+    "updates_per_s", "update_p50_ms", "update_p99_ms", "http_requests_per_s", "http_p50_ms",
+    "http_p99_ms", "send_p99_ms", "db_lock_wait_write_s", "db_lock_wait_read_s", "rss_peak_mb",
+)
+
+
+def chat_id(bot_index: int, number: int) -> int:
+    """id чатов у ботов не пересекаются: первичный ключ чата - только id"""
+    return (bot_index + 1) * 1_000_000 + number
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+def histogram_quantile(histogram, labels: tuple, q: float) -> float:
+    """Верхняя граница корзины гистограммы metrics.Histogram, в которую попадает квантиль"""
+    series = histogram.values.get(labels)
+    if not series or not sum(series[:-1]):
+        return 0.0
+    rank = q * sum(series[:-1])
+    total = 0
+    for bound, count in zip(histogram.buckets + (math.inf,), series):
+        total += count
+        if total >= rank:
+            return bound
+    return math.inf
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(result: dict, path: str):
+    """Изменение отслеживаемых метрик в процентах к последнему сравнимому запуску"""
+    previous = None
+    try:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                run = json.loads(line)
+                if run.get("benchmark") == result["benchmark"] and all(
+                    run.get(name) == result[name] for name in PARAMETERS
+                ):
+                    previous = run
+    except FileNotFoundError:
+        return
+    if previous is None:
+        return
+    result["baseline_commit"] = previous.get("commit")
+    result["change_pct"] = {
+        name: round((result[name] - previous[name]) / previous[name] * 100, 1)
+        for name in TRACKED
+        if result.get(name) is not None and previous.get(name)
+    }
+
+
+async def inject(server: FakeTelegram, token: str, bot_index: int, args, deadline: float, injected: dict):
+    """Обновления бота с частотой args.rate в секунду: отдаются следующим getUpdates"""
+    started = time.perf_counter()
+    sent = 0
+    while time.perf_counter() < deadline:
+        due = int((time.perf_counter() - started) * args.rate) - sent
+        if due > 0:
+            batch = []
+            for _ in range(due):
+                sent += 1
+                text = f"m{bot_index}-{sent}"
+                batch.append(make_update(sent, chat_id(bot_index, random.randrange(args.chats)), text))
+                injected[text] = time.perf_counter()
+            server.add_updates(token, batch)
+        await asyncio.sleep(0.01)
+
+
+async def consume(subscription, injected: dict, latencies: list):
+    """Входящие сообщения, записанные в БД: ingestor публикует их после транзакции"""
+    while True:
+        event = json.loads(await subscription.queue.get())
+        if event["direction"] == "incoming":
+            started = injected.pop(event["text"], None)
+            if started is not None:
+                latencies.append(time.perf_counter() - started)
+
+
+async def operator(url: str, bot_id: int, bot_index: int, args, deadline: float,
+                   latencies: dict, errors: dict, posted: dict):
+    """Оператор со своей сессией ходит по страницам бота, как браузер (с If-None-Match)"""
+    async with aiohttp.ClientSession(base_url=url, cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
+        async with session.post("/login", data={"bot_id": str(bot_id)}, allow_redirects=False) as response:
+            assert response.status == 303, response.status
+        etags = {}
+        sent = 0
+        actions, weights = list(ACTIONS), list(ACTIONS.values())
+        while time.perf_counter() < deadline:
+            action = random.choices(actions, weights)[0]
+            chat = chat_id(bot_index, random.randrange(args.chats))
+            started = time.perf_counter()
+            if action == "send":
+                sent += 1
+                text = f"reply {bot_id}-{sent}"
+                posted[text] = started
+                request = session.post(f"/chat/{chat}", data={"text": text}, allow_redirects=False)
+            else:
+                path = {
+                    "chats": "/chats",
+                    "chat": f"/chat/{chat}",
+                    "history": f"/api/chat/{chat}/messages",
+                    "admin_bots": "/admin/bots",
+                }[action]
+                headers = {"If-None-Match": etags[path]} if path in etags else {}
+                request = session.get(path, headers=headers, allow_redirects=False)
+            async with request as response:
+                await response.read()
+                if "ETag" in response.headers:
+                    etags[path] = response.headers["ETag"]
+            latencies.setdefault(action, []).append(time.perf_counter() - started)
+            if response.status >= 400:
+                errors[action] = errors.get(action, 0) + 1
+            await asyncio.sleep(random.expovariate(1 / args.think) if args.think else 0)
+
+
+async def sample_rss(samples: list):
+    while True:
+        samples.append(rss_mb())
+        await asyncio.sleep(0.5)
+
+
+async def wait_for(condition, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while not condition() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+
+
+async def main(args):
+    server = FakeTelegram()
+    os.environ["TELEGRAM_API_URL"] = await server.start()
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    os.environ["DB_READERS"] = str(args.readers)
+    os.environ["BOT_MODE"] = "polling"
+    os.environ["BOT_SHARDING"] = "0"
+
+    import uvicorn
+    from db import TORTOISE_CONFIG, WRITE_CONNECTION, init_db
+    from models import Bot as BotModel
+    from hub import hub, bot_topic
+    from metrics import DB_LOCK_WAIT_SECONDS
+    import main as app_module
+
+    logging.getLogger().setLevel(logging.WARNING)
+    random.seed(args.seed)
+
+    # Боты и их чаты - до запуска приложения: при старте оно запускает всех активных ботов
+    await init_db(TORTOISE_CONFIG)
+    bots = [await BotModel.create(token=make_token(300000 + i), name=f"bench {i}", bot_type="shop")
+            for i in range(args.bots)]
+    async with in_transaction(WRITE_CONNECTION) as conn:
+        for index, bot in enumerate(bots):
+            await conn.execute_many(CHAT_INSERT_SQL, [
+                [chat_id(index, i), f"chat {i}", "hello", 0, "2025-01-01 00:00:00+00:00", bot.id]
+                for i in range(args.chats)
+            ])
+    await Tortoise.close_connections()
+
+    uvicorn_server = uvicorn.Server(uvicorn.Config(app_module.app, host="127.0.0.1", port=0,
+                                                   log_level="warning", lifespan="on"))
+    serving = asyncio.create_task(uvicorn_server.serve())
+    await wait_for(lambda: uvicorn_server.started, 30)
+    port = uvicorn_server.servers[0].sockets[0].getsockname()[1]
+    url = f"http://127.0.0.1:{port}"
+    await wait_for(lambda: len(server.first_poll) >= args.bots, 60)
+    online = len(server.first_poll)
+
+    # Подписчики получают все события без ограничения очереди: пачка записи публикуется разом
+    hub.queue_size = 1_000_000
+    injected, update_latencies = {}, []
+    consumers = [asyncio.create_task(consume(hub.subscribe(bot_topic(bot.id)), injected, update_latencies))
+                 for bot in bots]
+    rss_samples = []
+    sampler = asyncio.create_task(sample_rss(rss_samples))
+    DB_LOCK_WAIT_SECONDS.clear()
+    sent_before = len(server.sent)
+
+    http_latencies, errors, posted = {}, {}, {}
+    started = time.perf_counter()
+    deadline = started + args.seconds
+    await asyncio.gather(
+        *(inject(server, bot.token, index, args, deadline, injected) for index, bot in enumerate(bots)),
+        *(operator(url, bots[i % len(bots)].id, i % len(bots), args, deadline, http_latencies, errors, posted)
+          for i in range(args.operators)),
+    )
+    elapsed = time.perf_counter() - started
+    # Досчитываем то, что уже в пути: обновления в очереди записи, сообщения в outbox
+    await wait_for(lambda: not injected, 30)
+    await wait_for(lambda: len(server.sent) - sent_before >= len(posted), 30)
+    sampler.cancel()
+    for consumer in consumers:
+        consumer.cancel()
+
+    send_latencies = [at - posted[text] for _, _, text, at in server.sent[sent_before:] if text in posted]
+    everything = [value for values in http_latencies.values() for value in values]
+    injected_total = len(update_latencies) + len(injected)
+    result = {
+        "benchmark": "load",
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "bots": args.bots, "rate": args.rate, "operators": args.operators, "chats": args.chats,
+        "seconds": args.seconds, "think": args.think, "readers": args.readers,
+        "bots_online": online,
+        "updates_injected": injected_total,
+        "updates_stored": len(update_latencies),
+        "updates_per_s": len(update_latencies) / elapsed,
+        "update_p50_ms": percentile(update_latencies, 0.5),
+        "update_p99_ms": percentile(update_latencies, 0.99),
+        "http_requests": len(everything),
+        "http_requests_per_s": len(everything) / elapsed,
+        "http_p50_ms": percentile(everything, 0.5),
+        "http_p99_ms": percentile(everything, 0.99),
+        "http_errors": sum(errors.values()),
+        "sent": len(send_latencies),
+        "send_p50_ms": percentile(send_latencies, 0.5),
+        "send_p99_ms": percentile(send_latencies, 0.99),
+    }
+    for action, values in sorted(http_latencies.items()):
+        result[f"{action}_p50_ms"] = percentile(values, 0.5)
+        result[f"{action}_p99_ms"] = percentile(values, 0.99)
+    for role in ("write", "read"):
+        series = DB_LOCK_WAIT_SECONDS.values.get((role,))
+        result[f"db_lock_waits_{role}"] = sum(series[:-1]) if series else 0
+        result[f"db_lock_wait_{role}_s"] = series[-1] if series else 0.0
+        result[f"db_lock_wait_{role}_p99_ms_le"] = histogram_quantile(DB_LOCK_WAIT_SECONDS, (role,), 0.99) * 1000
+    result["rss_peak_mb"] = max(rss_samples)
+    result["rss_mb"] = rss_mb()
+
+    uvicorn_server.should_exit = True
+    await serving
+    await server.stop()
+    if args.baseline:
+        compare(result, args.baseline)
+    print_result(result, args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bots", type=int, default=20)
+    parser.add_argument("--rate", type=float, default=20, help="обновлений в секунду на бота")
+    parser.add_argument("--operators", type=int, default=10)
+    parser.add_argument("--chats", type=int, default=200, help="чатов у бота")
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--think", type=float, default=0.2, help="средняя пауза оператора между действиями, с")
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="файл истории запусков (JSON Lines), результат дописывается")
+    parser.add_argument("--baseline", help="файл истории для сравнения с последним таким же запуском")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,194 @@
+"""Загрузка файлов сообщений: скорость, занятость цикла событий и память при скачивании,
+дедупликация одинаковых файлов и отдача диапазонов (Range) из хранилища.
+
+Запуск из корня репозитория:
+    python -m benchmarks.media --files 100 --size 8 --duplicates 0.3
+    python -m benchmarks.media --files 100 --size 8 --mode buffered
+
+Сообщения с документами идут через ingestor (как из BaseBot.handle_message), файлы
+отдаёт локальная заглушка Telegram. streaming - MediaDownloader: файл читается блоками
+и пишется в хранилище в потоке; buffered - файл целиком в памяти, как bot.download()
+aiogram в BytesIO. --duplicates - доля сообщений с уже присланным файлом (тот же
+file_unique_id) и с тем же содержимым под другим file_unique_id. Затем из хранилища
+читаются случайные диапазоны по 64 КБ через media_response под uvicorn.
+"""
+from tortoise import Tortoise
+from benchmarks.fake_telegram import FakeTelegram, make_token, print_result, rss_mb
+from benchmarks.bot_startup import measure_lag
+import aiohttp
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+async def sample_rss(samples: list, interval: float = 0.05):
+    while True:
+        samples.append(rss_mb())
+        await asyncio.sleep(interval)
+
+
+async def wait_done(total: int, timeout: float = 300) -> int:
+    from models import Media
+
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        pending = await Media.filter(status="pending").count()
+        if not pending and await Media.all().count() >= total:
+            return 0
+        await asyncio.sleep(0.02)
+    return pending
+
+
+async def measure_ranges(store, requests: int) -> dict:
+    """Случайные диапазоны по 64 КБ из файлов хранилища через media_response"""
+    from fastapi import FastAPI, Request
+    from models import Media
+    from media import media_response
+    import uvicorn
+
+    app = FastAPI()
+
+    @app.get("/media/{media_id}")
+    async def get_media(request: Request, media_id: int):
+        return await media_response(request, await Media.get(id=media_id), store)
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning", lifespan="off"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    media = await Media.filter(status="stored").values("id", "size")
+    latencies = []
+    async with aiohttp.ClientSession() as session:
+        for _ in range(requests):
+            item = random.choice(media)
+            start = random.randrange(max(1, item["size"] - 65536))
+            started = time.perf_counter()
+            async with session.get(f"http://127.0.0.1:{port}/media/{item['id']}",
+                                   headers={"Range": f"bytes={start}-{start + 65535}"}) as response:
+                body = await response.read()
+            latencies.append(time.perf_counter() - started)
+            assert response.status == 206 and len(body) == min(65536, item["size"] - start), response.status
+    server.should_exit = True
+    await task
+    return {"range_p50_ms": percentile(latencies, 0.5), "range_p99_ms": percentile(latencies, 0.99)}
+
+
+async def main(args):
+    server = FakeTelegram()
+    os.environ["TELEGRAM_API_URL"] = await server.start()
+    from db import init_db, get_tortoise_config
+    from models import Bot as BotModel
+    from ingest import MessageIngestor, IncomingMessage
+    from media import MediaInfo, MediaStore, MediaDownloader
+    import ingest
+    from telegram_client import telegram_client
+
+    directory = tempfile.mkdtemp()
+    await init_db(get_tortoise_config(os.path.join(directory, "bench.sqlite3"), 1, database_url=""))
+    token = make_token(100001)
+    bot = await BotModel.create(token=token, name="bench", bot_type="shop")
+
+    store = MediaStore(os.path.join(directory, "media"))
+    downloader = MediaDownloader(store, workers=args.workers)
+    if args.mode == "buffered":
+        downloader.fetch = buffered_fetch(downloader)
+    ingest.media_downloader = downloader
+    ingestor = MessageIngestor()
+
+    size = args.size * 1024 * 1024
+    random.seed(1)
+    messages = []
+    for i in range(args.files):
+        if i and random.random() < args.duplicates:
+            # Повтор: тот же файл переслан ещё раз или то же содержимое под другим id
+            j = random.randrange(i)
+            unique_id = f"u{j}" if random.random() < 0.5 else f"u{i}"
+            fill = j % 256
+        else:
+            unique_id, fill = f"u{i}", i % 256
+        file_id = f"f{i}"
+        server.add_file(file_id, unique_id, size, fill)
+        messages.append(IncomingMessage(
+            bot_id=bot.id, chat_id=1000 + i % 10, chat_title="bench", text="",
+            media=MediaInfo("document", file_id, unique_id, "application/octet-stream", f"{unique_id}.bin", size)
+        ))
+
+    baseline = rss_mb()
+    lags, rss = [], []
+    probes = [asyncio.create_task(measure_lag(lags)), asyncio.create_task(sample_rss(rss))]
+    ingestor.start()
+    downloader.start()
+    started = time.perf_counter()
+    for message in messages:
+        await ingestor.put(message)
+    pending = await wait_done(len({message.media.file_unique_id for message in messages}))
+    elapsed = time.perf_counter() - started
+    for probe in probes:
+        probe.cancel()
+    await ingestor.stop()
+    await downloader.stop()
+
+    stats = downloader.stats()
+    stored_bytes = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(store.root) for name in names
+    )
+    result = {
+        "benchmark": "media", "mode": args.mode, "files": args.files, "size_mb": args.size,
+        "duplicates": args.duplicates, "workers": args.workers,
+        "seconds": elapsed, "throughput_mb_s": stats["bytes"] / 1024 / 1024 / elapsed,
+        "downloaded": stats["downloaded"], "deduplicated": stats["deduplicated"],
+        "failed": stats["failed"], "pending": pending, "telegram_downloads": server.downloads,
+        "stored_mb": stored_bytes / 1024 / 1024,
+        "max_loop_lag_ms": max(lags, default=0) * 1000,
+        "p99_loop_lag_ms": percentile(lags, 0.99),
+        "rss_baseline_mb": baseline, "rss_peak_mb": max(rss, default=baseline),
+    }
+    result.update(await measure_ranges(store, args.ranges))
+    await telegram_client.close()
+    await server.stop()
+    await Tortoise.close_connections()
+    print_result(result)
+
+
+def buffered_fetch(downloader):
+    """Прежний способ: файл целиком в памяти, затем запись"""
+    from telegram_client import telegram_client
+
+    async def fetch(token, media):
+        data = await telegram_client.call(token, "getFile", file_id=media.file_id)
+        session = await telegram_client.get_session()
+        url = f"{telegram_client.api_url}/file/bot{token}/{data['result']['file_path']}"
+        async with session.get(url, timeout=aiohttp.ClientTimeout(total=None)) as response:
+            body = await response.read()
+
+        async def single():
+            yield body
+        return await downloader.store.save(single(), downloader.max_size)
+    return fetch
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=100)
+    parser.add_argument("--size", type=int, default=8, help="размер файла, МБ")
+    parser.add_argument("--duplicates", type=float, default=0.3, help="доля повторных файлов")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--mode", choices=["streaming", "buffered"], default="streaming")
+    parser.add_argument("--ranges", type=int, default=500, help="запросов диапазонов")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(args))
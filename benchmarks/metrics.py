@@ -0,0 +1,146 @@
+"""Стоимость инструментирования горячего пути: обработка обновления ботом (dispatcher,
+handle_message, постановка в очередь записи) с метриками и без, и с прежним логом
+INFO на каждое сообщение.
+
+Запуск из корня репозитория:
+    python -m benchmarks.metrics --updates 50000
+
+Режимы: bare - Dispatcher aiogram без счётчика и без лога, metrics - как в приложении
+(счётчик, время последнего обновления, лог с выборкой LOG_SAMPLE_RATE), info_log - лог
+каждого сообщения, как было раньше. Лог пишется в /dev/null, чтобы мерить форматирование
+и обработчики, а не терминал. Режимы чередуются по раундам, берётся лучший раунд.
+
+Разница режимов на общей машине тонет в шуме (несколько процентов), поэтому
+instrumentation_pct считается напрямую: стоимость вызовов инструментирования
+на одно обновление, делённая на время обработки обновления.
+"""
+from benchmarks.fake_telegram import make_token, make_update, print_result
+import argparse
+import asyncio
+import functools
+import logging
+import math
+import os
+import tempfile
+import time
+
+
+def per_call_ns(function, repeat: int = 100_000, rounds: int = 5) -> float:
+    """Лучшее из rounds измерений, за вычетом стоимости пустого вызова"""
+    best = math.inf
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            function()
+        best = min(best, time.perf_counter() - started)
+    if function is not empty:
+        best -= per_call_ns(empty, repeat, rounds) * repeat / 1e9
+    return best / repeat * 1e9
+
+
+def empty():
+    pass
+
+
+async def main(args):
+    from aiogram.types import Update
+    import bot as bot_module
+    from aiogram import Dispatcher
+    from tortoise import Tortoise
+    from db import init_db, get_tortoise_config
+    from bot import BaseBot
+    from ingest import MessageIngestor
+    from config import LOG_SAMPLE_RATE
+    from metrics import Counter, DB_QUERY_SECONDS, log_event, sampled
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler(open("/dev/null", "w"))]
+    )
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    # Состояния FSM читаются на каждое обновление: после первого раунда - из памяти
+    await init_db(get_tortoise_config(os.path.join(tempfile.mkdtemp(), "bench.sqlite3"), 1, database_url=""))
+    # Очередь без ограничения и без записи в БД: меряем только обработку обновления
+    bot_module.ingestor = MessageIngestor(max_queue=0)
+    bot = BaseBot(make_token(1), 1)
+    # Как в feed_raw_update (вебхук) и при поллинге: разбор JSON-обновления входит в обработку
+    updates = [make_update(i, 1000 + i % 100, f"message {i}") for i in range(args.updates)]
+    counting_feed = bot.dp.feed_update
+    plain_feed = functools.partial(Dispatcher.feed_update, bot.dp)
+
+    def info_log(event, **fields):
+        text = "x" * 40
+        logging.info(f"Received message from chat {fields['chat_id']}: {text[:100]}{'...' if len(text) > 100 else ''}")
+
+    # Режим: (feed_update, sampled, log_event)
+    modes = {
+        "bare": (plain_feed, lambda rate: False, log_event),
+        "metrics": (counting_feed, sampled, log_event),
+        "info_log": (plain_feed, lambda rate: True, info_log),
+    }
+    timings = {mode: [] for mode in modes}
+    for _ in range(args.rounds):
+        for mode, (feed_update, sample, log) in modes.items():
+            bot_module.sampled, bot_module.log_event = sample, log
+            started = time.perf_counter()
+            for update in updates:
+                await feed_update(bot.bot, Update.model_validate(update, context={"bot": bot.bot}))
+            timings[mode].append((time.perf_counter() - started) / len(updates))
+            bot_module.ingestor.queue = asyncio.Queue()
+    per_update = {mode: min(values) for mode, values in timings.items()}
+    await bot.bot.session.close()
+    await Tortoise.close_connections()
+
+    dispatcher = bot.dp
+
+    def instrumentation():
+        # То же, что добавлено на пути обновления: BotDispatcher.feed_update и выборка лога
+        dispatcher.updates += 1
+        dispatcher.last_update = time.monotonic()
+        if sampled(LOG_SAMPLE_RATE):
+            log_event("message_received", LOG_SAMPLE_RATE, bot_id=1, chat_id=1000, length=10)
+
+    # Лишний кадр корутины от переопределённого feed_update
+    async def base():
+        pass
+
+    async def wrapped():
+        return await base()
+
+    def drive(coroutine_function):
+        def run():
+            try:
+                coroutine_function().send(None)
+            except StopIteration:
+                pass
+        return run
+
+    frame_ns = per_call_ns(drive(wrapped)) - per_call_ns(drive(base))
+    instrumentation_ns = per_call_ns(instrumentation) + frame_ns
+    counter = Counter("bench_total", "", ("bot_id",))
+
+    print_result({
+        "benchmark": "metrics",
+        "updates": args.updates,
+        "rounds": args.rounds,
+        "update_bare_us": per_update["bare"] * 1e6,
+        "update_metrics_us": per_update["metrics"] * 1e6,
+        "update_info_log_us": per_update["info_log"] * 1e6,
+        "metrics_overhead_pct": (per_update["metrics"] / per_update["bare"] - 1) * 100,
+        "info_log_overhead_pct": (per_update["info_log"] / per_update["bare"] - 1) * 100,
+        "instrumentation_ns": instrumentation_ns,
+        "instrumentation_pct": instrumentation_ns / (per_update["bare"] * 1e9) * 100,
+        "counter_inc_ns": per_call_ns(lambda: counter.inc(1)),
+        "histogram_observe_ns": per_call_ns(lambda: DB_QUERY_SECONDS.observe(0.003, "bench")),
+        "timer_block_ns": per_call_ns(lambda: DB_QUERY_SECONDS.time("bench").__enter__().__exit__()),
+        "sampled_ns": per_call_ns(lambda: sampled(LOG_SAMPLE_RATE)),
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=50000)
+    parser.add_argument("--rounds", type=int, default=5)
+    asyncio.run(main(parser.parse_args()))
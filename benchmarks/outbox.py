@@ -0,0 +1,128 @@
+"""Очередь исходящих: скорость рассылки при лимитах Telegram, соблюдение лимитов на бота
+и на чат, повторы после 429 и время ответа веб-запроса на отправку.
+
+Запуск из корня репозитория:
+    python -m benchmarks.outbox --bots 5 --chats 300 --flood-every 100
+
+Заглушка Telegram отвечает 429 на каждый N-й sendMessage; после рассылки проверяется,
+что все сообщения доставлены ровно по одному разу, и по времени их прихода на заглушку
+считается максимум сообщений бота за любую секунду и минимальный интервал в одном чате.
+"""
+from tortoise import Tortoise
+from benchmarks.fake_telegram import FakeTelegram, make_token, print_result, rss_mb
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+
+async def timed(coro) -> float:
+    started = time.perf_counter()
+    await coro
+    return time.perf_counter() - started
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+def max_per_second(times: list) -> int:
+    """Наибольшее число событий в любом окне длиной в секунду"""
+    times = sorted(times)
+    best, start = 0, 0
+    for end, moment in enumerate(times):
+        while moment - times[start] >= 1.0:
+            start += 1
+        best = max(best, end - start + 1)
+    return best
+
+
+async def main(args):
+    server = FakeTelegram(retry_after=1, send_delay=args.latency)
+    os.environ["TELEGRAM_API_URL"] = await server.start()
+
+    from db import init_db, get_tortoise_config
+    from models import Bot as BotModel, Message
+    from outbox import outbox, QUEUED
+    from telegram_client import telegram_client
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    await init_db(get_tortoise_config(db_path, 2, database_url=""))
+    bots = [await BotModel.create(token=make_token(300000 + i), name=f"bench {i}", bot_type="custom")
+            for i in range(args.bots)]
+    outbox.start()
+
+    # Время ответа веб-запроса: раньше он ждал sendMessage, теперь только запись в очередь
+    bot = bots[0]
+    direct = [await timed(telegram_client.call(bot.token, "sendMessage", chat_id=1, text="direct"))
+              for _ in range(args.requests)]
+    queued = [await timed(outbox.enqueue(bot.id, 1000 + i, "queued")) for i in range(args.requests)]
+    while await Message.filter(status=QUEUED).exists():
+        await asyncio.sleep(0.05)
+
+    # Рассылка каждым ботом во все чаты плюс серия сообщений в один чат
+    server.flood_every = args.flood_every
+    mark = len(server.sent)
+    calls_before = server.calls.get("sendMessage", 0)
+    chat_ids = list(range(1, args.chats + 1))
+    started = time.perf_counter()
+    for bot in bots:
+        await outbox.broadcast(bot.id, "broadcast", chat_ids)
+    for i in range(args.burst):
+        await outbox.enqueue(bots[0].id, 1, f"burst {i}")
+    total = args.bots * args.chats + args.burst
+    deadline = started + args.timeout
+    while await Message.filter(status=QUEUED).exists() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    delivered = await Message.filter(status="sent", text__in=["broadcast", *(f"burst {i}" for i in range(args.burst))]).count()
+
+    sent = server.sent[mark:]
+    per_bot, per_chat, broadcast = {}, {}, {}
+    for token, chat_id, text, moment in sent:
+        per_bot.setdefault(token, []).append(moment)
+        per_chat.setdefault((token, chat_id), []).append(moment)
+        if text == "broadcast":
+            broadcast.setdefault(token, []).append(moment)
+    gaps = [b - a for times in per_chat.values() for a, b in zip(times, times[1:])]
+
+    result = {
+        "benchmark": "outbox",
+        "bots": args.bots,
+        "messages": total,
+        "delivered": delivered,
+        "duplicates": len(sent) - len({(token, chat_id, text) for token, chat_id, text, _ in sent}),
+        "flood_429": server.calls.get("sendMessage", 0) - calls_before - len(sent),
+        "elapsed_s": elapsed,
+        "msgs_per_s": len(sent) / elapsed,
+        # Темп рассылки бота между её первой и последней отправкой
+        "per_bot_msgs_per_s": min((len(times) - 1) / (max(times) - min(times)) for times in broadcast.values()),
+        "max_bot_msgs_in_1s": max(max_per_second(times) for times in per_bot.values()),
+        "min_chat_interval_s": min(gaps) if gaps else None,
+        "send_request_direct_p50_ms": percentile(direct, 0.5),
+        "send_request_queued_p50_ms": percentile(queued, 0.5),
+        "send_request_queued_p99_ms": percentile(queued, 0.99),
+        "rss_mb": rss_mb(),
+    }
+    await outbox.stop()
+    await telegram_client.close()
+    await Tortoise.close_connections()
+    await server.stop()
+    print_result(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bots", type=int, default=5)
+    parser.add_argument("--chats", type=int, default=300)
+    parser.add_argument("--burst", type=int, default=5, help="сообщений подряд в один чат")
+    parser.add_argument("--flood-every", type=int, default=100, help="каждый N-й sendMessage - 429")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа sendMessage, с")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--timeout", type=float, default=300)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(args))
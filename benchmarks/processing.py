@@ -0,0 +1,163 @@
+"""Обработка тяжёлых для CPU заданий: пропускная способность, задержка результата
+и занятость цикла событий под нагрузкой.
+
+Запуск из корня репозитория:
+    python -m benchmarks.processing --mode engine --workers 2 --work-ms 20
+    python -m benchmarks.processing --mode executor --workers 2 --work-ms 20
+    python -m benchmarks.processing --mode inline --work-ms 20
+
+Процессор-заглушка burn тратит --work-ms процессорного времени на задание (sha256 по
+кругу) плюс --batch-overhead-ms на пачку (загрузка модели, подготовка). Один бот разом
+присылает --flood заданий в несколько чатов, остальные --bots ботов - по заданию в чат
+с частотой --rate в секунду. inline - обработка прямо в обработчике сообщения, как сейчас
+в TranscriptionBot; executor - ProcessPoolExecutor без очереди (FIFO по заданию);
+engine - ProcessingEngine: приоритеты, круг по ботам, пачки по чатам. Задержка
+"тихих" ботов показывает, мешает ли им бот с очередью, задержка цикла событий - стоит
+ли поллинг остальных ботов.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from benchmarks.fake_telegram import print_result
+from benchmarks.bot_startup import measure_lag
+import argparse
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import time
+
+FLOOD_CHATS = 5
+
+
+def burn(payloads: list) -> list:
+    """Процессор-заглушка: (iterations, overhead) -> длина данных; выполняется в процессе пула"""
+    overhead = payloads[0][1]
+    digest = b"x" * 64
+    for _ in range(overhead):
+        digest = hashlib.sha256(digest).digest()
+    results = []
+    for iterations, _ in payloads:
+        for _ in range(iterations):
+            digest = hashlib.sha256(digest).digest()
+        results.append(len(digest))
+    return results
+
+
+def calibrate() -> float:
+    """Итераций sha256 за миллисекунду на этой машине"""
+    started = time.perf_counter()
+    burn([(100_000, 0)])
+    return 100_000 / ((time.perf_counter() - started) * 1000)
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+class Runner:
+    """Постановка задания выбранным способом; результат - время от постановки до результата"""
+    def __init__(self, mode: str, workers: int, batch_size: int):
+        self.mode = mode
+        self.engine = None
+        self.pool = None
+        if mode == "engine":
+            from processing import ProcessingEngine
+
+            self.engine = ProcessingEngine(workers=workers, batch_size=batch_size)
+        elif mode == "executor":
+            self.pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+    async def start(self):
+        if self.engine:
+            self.engine.start()
+            await (await self.engine.submit(0, 0, burn, (1, 0)))
+        elif self.pool:
+            await asyncio.get_running_loop().run_in_executor(self.pool, burn, [(1, 0)])
+
+    async def run(self, bot_id: int, chat_id: int, payload, arrived: float) -> float:
+        """arrived - время прихода сообщения: при inline задание ждёт, пока цикл событий занят"""
+        if self.engine:
+            await (await self.engine.submit(bot_id, chat_id, burn, payload))
+        elif self.pool:
+            await asyncio.get_running_loop().run_in_executor(self.pool, burn, [payload])
+        else:
+            # Обработчик сообщения считает сам: цикл событий занят всё это время
+            burn([payload])
+        return time.perf_counter() - arrived
+
+    async def stop(self):
+        if self.engine:
+            await self.engine.stop()
+        elif self.pool:
+            self.pool.shutdown()
+
+
+async def quiet_bot(runner: Runner, bot_id: int, payload, rate: float, seconds: float, latencies: list):
+    """Бот с редкими сообщениями: каждое - задание в свой чат, не дожидаясь предыдущего.
+
+    Сообщения приходят по расписанию: если цикл событий был занят, пропущенные
+    обрабатываются с опозданием, и оно входит в задержку.
+    """
+    tasks = []
+    started = time.perf_counter()
+    for number in range(int(seconds * rate)):
+        arrived = started + number / rate
+        await asyncio.sleep(max(0, arrived - time.perf_counter()))
+        tasks.append(asyncio.create_task(runner.run(bot_id, bot_id * 1000 + number % 10, payload, arrived)))
+    latencies.extend(await asyncio.gather(*tasks))
+
+
+async def main(args):
+    per_ms = calibrate()
+    payload = (int(per_ms * args.work_ms), int(per_ms * args.batch_overhead_ms))
+    runner = Runner(args.mode, args.workers, args.batch_size)
+    await runner.start()
+
+    lags = []
+    lag_task = asyncio.create_task(measure_lag(lags))
+    started = time.perf_counter()
+    quiet = []
+    bots = [
+        asyncio.create_task(quiet_bot(runner, bot_id, payload, args.rate, args.seconds, quiet))
+        for bot_id in range(2, args.bots + 2)
+    ]
+    # Бот с очередью: все задания приходят разом, как пачка голосовых после простоя
+    flood = [
+        asyncio.create_task(runner.run(1, 1000 + i % FLOOD_CHATS, payload, started))
+        for i in range(args.flood)
+    ]
+    await asyncio.gather(*bots)
+    flood_latencies = await asyncio.gather(*flood)
+    elapsed = time.perf_counter() - started
+    lag_task.cancel()
+    stats = runner.engine.stats() if runner.engine else {}
+    await runner.stop()
+
+    jobs = len(quiet) + len(flood_latencies)
+    print_result({
+        "benchmark": "processing", "mode": args.mode, "workers": args.workers, "work_ms": args.work_ms,
+        "batch_overhead_ms": args.batch_overhead_ms, "batch_size": args.batch_size, "flood": args.flood,
+        "bots": args.bots, "rate": args.rate, "seconds": elapsed, "jobs": jobs,
+        "jobs_per_s": jobs / elapsed, "batches": stats.get("batches"),
+        "quiet_p50_ms": percentile(quiet, 0.5), "quiet_p99_ms": percentile(quiet, 0.99),
+        "flood_p50_ms": percentile(flood_latencies, 0.5), "flood_max_ms": percentile(flood_latencies, 1),
+        "loop_lag_p99_ms": percentile(lags, 0.99), "loop_lag_max_ms": max(lags, default=0) * 1000,
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["inline", "executor", "engine"], default="engine")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--work-ms", type=float, default=20, help="CPU на задание, мс")
+    parser.add_argument("--batch-overhead-ms", type=float, default=20, help="CPU на пачку, мс")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--flood", type=int, default=300, help="заданий от бота с очередью")
+    parser.add_argument("--bots", type=int, default=10, help="ботов с редкими сообщениями")
+    parser.add_argument("--rate", type=float, default=1, help="заданий в секунду на бота")
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(args))
@@ -0,0 +1,108 @@
+"""Проверка сообщения по автоответам: время на сообщение в зависимости от числа правил
+и время построения индекса.
+
+Запуск из корня репозитория:
+    python -m benchmarks.rules --rules 100,1000,10000 --regex-share 0.05
+
+index - RuleIndex (словарь команд, автомат Ахо-Корасик, отбор выражений по подстроке);
+linear - проверка правил по одному, как цепочка фильтров aiogram: сравнение команды,
+подстрока в тексте, re.search. Правила - случайные слова из словаря: ключевые слова,
+команды и доля --regex-share регулярных выражений; сообщения - по 5-20 слов того же
+словаря, примерно каждое пятое содержит ключевое слово.
+"""
+from benchmarks.fake_telegram import print_result
+from rules import Rule, RuleIndex, COMMAND, KEYWORD, REGEX
+import argparse
+import random
+import re
+import string
+import time
+
+
+def word(rng: random.Random) -> str:
+    return "".join(rng.choice(string.ascii_lowercase + "абвгдеклмнопрст") for _ in range(rng.randint(4, 9)))
+
+
+def make_rules(count: int, regex_share: float, rng: random.Random) -> list:
+    rules = []
+    for i in range(count):
+        roll = rng.random()
+        if roll < regex_share:
+            rules.append(Rule(i + 1, REGEX, rf"{word(rng)}\s*#?\d+", f"r{i}", rng.randint(0, 3)))
+        elif roll < 0.2:
+            rules.append(Rule(i + 1, COMMAND, word(rng), f"c{i}", rng.randint(0, 3)))
+        else:
+            rules.append(Rule(i + 1, KEYWORD, word(rng), f"k{i}", rng.randint(0, 3)))
+    return rules
+
+
+def make_messages(rules: list, count: int, rng: random.Random) -> list:
+    keywords = [rule.pattern for rule in rules if rule.kind == KEYWORD]
+    messages = []
+    for _ in range(count):
+        words = [word(rng) for _ in range(rng.randint(5, 20))]
+        if keywords and rng.random() < 0.2:
+            words.insert(rng.randrange(len(words)), rng.choice(keywords))
+        messages.append(" ".join(words))
+    return messages
+
+
+class LinearRules:
+    """Прежний способ: каждое правило - отдельный фильтр, проверяются все по очереди"""
+    def __init__(self, rules: list):
+        self.rules = [
+            (rule, re.compile(rule.pattern, re.IGNORECASE) if rule.kind == REGEX else None) for rule in rules
+        ]
+
+    def match(self, text: str) -> Rule:
+        folded = text.casefold()
+        command = text[1:].split(maxsplit=1)[0].lower() if text.startswith("/") else None
+        found = None
+        for rule, regex in self.rules:
+            if rule.kind == COMMAND:
+                matched = command == rule.pattern
+            elif rule.kind == KEYWORD:
+                matched = rule.pattern in folded
+            else:
+                matched = regex.search(text) is not None
+            if matched and (found is None or rule.rank > found.rank):
+                found = rule
+        return found
+
+
+def measure(matcher, messages: list) -> tuple:
+    started = time.perf_counter()
+    matched = sum(matcher.match(text) is not None for text in messages)
+    return (time.perf_counter() - started) / len(messages) * 1_000_000, matched
+
+
+def main(args):
+    rng = random.Random(1)
+    for count in (int(value) for value in args.rules.split(",")):
+        rules = make_rules(count, args.regex_share, rng)
+        messages = make_messages(rules, args.messages, rng)
+        started = time.perf_counter()
+        index = RuleIndex(rules)
+        build = time.perf_counter() - started
+        index_us, index_matched = measure(index, messages)
+        # Без регулярных выражений: только словарь и автомат
+        plain = RuleIndex([rule for rule in rules if rule.kind != REGEX])
+        plain_us, _ = measure(plain, messages)
+        linear_us, linear_matched = measure(LinearRules(rules), messages[:args.linear_messages])
+        print_result({
+            "benchmark": "rules", "rules": count, "regex_share": args.regex_share,
+            "messages": len(messages), "build_s": build,
+            "index_us_per_message": index_us, "index_no_regex_us_per_message": plain_us,
+            "linear_us_per_message": linear_us, "speedup": linear_us / index_us,
+            "matched_share": index_matched / len(messages),
+        })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", default="100,1000,10000", help="числа правил через запятую")
+    parser.add_argument("--regex-share", type=float, default=0.05, help="доля регулярных выражений")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--linear-messages", type=int, default=500, help="сообщений для linear (он медленный)")
+    args = parser.parse_args()
+    main(args)
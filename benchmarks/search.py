@@ -0,0 +1,138 @@
+"""Полнотекстовый поиск по истории: задержка запросов через FTS5 на миллионе сообщений
+в сравнении со сканированием LIKE, а также скорость разовой индексации старых сообщений.
+
+Запуск из корня репозитория:
+    python -m benchmarks.search --messages 1000000
+"""
+from tortoise import Tortoise, connections
+from tortoise.transactions import in_transaction
+from benchmarks.fake_telegram import print_result, rss_mb
+import argparse
+import itertools
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+INSERT_SQL = 'INSERT INTO "messages" ("chat_id", "text", "direction", "timestamp", "bot_id") VALUES (?, ?, ?, ?, ?)'
+
+
+def make_vocabulary(size: int) -> list:
+    """Слова из кириллицы, частоты по закону Ципфа - как в живой переписке"""
+    letters = "абвгдежзийклмнопрстуфхцчшщыэюя"
+    words = set()
+    while len(words) < size:
+        words.add("".join(random.choices(letters, k=random.randint(3, 10))))
+    return sorted(words, key=len)
+
+
+def percentile(values: list, p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000
+
+
+async def timed(fn, *args) -> float:
+    started = time.perf_counter()
+    await fn(*args)
+    return time.perf_counter() - started
+
+
+async def main(args):
+    from db import init_db, get_tortoise_config, WRITE_CONNECTION
+    from models import Bot as BotModel
+    from search import search_messages, search_cursor, backfill_index
+
+    random.seed(args.seed)
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    await init_db(get_tortoise_config(db_path, args.readers, database_url=""))
+    bots = [await BotModel.create(token=f"{i}:bench", name=f"bench {i}", bot_type="shop")
+            for i in range(1, args.bots + 1)]
+
+    vocabulary = make_vocabulary(args.vocabulary)
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    random.shuffle(weights)
+    cum_weights = list(itertools.accumulate(weights))
+    timestamp = "2025-01-01 00:00:00+00:00"
+
+    # Запись с триггером FTS5: столько же стоит индексация новых сообщений
+    started = time.perf_counter()
+    for offset in range(0, args.messages, args.batch):
+        rows = []
+        for i in range(offset, min(offset + args.batch, args.messages)):
+            text = " ".join(random.choices(vocabulary, cum_weights=cum_weights, k=random.randint(3, 15)))
+            rows.append([10000 + i % args.chats, text, "incoming", timestamp, bots[i % len(bots)].id])
+        async with in_transaction(WRITE_CONNECTION) as conn:
+            await conn.execute_many(INSERT_SQL, rows)
+    insert_s = time.perf_counter() - started
+
+    # Разовая индексация: сбрасываем индекс и строим заново через index_search
+    writer = connections.get(WRITE_CONNECTION)
+    await writer.execute_query('INSERT INTO "messages_fts" ("messages_fts") VALUES (\'delete-all\')')
+    await writer.execute_query('UPDATE "search_backfill" SET "upto" = (SELECT MAX("id") FROM "messages"), "done" = 0')
+    started = time.perf_counter()
+    async for _ in backfill_index(args.backfill_batch):
+        pass
+    backfill_s = time.perf_counter() - started
+
+    bot_id = bots[0].id
+    by_frequency = [word for _, word in sorted(zip(weights, vocabulary), reverse=True)]
+    common, rare = by_frequency[:20], by_frequency[-2000:]
+    queries = {
+        "common_word": lambda: random.choice(common),
+        "rare_word": lambda: random.choice(rare),
+        "two_words": lambda: f"{random.choice(common)} {random.choice(by_frequency[:500])}",
+        "prefix": lambda: random.choice(by_frequency[:1000])[:3],
+    }
+    latencies = {}
+    for name, make_query in queries.items():
+        latencies[name] = [await timed(search_messages, bot_id, make_query()) for _ in range(args.queries)]
+
+    # Вторая страница по курсору
+    second_page = []
+    for _ in range(args.queries):
+        query = random.choice(common)
+        first = await search_messages(bot_id, query)
+        if first:
+            second_page.append(await timed(search_messages, bot_id, query, search_cursor(first[-1])))
+
+    # Для сравнения - старый способ, LIKE по всей таблице сообщений бота
+    async def like_scan(word):
+        await writer.execute_query(
+            'SELECT "id", "text" FROM "messages" WHERE "bot_id" = ? AND "text" LIKE ? ORDER BY "id" DESC LIMIT 20',
+            [bot_id, f"%{word}%"]
+        )
+    like_rare = [await timed(like_scan, random.choice(rare)) for _ in range(args.like_queries)]
+
+    await Tortoise.close_connections()
+    result = {
+        "benchmark": "search",
+        "messages": args.messages,
+        "bots": args.bots,
+        "insert_with_index_msgs_per_s": args.messages / insert_s,
+        "backfill_s": backfill_s,
+        "backfill_msgs_per_s": args.messages / backfill_s,
+        "db_mb": os.path.getsize(db_path) / 1024 / 1024,
+    }
+    for name, values in latencies.items():
+        result[f"{name}_p50_ms"] = percentile(values, 0.5)
+        result[f"{name}_p99_ms"] = percentile(values, 0.99)
+    result["second_page_p50_ms"] = percentile(second_page, 0.5)
+    result["like_rare_word_p50_ms"] = percentile(like_rare, 0.5)
+    result["rss_mb"] = rss_mb()
+    print_result(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--bots", type=int, default=10)
+    parser.add_argument("--chats", type=int, default=5000)
+    parser.add_argument("--vocabulary", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=50000)
+    parser.add_argument("--backfill-batch", type=int, default=50000)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--like-queries", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,134 @@
+"""Шардирование ботов между процессами: распределение, отсутствие двойного поллинга и
+время переезда ботов с упавшего воркера.
+
+Запускает несколько процессов uvicorn с BOT_SHARDING=1 на общей базе и заглушке
+Telegram, затем убивает один воркер (SIGKILL) и ждёт, пока его боты заработают
+на оставшихся.
+
+Запуск из корня репозитория:
+    python -m benchmarks.sharding --workers 3 --bots 60
+"""
+from tortoise import Tortoise, connections
+from benchmarks.fake_telegram import FakeTelegram, make_token, print_result
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import sys
+import tempfile
+import time
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for(condition, timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if await condition():
+            return True
+        await asyncio.sleep(0.05)
+    return False
+
+
+async def leases() -> dict:
+    """worker_id -> список bot_id по таблице аренд"""
+    _, rows = await connections.get("default").execute_query('SELECT "bot_id", "worker_id" FROM "bot_leases"')
+    owners = {}
+    for row in rows:
+        owners.setdefault(row["worker_id"], []).append(row["bot_id"])
+    return owners
+
+
+async def main(args):
+    from db import init_db, get_tortoise_config
+    from models import Bot as BotModel
+
+    fake = FakeTelegram(poll_timeout=1.0)
+    await fake.start()
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    await init_db(get_tortoise_config(db_path, 0, database_url=""))
+    tokens = {}
+    for i in range(1, args.bots + 1):
+        bot = await BotModel.create(token=make_token(i), name=f"bench {i}", bot_type="shop")
+        tokens[bot.id] = bot.token
+
+    env = dict(
+        os.environ,
+        DB_PATH=db_path,
+        DATABASE_URL="",
+        DB_READERS="2",
+        TELEGRAM_API_URL=fake.url,
+        BOT_MODE="polling",
+        BOT_SHARDING="1",
+        SHARD_HEARTBEAT=str(args.heartbeat),
+        SHARD_LEASE_TTL=str(args.lease_ttl),
+        SESSION_SECRET="bench",
+    )
+    started = time.perf_counter()
+    workers = [
+        await asyncio.create_subprocess_exec(
+            sys.executable, "-m", "uvicorn", "main:app", "--port", str(free_port()),
+            "--log-level", "warning", env=env, stderr=asyncio.subprocess.DEVNULL
+        )
+        for _ in range(args.workers)
+    ]
+
+    # Все боты поллятся, и у каждого есть аренда (распределение устоялось)
+    async def settled():
+        owners = await leases()
+        polled = all(fake.last_poll.get(token, 0) > started for token in tokens.values())
+        return polled and sum(len(bots) for bots in owners.values()) == args.bots
+    await wait_for(settled, 60)
+    # Даём кольцу стабилизироваться после одновременного старта воркеров
+    await asyncio.sleep(args.lease_ttl)
+    await wait_for(settled, 60)
+    startup_s = time.perf_counter() - started
+    owners = await leases()
+    distribution = sorted(len(bots) for bots in owners.values())
+
+    # Убиваем воркер с наибольшим числом ботов
+    victim_id, orphans = max(owners.items(), key=lambda item: len(item[1]))
+    victim_pid = int(victim_id.split(":")[1])
+    killed = time.perf_counter()
+    os.kill(victim_pid, signal.SIGKILL)
+
+    async def recovered():
+        return all(fake.last_poll.get(tokens[bot_id], 0) > killed for bot_id in orphans)
+    moved = await wait_for(recovered, args.lease_ttl * 4)
+    failover_s = time.perf_counter() - killed
+
+    for worker in workers:
+        if worker.returncode is None and worker.pid != victim_pid:
+            worker.send_signal(signal.SIGTERM)
+    await asyncio.gather(*(worker.wait() for worker in workers))
+    remaining = await leases()
+    await Tortoise.close_connections()
+    await fake.stop()
+
+    print_result({
+        "benchmark": "sharding",
+        "workers": args.workers,
+        "bots": args.bots,
+        "startup_s": startup_s,
+        "bots_per_worker": distribution,
+        "killed_worker_bots": len(orphans),
+        "failover_ok": moved,
+        "failover_s": failover_s,
+        "lease_ttl_s": args.lease_ttl,
+        "double_polling": fake.conflicts,
+        "leases_after_shutdown": sum(len(bots) for bots in remaining.values()),
+    })
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=3)
+    parser.add_argument("--bots", type=int, default=60)
+    parser.add_argument("--heartbeat", type=float, default=1)
+    parser.add_argument("--lease-ttl", type=float, default=4)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,122 @@
+"""Пропускная способность приёма обновлений: поллинг каждым ботом против общего вебхука.
+
+Запуск из корня репозитория:
+    python -m benchmarks.webhook --bots 20 --updates 5000 --mode polling
+    python -m benchmarks.webhook --bots 20 --updates 5000 --mode webhook
+
+Обновления идут через локальную заглушку Telegram, обрабатываются обычным
+BaseBot.handle_message и записываются в временную SQLite через MessageIngestor.
+"""
+from types import SimpleNamespace
+from tortoise import Tortoise
+from benchmarks.fake_telegram import FakeTelegram, make_token, make_update, print_result, rss_mb
+import aiohttp
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+import time
+
+
+async def main(args):
+    server = FakeTelegram()
+    os.environ["TELEGRAM_API_URL"] = await server.start()
+    os.environ["WEBHOOK_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ["WEBHOOK_SECRET"] = "benchmark"
+
+    import uvicorn
+    from fastapi import FastAPI
+    from db import init_db, get_tortoise_config
+    from models import Bot as BotModel
+    from ingest import ingestor
+    from manager import BotManager
+    from telegram_client import telegram_client
+    from webhook import webhook_dispatcher, router
+
+    db_path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    await init_db(get_tortoise_config(db_path, 1, database_url=""))
+    ingestor.start()
+
+    app = FastAPI()
+    app.include_router(router)
+    uvicorn_server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port,
+                                                   log_level="warning"))
+    serving = asyncio.create_task(uvicorn_server.serve())
+    if args.mode == "webhook":
+        webhook_dispatcher.start()
+
+    manager = BotManager(mode=args.mode)
+    tokens = []
+    for i in range(args.bots):
+        bot = await BotModel.create(token=make_token(200000 + i), name=f"bench {i}", bot_type="custom")
+        await manager.start_bot(bot)
+        tokens.append(bot.token)
+    if args.mode == "polling":
+        while len(server.first_poll) < args.bots:
+            await asyncio.sleep(0.01)
+
+    per_bot = args.updates // args.bots
+    total = per_bot * args.bots
+    updates = {
+        token: [make_update(n + 1, 5000 + n % args.chats, f"message {n}") for n in range(per_bot)]
+        for token in tokens
+    }
+    calls_before = dict(server.calls)
+
+    started = time.perf_counter()
+    if args.mode == "polling":
+        for token in tokens:
+            server.add_updates(token, updates[token])
+    else:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency))
+        queue = [(server.webhooks[token], update) for token in tokens for update in updates[token]]
+        position = iter(queue)
+
+        async def sender():
+            for url, update in position:
+                async with session.post(url, json=update) as response:
+                    assert response.status == 200, response.status
+
+        await asyncio.gather(*(sender() for _ in range(args.concurrency)))
+        await session.close()
+
+    while ingestor.flushed < total and time.perf_counter() - started < args.timeout:
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "benchmark": "webhook",
+        "mode": args.mode,
+        "bots": args.bots,
+        "updates": total,
+        "saved": ingestor.flushed,
+        "elapsed_s": elapsed,
+        "updates_per_s": ingestor.flushed / elapsed,
+        "get_updates_calls": server.calls.get("getUpdates", 0) - calls_before.get("getUpdates", 0),
+        "rss_mb": rss_mb(),
+    }
+
+    await manager.stop_all()
+    await webhook_dispatcher.stop()
+    await ingestor.stop()
+    uvicorn_server.should_exit = True
+    await serving
+    await telegram_client.close()
+    await Tortoise.close_connections()
+    await server.stop()
+    print_result(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bots", type=int, default=20)
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="webhook")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main(args))
@@ -1,182 +1,201 @@
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram import Bot, Dispatcher, types
 from aiogram.types import Message
-from models import Message as DBMessage, Chat, Bot as BotModel
+from ingest import ingestor, IncomingMessage, OutgoingMessage
+from telegram_client import telegram_client
+from fsm_storage import fsm_storage
+from media import media_info
+from processing import processing_engine, transcribe
+from rules import rule_router, RuleIndex, Rule, COMMAND, KEYWORD
+from config import LOG_SAMPLE_RATE
+from metrics import log_event, sampled
+import asyncio
+import functools
 import logging
-from tortoise import Tortoise
-
-TORTOISE_CONFIG = {
-    "connections": {"default": "sqlite://db.sqlite3"},
-    "apps": {
-        "models": {
-            "models": ["main"],
-            "default_connection": "default",
-        }
-    },
-}
+import time
+
+class BotDispatcher(Dispatcher):
+    """Dispatcher бота с учётом обновлений для /metrics.
+
+    Поллинг и вебхук оба проходят через feed_update; outer middleware добавил бы
+    лишнее звено в цепочку aiogram на каждое обновление. Счётчик - простое число,
+    в метрики его переносит сборщик при запросе /metrics.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.updates = 0
+        self.last_update = None  # time.monotonic() последнего обновления
+
+    async def feed_update(self, bot: Bot, update: types.Update, **kwargs):
+        self.updates += 1
+        self.last_update = time.monotonic()
+        return await super().feed_update(bot, update, **kwargs)
+
 
 class BaseBot:
+    # Автоответы типа бота: срабатывают, если не подошло ни одно правило бота из админки
+    default_rules = ()
+
     def __init__(self, token: str, bot_id: int):
         self.token = token
         self.bot_id = bot_id
-        self.bot = Bot(token=token)
-        self.storage = MemoryStorage()
-        self.dp = Dispatcher(storage=self.storage)
+        # Все боты ходят в Telegram через общий пул соединений приложения
+        self.bot = Bot(token=token, session=telegram_client.bot_session())
+        # Состояния FSM - в общем хранилище процесса на БД (переживают перезапуск)
+        self.storage = fsm_storage
+        self.dp = BotDispatcher(storage=self.storage)
         self.running = False
-        self.bot_id = bot_id
-        self._tortoise_inited = False
         
         # Регистрация обработчиков
         self.dp.message.register(self.handle_message)
         
         logging.info(f"Base bot initialized: {token[:5]}...")
         
-    async def init_orm(self):
-        """Инициализация Tortoise ORM для этого бота"""
-        if not self._tortoise_inited:
-            await Tortoise.init(config=TORTOISE_CONFIG)
-            self._tortoise_inited = True
-            logging.info(f"Tortoise ORM initialized for bot {self.bot_id}")
-
     async def handle_message(self, message: types.Message):
-        
-        if not self._tortoise_inited:
-            await self.init_orm()
-        
         """Обработчик входящих сообщений для всех ботов"""
         try:
             chat_id = message.chat.id
             text = message.text or message.caption or ''
             
-            # Логируем получение сообщения
-            logging.info(f"Received message from chat {chat_id}: {text[:100]}{'...' if len(text) > 100 else ''}")
-            
-            # Получаем модель бота из БД
-            try:
-                bot_instance = await BotModel.get(id=self.bot_id)
-                logging.info(f"Bot instance found: {bot_instance.name}")
-            except Exception as e:
-                logging.error(f"Error getting bot model: {e}")
-                return
+            # В лог - только доля сообщений (LOG_SAMPLE_RATE) и без текста переписки
+            if sampled(LOG_SAMPLE_RATE):
+                log_event("message_received", LOG_SAMPLE_RATE, bot_id=self.bot_id, chat_id=chat_id, length=len(text))
             
-            # Сохраняем сообщение
-            try:
-                db_message = await DBMessage.create(
-                    chat_id=chat_id,
-                    text=text,
-                    direction='incoming',
-                    bot=bot_instance
-                )
-                logging.info(f"Message saved to DB with ID {db_message.id}")
-            except Exception as e:
-                logging.error(f"Error saving message to DB: {e}", exc_info=True)
-                return
+            # Сообщение и чат записываются в БД пачкой в фоне
+            await ingestor.put(IncomingMessage(
+                bot_id=self.bot_id,
+                chat_id=chat_id,
+                chat_title=self.chat_title(message),
+                text=text,
+                # Файл скачивается в фоне после записи сообщения
+                media=media_info(message)
+            ))
             
-            # Создаем название чата
-            chat_title = message.chat.title or ""
-            if not chat_title:
-                if message.chat.first_name or message.chat.last_name:
-                    chat_title = f"{message.chat.first_name or ''} {message.chat.last_name or ''}".strip()
-                else:
-                    chat_title = f"User #{chat_id}"
-            
-            # Обновляем информацию о чате
-            try:
-                chat, created = await Chat.get_or_create(
-                    id=chat_id,
-                    bot=bot_instance,
-                    defaults={
-                        'title': chat_title,
-                        'last_message': text,
-                        'unread': 1
-                    }
-                )
-                
-                if not created:
-                    chat.unread += 1
-                    chat.last_message = text
-                    await chat.save()
-                
-                logging.info(f"Chat updated: {chat_title} (ID: {chat_id})")
-                
-            except Exception as e:
-                logging.error(f"Error updating chat: {e}", exc_info=True)
+            # Автоответ по правилам: один поиск по индексу, сколько бы правил ни было
+            if text:
+                username = None
+                if text.startswith("/") and "@" in text.split(maxsplit=1)[0]:
+                    username = (await self.bot.me()).username
+                reply = await rule_router.match(self.bot_id, text, self.default_index(), username)
+                if reply:
+                    await self.reply(message, reply)
             
         except Exception as e:
             logging.error(f"Unhandled error in message handler: {e}", exc_info=True)
+
+    @classmethod
+    @functools.cache
+    def default_index(cls) -> RuleIndex:
+        """Индекс правил типа бота (один на класс)"""
+        return RuleIndex(list(cls.default_rules))
+
+    @staticmethod
+    def chat_title(message: types.Message) -> str:
+        """Название чата для списка чатов"""
+        chat_title = message.chat.title or ""
+        if not chat_title:
+            if message.chat.first_name or message.chat.last_name:
+                chat_title = f"{message.chat.first_name or ''} {message.chat.last_name or ''}".strip()
+            else:
+                chat_title = f"User #{message.chat.id}"
+        return chat_title
+
+    async def reply(self, message: types.Message, text: str):
+        """Ответ в чат через outbox (лимиты Telegram, повторы, история) вместо message.answer"""
+        await ingestor.put(OutgoingMessage(
+            bot_id=self.bot_id,
+            chat_id=message.chat.id,
+            chat_title=self.chat_title(message),
+            text=text
+        ))
             
     async def start(self):
-        """Запуск бота"""
-        if not self.running:
-            self.running = True
-            logging.info("Starting bot polling...")
-            await self.dp.start_polling(self.bot)
-            logging.info("Bot polling stopped")
+        """Запуск поллинга (останавливается отменой задачи, в которой работает start)"""
+        if self.running:
+            return
+        # Поллинг не работает, пока у бота установлен вебхук
+        await self.delete_webhook()
+        self.running = True
+        logging.info(f"Starting bot {self.bot_id} polling...")
+        # Сигналы обрабатывает uvicorn, сессию закрываем сами в stop().
+        # start_polling не отменяет свои внутренние задачи при внешней отмене,
+        # поэтому запускаем его отдельно и останавливаем штатно через stop_polling
+        polling = asyncio.create_task(self.dp.start_polling(
+            self.bot,
+            handle_signals=False,
+            close_bot_session=False
+        ))
+        try:
+            await asyncio.shield(polling)
+        except asyncio.CancelledError:
+            try:
+                await self.dp.stop_polling()
+            except RuntimeError:
+                # Поллинг ещё не начался или уже завершился
+                polling.cancel()
+            raise
+        finally:
+            self.running = False
+            logging.info(f"Bot {self.bot_id} polling stopped")
+
+    async def set_webhook(self, url: str):
+        """Регистрация вебхука вместо поллинга"""
+        await self.bot.set_webhook(url, allowed_updates=self.dp.resolve_used_update_types())
+
+    async def delete_webhook(self):
+        """Отключение вебхука"""
+        await self.bot.delete_webhook()
 
     async def stop(self):
-        """Остановка бота"""
+        """Остановка бота и освобождение ресурсов"""
+        logging.info(f"Stopping bot {self.bot_id}...")
         if self.running:
-            self.running = False
-            logging.info("Stopping bot...")
-            await self.dp.stop_polling()
-            await self.storage.close()
-            logging.info("Bot stopped")
+            try:
+                await self.dp.stop_polling()
+            except RuntimeError:
+                pass
+        await self.storage.close()
+        await self.bot.session.close()
+        logging.info(f"Bot {self.bot_id} stopped")
 
 class ShopBot(BaseBot):
     """Бот для интернет-магазина"""
+    default_rules = (
+        Rule(1, COMMAND, "start", "🛒 Добро пожаловать в наш магазин! Выберите категорию:"),
+        Rule(2, KEYWORD, "товар", "🔍 Вот список доступных товаров..."),
+    )
+
     def __init__(self, token: str, bot_id: int):
         super().__init__(token, bot_id)
-        
-        # Регистрация специфичных обработчиков
-        self.dp.message.register(self.start_command, Command("start"))
-        self.dp.message.register(self.handle_product_query, F.text.lower().contains("товар"))
-        
         logging.info(f"Shop bot initialized: {token[:5]}...")
 
-    async def start_command(self, message: Message):
-        """Обработчик команды /start"""
-        await message.answer("🛒 Добро пожаловать в наш магазин! Выберите категорию:")
-        # Здесь будет логика магазина
-
-    async def handle_product_query(self, message: Message):
-        """Обработчик запросов о товарах"""
-        await message.answer("🔍 Вот список доступных товаров...")
-        # Логика обработки товаров
-
 class ConsultationBot(BaseBot):
     """Бот для записи на консультации"""
+    default_rules = (
+        Rule(1, COMMAND, "start", "📅 Добро пожаловать в бот для записи на консультации!"),
+        Rule(2, COMMAND, "schedule", "🗓️ Выберите удобное время для консультации:"),
+    )
+
     def __init__(self, token: str, bot_id: int):
         super().__init__(token, bot_id)
-        
-        # Регистрация специфичных обработчиков
-        self.dp.message.register(self.start_command, Command("start"))
-        self.dp.message.register(self.handle_schedule, Command("schedule"))
-        
         logging.info(f"Consultation bot initialized: {token[:5]}...")
 
-    async def start_command(self, message: Message):
-        """Обработчик команды /start"""
-        await message.answer("📅 Добро пожаловать в бот для записи на консультации!")
-        
-    async def handle_schedule(self, message: Message):
-        """Обработчик команды /schedule"""
-        await message.answer("🗓️ Выберите удобное время для консультации:")
-        # Логика записи
-
 class TranscriptionBot(BaseBot):
     """Бот для транскрибации сообщений"""
     def __init__(self, token: str, bot_id: int):
         super().__init__(token, bot_id)
-        
-        # Регистрация обработчика всех сообщений
-        self.dp.message.register(self.transcribe_message)
-        
+        processing_engine.prepare()
         logging.info(f"Transcription bot initialized: {token[:5]}...")
 
+    async def handle_message(self, message: types.Message):
+        """Запись сообщения и транскрибация; отдельный обработчик после общего не вызывался бы"""
+        await super().handle_message(message)
+        await self.transcribe_message(message)
+
     async def transcribe_message(self, message: Message):
-        """Транскрибация входящих сообщений"""
+        """Транскрибация входящих сообщений в пуле процессов: ответ уходит, когда она готова,
+        поллинг его не ждёт"""
         text = message.text or message.caption or ''
         if text:
-            # Здесь будет логика транскрибации
-            await message.answer(f"🔤 Транскрипция: {text.upper()}")
\ No newline at end of file
+            async def deliver(result: str):
+                await self.reply(message, f"🔤 Транскрипция: {result}")
+            await processing_engine.submit(self.bot_id, message.chat.id, transcribe, text, deliver=deliver)
\ No newline at end of file
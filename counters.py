@@ -0,0 +1,48 @@
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+from db import WRITE_CONNECTION, dialect_sql
+from models import Chat, BotStats
+from metrics import DB_QUERY_SECONDS
+from pages import page_cache
+
+# Увеличение общего счётчика непрочитанных бота на число новых сообщений
+BOT_UNREAD_UPSERT_SQL = (
+    'INSERT INTO "bot_stats" ("bot_id", "unread") VALUES (?, ?) '
+    'ON CONFLICT ("bot_id") DO UPDATE SET "unread" = "bot_stats"."unread" + excluded."unread"'
+)
+
+# Вычитаем непрочитанные чата из общего счётчика бота (до обнуления чата)
+BOT_UNREAD_SUBTRACT_SQL = (
+    'UPDATE "bot_stats" SET "unread" = "unread" - COALESCE('
+    '(SELECT "unread" FROM "chats" WHERE "id" = ? AND "bot_id" = ?), 0) '
+    'WHERE "bot_id" = ?'
+)
+
+
+async def mark_chat_read(bot_id: int, chat_id: int, **values):
+    """Обнуление непрочитанных чата и общего счётчика бота одной транзакцией.
+
+    Дополнительные поля чата (например, last_message) обновляются тем же запросом.
+    """
+    if "last_message" in values:
+        values["updated"] = timezone.now()
+    with DB_QUERY_SECONDS.time("mark_read"):
+        async with in_transaction(WRITE_CONNECTION) as conn:
+            await conn.execute_query(dialect_sql(conn, BOT_UNREAD_SUBTRACT_SQL), [chat_id, bot_id, bot_id])
+            await Chat.filter(id=chat_id, bot_id=bot_id).using_db(conn).update(unread=0, **values)
+    page_cache.bump("unread", ("chats", bot_id))
+
+
+async def unread_totals() -> dict:
+    """Непрочитанные по ботам: bot_id -> количество (без обхода таблицы чатов)"""
+    return dict(await BotStats.all().values_list("bot_id", "unread"))
+
+
+async def rebuild_unread_totals():
+    """Пересчёт общих счётчиков по таблице чатов (при запуске, до приёма сообщений)"""
+    async with in_transaction(WRITE_CONNECTION) as conn:
+        await conn.execute_query('DELETE FROM "bot_stats"')
+        await conn.execute_query(
+            'INSERT INTO "bot_stats" ("bot_id", "unread") '
+            'SELECT "bot_id", SUM("unread") FROM "chats" GROUP BY "bot_id"'
+        )
@@ -0,0 +1,204 @@
+from config import (
+    DB_PATH, DB_READERS, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE, SQLITE_BUSY_TIMEOUT_MS,
+    DATABASE_URL, DB_POOL_MIN, DB_POOL_MAX
+)
+from tortoise import Tortoise, connections
+from tortoise.backends.base.config_generator import expand_db_url
+from tortoise.transactions import in_transaction
+from metrics import DB_LOCK_WAIT_SECONDS
+from pathlib import Path
+import asyncio
+import importlib
+import itertools
+import logging
+import time
+
+# Имя единственного соединения, через которое идут все записи
+WRITE_CONNECTION = "default"
+
+
+def sqlite_connection(path: str, read_only: bool = False) -> dict:
+    """Соединение SQLite с настройками для одновременной работы ботов и веб-интерфейса"""
+    # Все параметры, кроме file_path, Tortoise выполняет как PRAGMA при подключении
+    credentials = {"file_path": path}
+    if not read_only:
+        # Освобождённые страницы возвращаются ОС шагами (archive.py), без полного VACUUM.
+        # Действует только для новой базы и только до journal_mode; старую переводит
+        # python archive_messages.py --vacuum
+        credentials["auto_vacuum"] = "INCREMENTAL"
+    credentials.update({
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -SQLITE_CACHE_SIZE_KB,
+        "mmap_size": SQLITE_MMAP_SIZE,
+        "busy_timeout": SQLITE_BUSY_TIMEOUT_MS,
+        "temp_store": "MEMORY",
+    })
+    if read_only:
+        credentials["query_only"] = "ON"
+    return {"engine": "tortoise.backends.sqlite", "credentials": credentials}
+
+
+def postgres_connection(url: str) -> dict:
+    """Соединение PostgreSQL: пул asyncpg, общий для всех запросов процесса"""
+    if url.startswith("postgresql://"):
+        # Схему postgresql:// (libpq, docker-образы) Tortoise не знает
+        url = "postgres://" + url[len("postgresql://"):]
+    connection = expand_db_url(url)
+    connection["credentials"].setdefault("minsize", DB_POOL_MIN)
+    connection["credentials"].setdefault("maxsize", DB_POOL_MAX)
+    return connection
+
+
+def get_tortoise_config(path: str = DB_PATH, readers: int = DB_READERS,
+                        database_url: str = DATABASE_URL) -> dict:
+    """Конфигурация Tortoise.
+
+    PostgreSQL (database_url) - одно соединение с пулом; SQLite - одно соединение-писатель
+    ("default") и пул читателей.
+    """
+    if database_url:
+        connections = {WRITE_CONNECTION: postgres_connection(database_url)}
+        readers = 0
+    else:
+        connections = {WRITE_CONNECTION: sqlite_connection(path)}
+        for i in range(readers):
+            connections[f"reader_{i}"] = sqlite_connection(path, read_only=True)
+    ReadWriteRouter.readers = itertools.cycle([f"reader_{i}" for i in range(readers)])
+    return {
+        "connections": connections,
+        "apps": {
+            "models": {
+                "models": ["models"],
+                "default_connection": WRITE_CONNECTION,
+            }
+        },
+        "routers": ["db.ReadWriteRouter"] if readers else [],
+    }
+
+
+class ReadWriteRouter:
+    """Чтение - по кругу через соединения-читатели, запись - только через "default".
+
+    В WAL читатели не ждут писателя, а все записи идут последовательно через одно
+    соединение, поэтому "database is locked" между ними не возникает.
+    """
+    readers = itertools.cycle([])
+
+    def db_for_read(self, model):
+        return next(self.readers, None)
+
+    def db_for_write(self, model):
+        return WRITE_CONNECTION
+
+
+def read_connection():
+    """Соединение для сырых запросов на чтение: читатель SQLite или общий пул"""
+    return connections.get(next(ReadWriteRouter.readers, None) or WRITE_CONNECTION)
+
+
+class TimedLock(asyncio.Lock):
+    """Блокировка соединения SQLite в Tortoise с учётом ожидания (db_lock_wait_seconds).
+
+    Соединение выполняет один запрос за раз, транзакция держит его до конца, поэтому
+    время ожидания здесь - это очередь к писателю (или занятому читателю).
+    """
+    def __init__(self, role: str):
+        super().__init__()
+        self.role = role
+
+    async def acquire(self):
+        if not self.locked():
+            return await super().acquire()
+        started = time.perf_counter()
+        try:
+            return await super().acquire()
+        finally:
+            DB_LOCK_WAIT_SECONDS.observe(time.perf_counter() - started, self.role)
+
+
+def is_postgres(connection) -> bool:
+    return connection.capabilities.dialect == "postgres"
+
+
+def dialect_sql(connection, query: str) -> str:
+    """Сырой запрос с параметрами "?" в синтаксисе соединения (asyncpg: $1, $2, ...)"""
+    if not is_postgres(connection):
+        return query
+    parts = query.split("?")
+    return parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+
+
+def db_datetime(connection, value):
+    """Дата для сырого запроса: SQLite хранит строку, как это делает Tortoise"""
+    return value if is_postgres(connection) else str(value)
+
+
+# Версионные миграции схемы: migrations/NNNN_name.py со списками UPGRADE по диалектам
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+# Ключ блокировки PostgreSQL, чтобы миграции не выполнялись несколькими воркерами сразу
+MIGRATIONS_LOCK_ID = 720_001
+
+MIGRATIONS_TABLE_SQL = {
+    "sqlite": (
+        'CREATE TABLE IF NOT EXISTS "schema_migrations" ('
+        '"version" VARCHAR(255) NOT NULL PRIMARY KEY, '
+        '"applied_at" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)'
+    ),
+    "postgres": (
+        'CREATE TABLE IF NOT EXISTS "schema_migrations" ('
+        '"version" VARCHAR(255) NOT NULL PRIMARY KEY, '
+        '"applied_at" TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP)'
+    ),
+}
+
+
+def load_migrations() -> list:
+    """Миграции по порядку номеров: [(версия, модуль)]"""
+    return [
+        (path.stem, importlib.import_module(f"migrations.{path.stem}"))
+        for path in sorted(MIGRATIONS_DIR.glob("[0-9]*.py"))
+    ]
+
+
+async def apply_migrations(connection_name: str = WRITE_CONNECTION) -> list:
+    """Применение новых миграций одной транзакцией; список применённых версий"""
+    applied_now = []
+    async with in_transaction(connection_name) as conn:
+        dialect = conn.capabilities.dialect
+        if dialect == "postgres":
+            await conn.execute_query("SELECT pg_advisory_xact_lock($1)", [MIGRATIONS_LOCK_ID])
+        await conn.execute_query(MIGRATIONS_TABLE_SQL[dialect])
+        _, rows = await conn.execute_query('SELECT "version" FROM "schema_migrations"')
+        applied = {row["version"] for row in rows}
+        for version, migration in load_migrations():
+            if version in applied:
+                continue
+            for statement in migration.UPGRADE[dialect]:
+                await conn.execute_query(statement)
+            await conn.execute_query(
+                dialect_sql(conn, 'INSERT INTO "schema_migrations" ("version") VALUES (?)'), [version]
+            )
+            applied_now.append(version)
+            logging.info(f"Applied migration {version}")
+    return applied_now
+
+
+async def init_db(config: dict = None):
+    """Инициализация ORM, всех соединений и схемы до начала работы.
+
+    Tortoise открывает соединение SQLite лениво и без блокировки: если первый запрос
+    к читателю придёт из нескольких задач одновременно, соединение будет сломано.
+    """
+    await Tortoise.init(config=config or TORTOISE_CONFIG)
+    for connection in connections.all():
+        await connection.create_connection(with_db=True)
+        if not is_postgres(connection):
+            # Транзакции берут блокировку соединения при создании, подменяем до первой из них
+            role = "write" if connection.connection_name == WRITE_CONNECTION else "read"
+            connection._lock = TimedLock(role)
+    await apply_migrations()
+
+
+# Конфигурация приложения (main.py, migrate.py)
+TORTOISE_CONFIG = get_tortoise_config()
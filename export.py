@@ -0,0 +1,175 @@
+from datetime import datetime, timezone
+from tortoise.transactions import in_transaction
+from db import WRITE_CONNECTION, read_connection, dialect_sql, db_datetime
+from counters import rebuild_unread_totals
+from metrics import DB_QUERY_SECONDS
+from config import EXPORT_BATCH_SIZE
+import csv
+import io
+import itertools
+import json
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+# Выгружаемые таблицы: колонки, ключ страницы (у сообщений - по индексу bot_id, chat_id, id),
+# колонка даты и колонка чата для фильтров
+TABLES = {
+    "messages": ("messages", ["id", "chat_id", "direction", "text", "timestamp", "status", "attempts", "error"],
+                 ["chat_id", "id"], "timestamp", "chat_id"),
+    "chats": ("chats", ["id", "title", "last_message", "unread", "updated"], ["id"], "updated", "id"),
+}
+
+# Колонки, которые при импорте приводятся к типу; пустая строка CSV в nullable - это None
+DATE_COLUMNS = {"timestamp", "updated"}
+INT_COLUMNS = {"id", "chat_id", "unread", "attempts"}
+NULLABLE_COLUMNS = {"status", "error"}
+
+# Сообщения получают новые id; чат с тем же id обновляется, если принадлежит тому же боту
+IMPORT_SQL = {
+    "messages": (
+        'INSERT INTO "messages" ("chat_id", "direction", "text", "timestamp", "status", "attempts", "error", "bot_id") '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+    ),
+    "chats": (
+        'INSERT INTO "chats" ("id", "title", "last_message", "unread", "updated", "bot_id") '
+        'VALUES (?, ?, ?, ?, ?, ?) '
+        'ON CONFLICT ("id") DO UPDATE SET '
+        '"title" = excluded."title", "last_message" = excluded."last_message", '
+        '"unread" = excluded."unread", "updated" = excluded."updated" '
+        'WHERE "chats"."bot_id" = excluded."bot_id"'
+    ),
+}
+
+
+def parse_datetime(value: str) -> datetime:
+    """Дата из фильтра или файла в UTC; без часового пояса считается UTC.
+
+    SQLite хранит даты строками в UTC и сравнивает их как текст: дата с другим
+    смещением (+03:00) попала бы не на те строки.
+    """
+    value = datetime.fromisoformat(value)
+    return value.astimezone(timezone.utc) if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def encode_date(value):
+    """Дата в ISO 8601: PostgreSQL отдаёт datetime, SQLite - строку str(datetime)"""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value.replace(" ", "T", 1) if value else value
+
+
+def format_rows(rows: list, columns: list, fmt: str) -> str:
+    """Пачка строк в NDJSON или CSV"""
+    dates = [index for index, column in enumerate(columns) if column in DATE_COLUMNS]
+    for row in rows:
+        for index in dates:
+            row[index] = encode_date(row[index])
+    if fmt == "ndjson":
+        return "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue()
+
+
+async def export_rows(bot_id: int, kind: str, fmt: str = "ndjson", since: datetime = None,
+                      until: datetime = None, chat_id: int = None, batch_size: int = EXPORT_BATCH_SIZE):
+    """Выгрузка чатов или сообщений бота кусками текста, по batch_size строк.
+
+    Страницы читаются по ключу индекса (без OFFSET и сортировки), поэтому время страницы
+    и память не зависят от объёма истории. Каждая страница - отдельный запрос: строки,
+    записанные во время выгрузки, могут в неё не попасть, но повторов не будет.
+    """
+    table, columns, key, date_column, chat_column = TABLES[kind]
+    conditions, params = ['"bot_id" = ?'], [bot_id]
+    if chat_id is not None:
+        conditions.append(f'"{chat_column}" = ?')
+        params.append(chat_id)
+    if since is not None:
+        conditions.append(f'"{date_column}" >= ?')
+        params.append(since)
+    if until is not None:
+        conditions.append(f'"{date_column}" < ?')
+        params.append(until)
+    select = ", ".join(f'"{column}"' for column in columns)
+    order = ", ".join(f'"{column}"' for column in key)
+    # Сравнение кортежей: продолжение с места, где закончилась прошлая страница
+    after_condition = f'({order}) > ({", ".join("?" for _ in key)})'
+
+    if fmt == "csv":
+        yield format_rows([list(columns)], [], fmt)
+    after = None
+    while True:
+        connection = read_connection()
+        where = conditions + ([after_condition] if after else [])
+        sql = f'SELECT {select} FROM "{table}" WHERE {" AND ".join(where)} ORDER BY {order} LIMIT ?'
+        values = [db_datetime(connection, value) if isinstance(value, datetime) else value for value in params]
+        with DB_QUERY_SECONDS.time("export_page"):
+            _, rows = await connection.execute_query(
+                dialect_sql(connection, sql), values + (after or []) + [batch_size]
+            )
+        if not rows:
+            return
+        after = [rows[-1][column] for column in key]
+        yield format_rows([[row[column] for column in columns] for row in rows], columns, fmt)
+        if len(rows) < batch_size:
+            return
+
+
+def read_records(lines, fmt: str):
+    """Записи из строк файла NDJSON или CSV (с заголовком) в виде dict"""
+    if fmt == "csv":
+        yield from csv.DictReader(lines)
+        return
+    for line in lines:
+        if line.strip():
+            yield json.loads(line)
+
+
+def import_params(conn, kind: str, bot_id: int, record: dict) -> list:
+    _, columns, *_ = TABLES[kind]
+    values = {}
+    for column in columns:
+        value = record.get(column)
+        if value in ("", None) and column in NULLABLE_COLUMNS:
+            value = None
+        elif column in DATE_COLUMNS:
+            value = db_datetime(conn, parse_datetime(value))
+        elif column in INT_COLUMNS:
+            value = int(value or 0)
+        values[column] = value
+    if kind == "chats":
+        return [values["id"], values["title"][:100], values["last_message"], values["unread"],
+                values["updated"], bot_id]
+    if values["status"] == "queued":
+        # Неотправленное на момент выгрузки не отправляем повторно при восстановлении
+        values["status"], values["error"] = "failed", "Not sent before export"
+    return [values["chat_id"], values["direction"], values["text"], values["timestamp"],
+            values["status"], values["attempts"], values["error"], bot_id]
+
+
+async def import_rows(bot_id: int, kind: str, lines, fmt: str = "ndjson",
+                      batch_size: int = EXPORT_BATCH_SIZE) -> int:
+    """Загрузка выгрузки в бота bot_id пачками по batch_size строк, каждая пачка - транзакция.
+
+    Сообщения добавляются с новыми id, поэтому повторный импорт того же файла их задублирует.
+    Возвращает число загруженных строк.
+    """
+    records = read_records(lines, fmt)
+    imported = 0
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            break
+        with DB_QUERY_SECONDS.time("import_batch"):
+            async with in_transaction(WRITE_CONNECTION) as conn:
+                await conn.execute_many(
+                    dialect_sql(conn, IMPORT_SQL[kind]),
+                    [import_params(conn, kind, bot_id, record) for record in batch]
+                )
+        imported += len(batch)
+    if kind == "chats":
+        await rebuild_unread_totals()
+    return imported
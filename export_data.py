@@ -0,0 +1,60 @@
+# export_data.py
+"""Выгрузка и загрузка чатов и сообщений бота в NDJSON или CSV.
+
+    python export_data.py export --bot 1 --kind messages --since 2025-01-01 --output messages.ndjson
+    python export_data.py import --bot 1 --kind messages --input messages.ndjson
+
+Чаты загружаются раньше сообщений, чтобы счётчики непрочитанных пересчитались по ним.
+"""
+from tortoise import Tortoise, run_async
+from db import TORTOISE_CONFIG, apply_migrations
+from export import export_rows, import_rows, parse_datetime, TABLES, FORMATS
+from config import EXPORT_BATCH_SIZE
+import argparse
+import sys
+import time
+
+
+async def export_data(args):
+    output = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        async for chunk in export_rows(args.bot, args.kind, args.format, args.since, args.until,
+                                       args.chat, args.batch):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+
+async def import_data(args):
+    started = time.perf_counter()
+    source = open(args.input, encoding="utf-8", newline="") if args.input else sys.stdin
+    try:
+        imported = await import_rows(args.bot, args.kind, source, args.format, args.batch)
+    finally:
+        if args.input:
+            source.close()
+    print(f"Imported {imported} {args.kind} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+async def main(args):
+    await Tortoise.init(config=TORTOISE_CONFIG)
+    await apply_migrations()
+    if args.command == "export":
+        await export_data(args)
+    else:
+        await import_data(args)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("--bot", type=int, required=True, help="id бота")
+    parser.add_argument("--kind", choices=list(TABLES), default="messages")
+    parser.add_argument("--format", choices=list(FORMATS), default="ndjson")
+    parser.add_argument("--since", type=parse_datetime, help="с даты (включительно), ISO 8601")
+    parser.add_argument("--until", type=parse_datetime, help="до даты (не включая), ISO 8601")
+    parser.add_argument("--chat", type=int, help="только один чат")
+    parser.add_argument("--output", help="файл выгрузки (по умолчанию stdout)")
+    parser.add_argument("--input", help="файл для загрузки (по умолчанию stdin)")
+    parser.add_argument("--batch", type=int, default=EXPORT_BATCH_SIZE)
+    run_async(main(parser.parse_args()))
@@ -0,0 +1,257 @@
+from collections import OrderedDict
+from datetime import timedelta
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, DEFAULT_DESTINY
+from tortoise import connections, timezone
+from tortoise.transactions import in_transaction
+from db import WRITE_CONNECTION, dialect_sql, db_datetime, read_connection
+from metrics import DB_QUERY_SECONDS
+from config import (
+    FSM_FLUSH_INTERVAL, FSM_STATE_TTL_DAYS, FSM_CACHE_IDLE, FSM_CACHE_SIZE, FSM_CLEANUP_INTERVAL
+)
+import asyncio
+import json
+import logging
+import time
+
+UPSERT_SQL = (
+    'INSERT INTO "fsm_states" ("key", "state", "data", "updated") VALUES (?, ?, ?, ?) '
+    'ON CONFLICT ("key") DO UPDATE SET "state" = excluded."state", "data" = excluded."data", '
+    '"updated" = excluded."updated"'
+)
+DELETE_SQL = 'DELETE FROM "fsm_states" WHERE "key" = ?'
+EXPIRE_SQL = 'DELETE FROM "fsm_states" WHERE "updated" < ?'
+
+# Ключей в одном запросе загрузки (ограничение числа параметров SQLite - 32766)
+LOAD_BATCH = 500
+
+
+def storage_key(key: StorageKey) -> str:
+    """Строковый ключ состояния: bot_id:chat_id:user_id[:thread][:business][:destiny]"""
+    parts = [str(key.bot_id), str(key.chat_id), str(key.user_id)]
+    if key.thread_id:
+        parts.append(f"t{key.thread_id}")
+    if key.business_connection_id:
+        parts.append(f"b{key.business_connection_id}")
+    if key.destiny != DEFAULT_DESTINY:
+        parts.append(f"d{key.destiny}")
+    return ":".join(parts)
+
+
+class Entry:
+    """Состояние пользователя в памяти; пустое (state=None, data={}) - строки в БД нет"""
+    __slots__ = ("state", "data", "accessed")
+
+    def __init__(self, state: str = None, data: dict = None):
+        self.state = state
+        self.data = data or {}
+        self.accessed = time.monotonic()
+
+
+class DatabaseStorage(BaseStorage):
+    """Хранилище FSM aiogram в БД приложения, общее для всех ботов процесса.
+
+    Чтение идёт из кэша в памяти (состояние запрашивается на каждое обновление),
+    промахи, запрошенные одновременно, загружаются одним запросом. Изменения
+    пишутся в БД пачкой раз в flush_interval и при остановке. Состояния без
+    изменений дольше state_ttl_days удаляются из БД, без обращений дольше
+    cache_idle - из памяти.
+
+    Кэш верен, пока обновления пользователей бота обрабатывает один процесс
+    (поллинг, в том числе с шардированием). Если обновления бота приходят в разные
+    процессы (вебхук с BOT_SHARDING), чужие изменения видны после вытеснения из кэша.
+    """
+    def __init__(self, flush_interval: float = FSM_FLUSH_INTERVAL, state_ttl_days: float = FSM_STATE_TTL_DAYS,
+                 cache_idle: float = FSM_CACHE_IDLE, cache_size: int = FSM_CACHE_SIZE,
+                 cleanup_interval: float = FSM_CLEANUP_INTERVAL):
+        self.flush_interval = flush_interval
+        self.state_ttl_days = state_ttl_days
+        self.cache_idle = cache_idle
+        self.cache_size = cache_size
+        self.cleanup_interval = cleanup_interval
+        self.entries = OrderedDict()  # ключ -> Entry, от давно не использованных к недавним
+        self.dirty = set()  # ключи, изменённые после последней записи
+        self.loading = {}  # ключ -> future загрузки
+        self.load_task = None
+        self.task = None
+        self.hits = 0
+        self.misses = 0
+        self.flushed = 0
+        self.expired = 0
+
+    async def entry(self, key: str) -> Entry:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            entry.accessed = time.monotonic()
+            self.hits += 1
+            return entry
+        self.misses += 1
+        future = self.loading.get(key)
+        if future is None:
+            future = self.loading[key] = asyncio.get_running_loop().create_future()
+            if self.load_task is None:
+                self.load_task = asyncio.create_task(self.load_pending())
+        return await asyncio.shield(future)
+
+    async def load_pending(self):
+        """Загрузка ключей, запрошенных за одну итерацию цикла событий, пачками"""
+        try:
+            await asyncio.sleep(0)
+            while self.loading:
+                keys = list(self.loading)[:LOAD_BATCH]
+                try:
+                    conn = read_connection()
+                    with DB_QUERY_SECONDS.time("fsm_load"):
+                        _, rows = await conn.execute_query(dialect_sql(
+                            conn,
+                            f'SELECT "key", "state", "data" FROM "fsm_states" '
+                            f'WHERE "key" IN ({", ".join("?" * len(keys))})'
+                        ), keys)
+                except Exception as e:
+                    for key in keys:
+                        self.loading.pop(key).set_exception(e)
+                    continue
+                found = {row["key"]: row for row in rows}
+                for key in keys:
+                    row = found.get(key)
+                    entry = Entry(row["state"], json.loads(row["data"])) if row else Entry()
+                    self.entries[key] = entry
+                    self.loading.pop(key).set_result(entry)
+        finally:
+            self.load_task = None
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        key = storage_key(key)
+        entry = await self.entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self.dirty.add(key)
+
+    async def get_state(self, key: StorageKey):
+        return (await self.entry(storage_key(key))).state
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        key = storage_key(key)
+        entry = await self.entry(key)
+        entry.data = data.copy()
+        self.dirty.add(key)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        return (await self.entry(storage_key(key))).data.copy()
+
+    async def close(self) -> None:
+        # Хранилище общее для ботов: изменения записываются в stop() при остановке приложения
+        pass
+
+    def start(self):
+        """Запуск фоновой записи изменений"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run(), name="fsm-storage")
+            logging.info(
+                f"FSM storage started: flush={self.flush_interval}s, ttl={self.state_ttl_days}d, "
+                f"cache={self.cache_size}"
+            )
+
+    async def stop(self):
+        """Остановка с записью всех изменений"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    async def run(self):
+        """Фоновый цикл: запись изменений, вытеснение из памяти, удаление устаревших"""
+        loop = asyncio.get_running_loop()
+        next_cleanup = loop.time()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            flush = asyncio.ensure_future(self.flush())
+            try:
+                await asyncio.shield(flush)
+            except asyncio.CancelledError:
+                # Транзакцию не прерываем: отмена посреди неё оставляет блокировку соединения
+                await flush
+                raise
+            except Exception as e:
+                logging.error(f"FSM storage flush failed: {e}", exc_info=True)
+            try:
+                self.evict()
+                if self.state_ttl_days > 0 and loop.time() >= next_cleanup:
+                    next_cleanup = loop.time() + self.cleanup_interval
+                    await self.expire()
+            except Exception as e:
+                logging.error(f"FSM storage failed: {e}", exc_info=True)
+
+    async def flush(self) -> int:
+        """Запись изменённых состояний одной транзакцией; пустые удаляются"""
+        if not self.dirty:
+            return 0
+        keys, self.dirty = self.dirty, set()
+        # Снимок значений до первого await: дальнейшие изменения снова пометят ключ
+        writer = connections.get(WRITE_CONNECTION)
+        now = db_datetime(writer, timezone.now())
+        upserts, deletes = [], []
+        for key in keys:
+            entry = self.entries.get(key)
+            if entry is None:
+                continue
+            if entry.state is None and not entry.data:
+                deletes.append([key])
+            else:
+                upserts.append([key, entry.state, json.dumps(entry.data, ensure_ascii=False), now])
+        try:
+            with DB_QUERY_SECONDS.time("fsm_flush"):
+                async with in_transaction(WRITE_CONNECTION) as conn:
+                    if upserts:
+                        await conn.execute_many(dialect_sql(conn, UPSERT_SQL), upserts)
+                    if deletes:
+                        await conn.execute_many(dialect_sql(conn, DELETE_SQL), deletes)
+        except Exception:
+            # Не записали - запишем со следующей пачкой
+            self.dirty |= keys
+            raise
+        self.flushed += len(keys)
+        return len(keys)
+
+    def evict(self):
+        """Вытеснение из памяти давно не использованных состояний (изменённые ждут записи)"""
+        deadline = time.monotonic() - self.cache_idle
+        skipped = []
+        while self.entries:
+            key, entry = next(iter(self.entries.items()))
+            if len(self.entries) <= self.cache_size and entry.accessed > deadline:
+                break
+            self.entries.popitem(last=False)
+            if key in self.dirty:
+                skipped.append((key, entry))
+        for key, entry in skipped:
+            self.entries[key] = entry
+
+    async def expire(self) -> int:
+        """Удаление из БД состояний без изменений дольше state_ttl_days"""
+        cutoff = timezone.now() - timedelta(days=self.state_ttl_days)
+        conn = connections.get(WRITE_CONNECTION)
+        with DB_QUERY_SECONDS.time("fsm_expire"):
+            expired, _ = await conn.execute_query(dialect_sql(conn, EXPIRE_SQL), [db_datetime(conn, cutoff)])
+        if expired:
+            self.expired += expired
+            logging.info(f"FSM storage: {expired} stale states removed")
+        return expired
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self.entries),
+            "dirty": len(self.dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushed": self.flushed,
+            "expired": self.expired,
+        }
+
+
+# Общее хранилище состояний процесса
+fsm_storage = DatabaseStorage()
@@ -0,0 +1,120 @@
+from config import HUB_QUEUE_SIZE, HUB_HEARTBEAT
+import asyncio
+import json
+import logging
+
+
+class Subscription:
+    """Подписка клиента: собственная ограниченная очередь событий"""
+    def __init__(self, hub: "EventHub", topics: tuple, maxsize: int):
+        self.hub = hub
+        self.topics = topics
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.closed = False
+
+    async def get(self, timeout: float):
+        """Следующее событие (строка JSON), None при отключении или таймауте"""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.hub.unsubscribe(self)
+
+
+class EventHub:
+    """Публикация/подписка внутри процесса для отправки новых сообщений в браузер"""
+    def __init__(self, queue_size: int = HUB_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.topics = {}  # topic -> set(Subscription)
+        self.published = 0
+        self.dropped = 0  # отключено медленных клиентов
+
+    def subscribe(self, *topics) -> Subscription:
+        subscription = Subscription(self, topics, self.queue_size)
+        for topic in topics:
+            self.topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscription.closed = True
+        for topic in subscription.topics:
+            subscribers = self.topics.get(topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.topics[topic]
+
+    def publish(self, topic, event: dict):
+        """Рассылка события подписчикам темы; не ждёт клиентов"""
+        subscribers = self.topics.get(topic)
+        if not subscribers:
+            return
+        # Сериализуем один раз на всех подписчиков
+        data = json.dumps(event, ensure_ascii=False, default=str)
+        self.published += 1
+        for subscription in list(subscribers):
+            try:
+                subscription.queue.put_nowait(data)
+            except asyncio.QueueFull:
+                self.drop(subscription)
+
+    def drop(self, subscription: Subscription):
+        """Отключение клиента, который не успевает забирать события"""
+        self.unsubscribe(subscription)
+        self.dropped += 1
+        logging.warning(f"Dropped slow event subscriber: {subscription.topics}")
+        # Освобождаем очередь и будим читателя, чтобы он закрыл соединение
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+    def subscribers_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self.topics.values())
+
+
+async def event_stream(hub: EventHub, *topics, heartbeat: float = HUB_HEARTBEAT):
+    """Поток Server-Sent Events для StreamingResponse с периодическим heartbeat"""
+    # Подписываемся только когда ответ начал отправляться, иначе подписка может остаться висеть
+    subscription = hub.subscribe(*topics)
+    try:
+        yield "retry: 3000\n\n"
+        while not subscription.closed:
+            data = await subscription.get(heartbeat)
+            if data is None:
+                if subscription.closed:
+                    break
+                yield ": ping\n\n"
+            else:
+                yield f"data: {data}\n\n"
+    finally:
+        subscription.close()
+
+
+def chat_topic(bot_id: int, chat_id: int) -> tuple:
+    """Тема событий одного чата"""
+    return ("chat", bot_id, chat_id)
+
+
+def bot_topic(bot_id: int) -> tuple:
+    """Тема событий списка чатов бота"""
+    return ("bot", bot_id)
+
+
+# Общий хаб процесса
+hub = EventHub()
+
+
+def publish_message(bot_id: int, chat_id: int, text: str, direction: str, timestamp):
+    """Событие о новом сообщении: в тему чата и в тему списка чатов бота"""
+    event = {
+        "type": "message",
+        "chat_id": chat_id,
+        "text": text,
+        "direction": direction,
+        "timestamp": timestamp.isoformat(),
+        "time": timestamp.strftime('%H:%M')
+    }
+    hub.publish(chat_topic(bot_id, chat_id), event)
+    hub.publish(bot_topic(bot_id), event)
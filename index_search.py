@@ -0,0 +1,26 @@
+# index_search.py
+from tortoise import Tortoise, run_async
+from db import TORTOISE_CONFIG, apply_migrations
+from search import backfill_pending, backfill_index
+import argparse
+import time
+
+
+async def index_search(batch_size: int):
+    """Индексация сообщений, сохранённых до появления поиска (один раз после миграции)"""
+    await Tortoise.init(config=TORTOISE_CONFIG)
+    await apply_migrations()
+    pending = await backfill_pending()
+    if not pending:
+        print("Search index is up to date")
+        return
+    print(f"Indexing {pending} messages...")
+    started = time.perf_counter()
+    async for done, upto in backfill_index(batch_size):
+        print(f"- indexed up to id {done} of {upto}")
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch", type=int, default=10000)
+    run_async(index_search(parser.parse_args().batch))
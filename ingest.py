@@ -0,0 +1,308 @@
+from dataclasses import dataclass
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+from tortoise.exceptions import OperationalError, DBConnectionError
+from db import WRITE_CONNECTION, dialect_sql, db_datetime
+from models import Message
+from media import MediaInfo, media_downloader
+from hub import publish_message
+from counters import BOT_UNREAD_UPSERT_SQL
+from outbox import outbox, QUEUED
+from metrics import DB_QUERY_SECONDS
+from pages import page_cache
+from config import (
+    INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL, INGEST_QUEUE_SIZE, INGEST_MAX_ATTEMPTS, INGEST_RETRY_DELAY
+)
+import asyncio
+import logging
+
+# Вставка нового чата или обновление существующего одним запросом:
+# счётчик непрочитанных увеличивается на число сообщений в пачке.
+# id чата - глобальный id Telegram: чат другого бота с тем же id не трогаем
+CHAT_UPSERT_SQL = (
+    'INSERT INTO "chats" ("id", "title", "last_message", "unread", "updated", "bot_id") '
+    'VALUES (?, ?, ?, ?, ?, ?) '
+    'ON CONFLICT ("id") DO UPDATE SET '
+    '"last_message" = excluded."last_message", '
+    '"unread" = "chats"."unread" + excluded."unread", '
+    '"updated" = excluded."updated" '
+    'WHERE "chats"."bot_id" = excluded."bot_id"'
+)
+
+# Файл сообщения: новый - pending; уже известный боту - та же строка (файл не скачивается
+# второй раз), а после неудачной загрузки - новая попытка со свежим file_id
+MEDIA_UPSERT_SQL = (
+    'INSERT INTO "media" ("file_unique_id", "file_id", "kind", "mime_type", "file_name", "size", '
+    '"status", "attempts", "created", "bot_id") '
+    "VALUES (?, ?, ?, ?, ?, ?, 'pending', 0, ?, ?) "
+    'ON CONFLICT ("bot_id", "file_unique_id") DO UPDATE SET '
+    '"file_id" = excluded."file_id", '
+    '"status" = CASE WHEN "media"."status" = \'failed\' THEN \'pending\' ELSE "media"."status" END, '
+    '"attempts" = CASE WHEN "media"."status" = \'failed\' THEN 0 ELSE "media"."attempts" END'
+)
+
+# Ошибки БД, а не данных пачки: запись повторяется целиком, пачка не теряется
+RETRY_ERRORS = (OperationalError, DBConnectionError, ConnectionError, TimeoutError)
+
+
+@dataclass
+class IncomingMessage:
+    """Входящее сообщение, ожидающее записи в БД"""
+    bot_id: int
+    chat_id: int
+    chat_title: str
+    text: str
+    media: MediaInfo = None
+    direction = 'incoming'
+
+
+@dataclass
+class OutgoingMessage(IncomingMessage):
+    """Автоответ бота: пишется той же очередью, чтобы встать в историю после входящего,
+    и отправляется через outbox"""
+    direction = 'outgoing'
+
+
+class MessageIngestor:
+    """Очередь отложенной записи входящих сообщений (и автоответов) пачками в одной транзакции"""
+    def __init__(self, batch_size: int = INGEST_BATCH_SIZE,
+                 flush_interval: float = INGEST_FLUSH_INTERVAL,
+                 max_queue: int = INGEST_QUEUE_SIZE, max_attempts: int = INGEST_MAX_ATTEMPTS,
+                 retry_delay: float = INGEST_RETRY_DELAY):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.task = None
+        self.pending = []  # пачка, которая собирается, пишется или ждёт повтора
+        self.flushed = 0  # всего записано сообщений
+        self.batches = 0  # всего транзакций
+        self.dropped = 0  # сообщений, которые не удалось записать
+
+    async def put(self, item: IncomingMessage):
+        """Добавление сообщения; ждёт, если очередь заполнена (backpressure)"""
+        await self.queue.put(item)
+
+    def start(self):
+        """Запуск фоновой записи"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run(), name="message-ingestor")
+            logging.info(
+                f"Message ingestor started: batch={self.batch_size}, "
+                f"interval={self.flush_interval}s, queue={self.queue.maxsize}"
+            )
+
+    async def stop(self):
+        """Остановка с гарантированной записью всего, что осталось в очереди"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        rest = await self.flush(self.pending)
+        self.pending = []
+        while not self.queue.empty():
+            rest += await self.flush(self.drain(self.batch_size))
+        if rest:
+            self.dropped += len(rest)
+            logging.error(f"Message ingestor stopped with the database unavailable: {len(rest)} messages lost")
+        logging.info(f"Message ingestor stopped: {self.flushed} messages in {self.batches} batches")
+
+    def drain(self, limit: int) -> list:
+        """Забираем из очереди всё, что уже есть, но не больше limit"""
+        batch = []
+        while len(batch) < limit and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def collect(self) -> list:
+        """Ожидание пачки: до batch_size сообщений или flush_interval после первого"""
+        batch = self.pending
+        batch.append(await self.queue.get())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            batch.extend(self.drain(self.batch_size - len(batch)))
+            if len(batch) >= self.batch_size:
+                break
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        """Фоновый цикл записи"""
+        while True:
+            # Если задачу отменят во время сбора, пачка останется в self.pending
+            # и будет записана в stop(). Незаписанная из-за недоступной БД пачка тоже
+            # остаётся в self.pending и пишется снова, новые сообщения ждут в очереди
+            batch = self.pending if self.pending else await self.collect()
+            flush = asyncio.ensure_future(self.flush(batch))
+            try:
+                self.pending = await asyncio.shield(flush)
+            except asyncio.CancelledError:
+                # Транзакцию не прерываем: отмена посреди неё оставляет блокировку соединения
+                self.pending = await flush
+                raise
+            if self.pending:
+                logging.error(f"Database unavailable, {len(self.pending)} messages kept for retry")
+
+    async def flush(self, batch: list) -> list:
+        """Запись пачки с повторами; возвращает сообщения, не записанные из-за недоступной БД.
+
+        Ошибка БД - повтор всей пачки с растущей задержкой. Ошибка в данных - пачка
+        делится пополам, чтобы одно сообщение не забирало с собой остальные; сообщение,
+        которое не записывается и одно, пропускается с ошибкой в логе.
+        """
+        if not batch:
+            return []
+        delay = self.retry_delay
+        for attempt in range(1, self.max_attempts + 1):
+            now = timezone.now()
+            try:
+                media_ids = await self.write(batch, now)
+            except RETRY_ERRORS as e:
+                logging.warning(f"Failed to save batch of {len(batch)} messages (attempt {attempt}): {e}")
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(delay)
+                    delay *= 2
+            except Exception as e:
+                error = e
+                break
+            else:
+                # Транзакция зафиксирована - уведомления вне try, чтобы не записать пачку дважды
+                self.saved(batch, now, media_ids)
+                return []
+        else:
+            return batch
+        if len(batch) == 1:
+            item = batch[0]
+            self.dropped += 1
+            logging.error(
+                f"Dropping {item.direction} message of bot {item.bot_id} in chat {item.chat_id}: {error}",
+                exc_info=error
+            )
+            return []
+        logging.warning(f"Failed to save batch of {len(batch)} messages, splitting it: {error}")
+        middle = len(batch) // 2
+        rest = await self.flush(batch[:middle])
+        if rest:
+            return rest + batch[middle:]
+        return await self.flush(batch[middle:])
+
+    async def write(self, batch: list, now) -> dict:
+        """Запись пачки: bulk insert сообщений, upsert чатов и счётчиков бота в одной транзакции.
+
+        Возвращает id строк media для файлов пачки: (bot_id, file_unique_id) -> id.
+        """
+        # Сводка по чатам: число новых входящих, последнее сообщение и название
+        chats = {}
+        for item in batch:
+            key = (item.bot_id, item.chat_id)
+            count = chats[key][0] if key in chats else 0
+            # Сообщение без подписи - в списке чатов тип файла
+            text = item.text or (f"[{item.media.kind}]" if item.media else "")
+            chats[key] = (count + (item.direction == 'incoming'), text, item.chat_title)
+
+        media_ids = {}
+        with DB_QUERY_SECONDS.time("ingest_flush"):
+            async with in_transaction(WRITE_CONNECTION) as conn:
+                owned = await self.owned_chats(conn, chats)
+                # Непрочитанные бота - только по его чатам, как их посчитает upsert
+                bots = {}
+                for key in owned:
+                    if chats[key][0]:
+                        bots[key[0]] = bots.get(key[0], 0) + chats[key][0]
+                # title ограничен 100 символами: PostgreSQL, в отличие от SQLite, это проверяет
+                chat_rows = [
+                    [chat_id, title[:100], text, count, db_datetime(conn, now), bot_id]
+                    for (bot_id, chat_id), (count, text, title) in chats.items()
+                    if (bot_id, chat_id) in owned
+                ]
+                if any(item.media for item in batch):
+                    media_ids = await self.save_media(conn, batch, now)
+                await Message.bulk_create([
+                    Message(chat_id=item.chat_id, text=item.text, direction=item.direction, bot_id=item.bot_id,
+                            media_id=media_ids.get((item.bot_id, item.media.file_unique_id)) if item.media else None)
+                    if item.direction == 'incoming' else
+                    Message(chat_id=item.chat_id, text=item.text, direction=item.direction, bot_id=item.bot_id,
+                            status=QUEUED, next_attempt=now)
+                    for item in batch
+                ], using_db=conn)
+                if chat_rows:
+                    await conn.execute_many(dialect_sql(conn, CHAT_UPSERT_SQL), chat_rows)
+                if bots:
+                    await conn.execute_many(
+                        dialect_sql(conn, BOT_UNREAD_UPSERT_SQL), [list(row) for row in bots.items()]
+                    )
+        return media_ids
+
+    def saved(self, batch: list, now, media_ids: dict):
+        """Пачка в БД: уведомления страниц, outbox и загрузчика файлов"""
+        self.flushed += len(batch)
+        self.batches += 1
+        page_cache.bump("unread", *{("chats", item.bot_id) for item in batch})
+        for item in batch:
+            publish_message(item.bot_id, item.chat_id, item.text, item.direction, now)
+        if any(item.direction == 'outgoing' for item in batch):
+            # В пачке были автоответы - пора отправлять
+            outbox.wake()
+        if media_ids:
+            media_downloader.enqueue(media_ids.values())
+        logging.debug(f"Saved batch: {len(batch)} messages")
+
+    async def owned_chats(self, conn, chats: dict) -> set:
+        """(bot_id, chat_id) пачки, чьи строки chats принадлежат этому боту или будут созданы им.
+
+        Один пользователь, написавший двум ботам, - один id чата у обоих: строка chats
+        остаётся у бота, который создал её первым, сообщения второго пишутся без неё.
+        """
+        chat_ids = list({chat_id for _, chat_id in chats})
+        placeholders = ", ".join("?" * len(chat_ids))
+        _, rows = await conn.execute_query(dialect_sql(conn, (
+            f'SELECT "id", "bot_id" FROM "chats" WHERE "id" IN ({placeholders})'
+        )), chat_ids)
+        owners = {row["id"]: row["bot_id"] for row in rows}
+        owned = set()
+        for bot_id, chat_id in chats:
+            if owners.setdefault(chat_id, bot_id) == bot_id:
+                owned.add((bot_id, chat_id))
+            else:
+                logging.warning(f"Chat {chat_id} belongs to bot {owners[chat_id]}, not updating it for bot {bot_id}")
+        return owned
+
+    async def save_media(self, conn, batch: list, now) -> dict:
+        """Строки media для файлов пачки: (bot_id, file_unique_id) -> id"""
+        files = {}
+        for item in batch:
+            if item.media:
+                files[(item.bot_id, item.media.file_unique_id)] = item.media
+        await conn.execute_many(dialect_sql(conn, MEDIA_UPSERT_SQL), [
+            [media.file_unique_id, media.file_id, media.kind, media.mime_type,
+             media.file_name and media.file_name[:255], media.size, db_datetime(conn, now), bot_id]
+            for (bot_id, _), media in files.items()
+        ])
+        unique_ids = {}
+        for bot_id, file_unique_id in files:
+            unique_ids.setdefault(bot_id, []).append(file_unique_id)
+        media_ids = {}
+        for bot_id, file_unique_ids in unique_ids.items():
+            placeholders = ", ".join("?" * len(file_unique_ids))
+            _, rows = await conn.execute_query(dialect_sql(conn, (
+                'SELECT "id", "file_unique_id" FROM "media" '
+                f'WHERE "bot_id" = ? AND "file_unique_id" IN ({placeholders})'
+            )), [bot_id, *file_unique_ids])
+            for row in rows:
+                media_ids[(bot_id, row["file_unique_id"])] = row["id"]
+        return media_ids
+
+
+# Общая очередь для всех ботов процесса
+ingestor = MessageIngestor()
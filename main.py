@@ -1,17 +1,38 @@
 from fastapi import FastAPI, Request, Form, Depends, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse, PlainTextResponse
 from fastapi.templating import Jinja2Templates
 from tortoise import Tortoise
 from starlette.middleware.sessions import SessionMiddleware
-from models import Message, Chat, Bot as BotModel
-from bot import BaseBot, ShopBot, ConsultationBot, TranscriptionBot
+from models import Message, Chat, Media, ReplyRule, Bot as BotModel
+from db import TORTOISE_CONFIG, WRITE_CONNECTION, init_db
+from tortoise.transactions import in_transaction
+from tortoise.expressions import Q
+from datetime import datetime
+from manager import BotManager
+from sharding import ShardCoordinator
+from config import BOT_SHARDING, SESSION_SECRET, RETENTION_DAYS, METRICS_TOKEN, TEMPLATES_AUTO_RELOAD
+from webhook import webhook_dispatcher, check_config as check_webhook_config, router as webhook_router
+from ingest import ingestor
+from outbox import outbox
+from fsm_storage import fsm_storage
+from processing import processing_engine
+from rules import rule_router, bump_rules_version, normalize as normalize_rule, validate_rule, KINDS as RULE_KINDS
+from media import media_downloader, media_store, media_response, attach_media, STORED as MEDIA_STORED
+from archive import archiver, read_chat_archive, archive_cursor, has_archive
+from registry import bot_registry
+from tokens import token_checker, token_format_ok
+from telegram_client import telegram_client
+from hub import hub, event_stream, chat_topic, bot_topic, publish_message
+from metrics import metrics, MetricsMiddleware, DB_QUERY_SECONDS
+from pages import page_cache, page_response, HashedStaticFiles
+from counters import mark_chat_read, unread_totals, rebuild_unread_totals
+from search import search_messages, search_cursor, backfill_pending, SEARCH_PAGE_SIZE, SEARCH_PAGE_MAX
+from export import export_rows, parse_datetime, TABLES as EXPORT_TABLES, FORMATS as EXPORT_FORMATS
 import asyncio
+import hmac
 import logging
-import secrets
-import threading
-import aiohttp
 import os
+import time
 
 # Настройка логгирования
 logging.basicConfig(
@@ -19,153 +40,87 @@ logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     handlers=[logging.StreamHandler()]
 )
+# aiogram пишет INFO на каждое обновление; учёт обновлений - в метриках и log_event
+logging.getLogger("aiogram.event").setLevel(logging.WARNING)
 
 # Инициализация FastAPI
 app = FastAPI()
-app.add_middleware(SessionMiddleware, secret_key=secrets.token_hex(32))
-app.mount("/static", StaticFiles(directory="static"), name="static")
-templates = Jinja2Templates(directory="templates")
-
-# Глобальные переменные
-bot_manager = None
-
-# Конфигурация Tortoise ORM
-TORTOISE_CONFIG = {
-    "connections": {"default": "sqlite://db.sqlite3"},
-    "apps": {
-        "models": {
-            "models": ["models"],
-            "default_connection": "default",
-        }
-    },
-}
-
-class BotManager:
-    """Менеджер для управления ботами"""
-    def __init__(self):
-        self.bots = {}  # bot_id -> (bot_instance, thread)
-        self.lock = threading.Lock()
-        logging.info("BotManager initialized")
-    
-    async def start_bot(self, bot_db_instance):
-        """Запуск бота в отдельном потоке"""
-        try:
-            with self.lock:
-                bot_id = bot_db_instance.id
-                token = bot_db_instance.token
-                bot_type = bot_db_instance.bot_type
-                
-                if bot_id in self.bots:
-                    logging.warning(f"Bot {bot_id} already running")
-                    return self.bots[bot_id][0]
-                
-                # Логируем запуск
-                logging.info(f"Starting bot: ID={bot_id}, Type={bot_type}, Token={token[:5]}...")
-                
-                # Создаем экземпляр бота
-                if bot_type == 'shop':
-                    bot_instance = ShopBot(token, bot_id)
-                elif bot_type == 'consultation':
-                    bot_instance = ConsultationBot(token, bot_id)
-                elif bot_type == 'transcription':
-                    bot_instance = TranscriptionBot(token, bot_id)
-                else:
-                    bot_instance = BaseBot(token, bot_id)
-                
-                # Запускаем в отдельном потоке
-                bot_thread = threading.Thread(
-                    target=self.run_bot, 
-                    args=(bot_instance,),
-                    daemon=True
-                )
-                bot_thread.start()
-                
-                self.bots[bot_id] = (bot_instance, bot_thread)
-                logging.info(f"Bot {bot_id} started successfully")
-                return bot_instance
-        
-        except Exception as e:
-            logging.error(f"Failed to start bot {bot_db_instance.id}: {e}", exc_info=True)
-            # Деактивируем бота при ошибке запуска
-            bot_db_instance.is_active = False
-            await bot_db_instance.save()
-            raise
-    
-    async def run_bot(self, bot_instance):
-        """Запускаем бота с обработкой ошибок"""
-        try:
-            # Инициализируем ORM перед запуском
-            await bot_instance.init_orm()
-            logging.info(f"Starting bot {bot_instance.bot_id}")
-            await bot_instance.start()
-        except Exception as e:
-            logging.error(f"Bot task failed: {e}", exc_info=True)
-        finally:
-            # Удаляем бота при завершении задачи
-            async with self.lock:
-                if bot_instance.bot_id in self.bots:
-                    del self.bots[bot_instance.bot_id]
-                if bot_instance.bot_id in self.tasks:
-                    del self.tasks[bot_instance.bot_id]
-            
-            # Закрываем соединения ORM
-            if bot_instance._tortoise_inited:
-                await Tortoise.close_connections()
-                logging.info(f"Tortoise connections closed for bot {bot_instance.bot_id}")
-    
-    async def stop_bot(self, bot_id):
-        """Остановка бота"""
-        with self.lock:
-            if bot_id in self.bots:
-                bot_instance, bot_thread = self.bots[bot_id]
-                await bot_instance.stop()
-                bot_thread.join(timeout=5)
-                del self.bots[bot_id]
-    
-    async def stop_all(self):
-        """Остановка всех ботов"""
-        with self.lock:
-            for bot_id, (bot_instance, bot_thread) in list(self.bots.items()):
-                await bot_instance.stop()
-                bot_thread.join(timeout=5)
-            self.bots.clear()
+app.add_middleware(SessionMiddleware, secret_key=SESSION_SECRET)
+app.add_middleware(MetricsMiddleware)
+# Статика с хэшем содержимого в адресе кэшируется браузером надолго
+static_files = HashedStaticFiles(directory="static")
+app.mount("/static", static_files, name="static")
+# Скомпилированные шаблоны хранятся в памяти; без auto_reload - без проверки файла на каждую отрисовку
+templates = Jinja2Templates(directory="templates", auto_reload=TEMPLATES_AUTO_RELOAD)
+templates.env.globals["static_url"] = static_files.url
+app.include_router(webhook_router)
 
 # Инициализация менеджера ботов
 bot_manager = BotManager()
+# В режиме шардирования боты распределяются между воркерами, каждый запускает только свои
+shard_coordinator = ShardCoordinator(bot_manager) if BOT_SHARDING else None
+if shard_coordinator and bot_manager.mode == "webhook":
+    # Обновление может прийти в любой воркер, а не только во владельца бота
+    webhook_dispatcher.resolver = bot_manager.webhook_bot
+if shard_coordinator:
+    # Сообщения бота отправляет воркер-владелец: лимиты Telegram считаются в одном процессе
+    outbox.owned = bot_manager.bots.keys
+    # Архивирует сообщения бота тоже только владелец: два процесса не пишут в один архив
+    archiver.owned = bot_manager.bots.keys
+    # Файлы бота скачивает владелец: у него токен уже проверен и запущен
+    media_downloader.owned = bot_manager.bots.keys
 
 @app.on_event("startup")
 async def startup():
     """Инициализация при запуске"""
-    await Tortoise.init(config=TORTOISE_CONFIG)
-    await Tortoise.generate_schemas()
+    if bot_manager.mode == "webhook":
+        check_webhook_config()
+    await init_db(TORTOISE_CONFIG)
+    await rebuild_unread_totals()
+    pending = await backfill_pending()
+    if pending:
+        logging.warning(f"Search index: {pending} old messages are not indexed yet, run python index_search.py")
+    await telegram_client.start()
+    ingestor.start()
+    outbox.start()
+    fsm_storage.start()
+    media_downloader.start()
+    processing_engine.start()
+    rule_router.start()
+    archiver.start()
+    if bot_manager.mode == "webhook":
+        webhook_dispatcher.start()
     
-    # Запускаем всех активных ботов из базы
+    if shard_coordinator:
+        await shard_coordinator.start()
+        logging.info("Starting bots in background (sharded)")
+        return
+
+    # Запускаем всех активных ботов из базы в фоне: приложение принимает запросы сразу,
+    # боты подключаются по мере запуска (параллельно, с проверкой токенов)
     active_bots = await BotModel.filter(is_active=True)
-    for bot in active_bots:
-        await bot_manager.start_bot(bot)
-    logging.info(f"Started {len(active_bots)} bots on startup")
+    bot_manager.start_background(active_bots)
+    logging.info(f"Starting {len(active_bots)} bots in background")
 
 @app.on_event("shutdown")
 async def shutdown():
     """Действия при завершении работы"""
+    if shard_coordinator:
+        await shard_coordinator.stop()
+    await archiver.stop()
     await bot_manager.stop_all()
+    await webhook_dispatcher.stop()
+    # Готовые результаты обработки ещё успевают попасть в очередь записи
+    await processing_engine.stop()
+    await rule_router.stop()
+    await fsm_storage.stop()
+    await media_downloader.stop()
+    await ingestor.stop()
+    await outbox.stop()
+    await telegram_client.close()
     await Tortoise.close_connections()
     
 # Вспомогательные функции
-async def verify_token(token: str) -> bool:
-    """Проверка валидности токена бота"""
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(
-                f"https://api.telegram.org/bot{token}/getMe",
-                timeout=5
-            ) as response:
-                data = await response.json()
-                return data.get('ok', False)
-    except Exception as e:
-        logging.error(f"Token verification failed: {e}")
-        return False
-
 async def require_auth(request: Request):
     """Проверка аутентификации"""
     if "bot_id" not in request.session:
@@ -173,8 +128,8 @@ async def require_auth(request: Request):
     
     # Проверяем, что бот активен
     bot_id = request.session["bot_id"]
-    bot = await BotModel.get_or_none(id=bot_id, is_active=True)
-    if not bot:
+    bot = await bot_registry.get(bot_id)
+    if not bot or not bot.is_active:
         request.session.clear()
         return RedirectResponse(url="/login", status_code=303)
     
@@ -183,19 +138,29 @@ async def require_auth(request: Request):
 # Роуты аутентификации
 @app.get("/login", response_class=HTMLResponse)
 async def login_page(request: Request, error: str = None):
-    """Страница входа"""
-    bots = await BotModel.filter(is_active=True).all()
-    return templates.TemplateResponse("login.html", {
-        "request": request,
-        "error": error,
-        "bots": bots
-    })
+    """Страница входа (без ошибки - из кэша страниц)"""
+    if error:
+        return templates.TemplateResponse("login.html", {
+            "request": request,
+            "error": error,
+            "bots": await BotModel.filter(is_active=True).all(),
+            "unread": await unread_totals()
+        })
+    
+    async def render():
+        return templates.get_template("login.html").render(
+            bots=await BotModel.filter(is_active=True).all(),
+            unread=await unread_totals()
+        )
+    
+    page = await page_cache.get("login", ("bots", "unread"), render)
+    return page_response(request, page)
 
 @app.post("/login")
 async def login(request: Request, bot_id: int = Form(...)):
     """Обработка входа"""
-    bot = await BotModel.get_or_none(id=bot_id, is_active=True)
-    if not bot:
+    bot = await bot_registry.get(bot_id)
+    if not bot or not bot.is_active:
         return templates.TemplateResponse("login.html", {
             "request": request,
             "error": "Bot not found or inactive"
@@ -216,12 +181,16 @@ async def logout(request: Request):
 # Роуты управления ботами
 @app.get("/admin/bots", response_class=HTMLResponse)
 async def admin_bots(request: Request, auth: bool = Depends(require_auth)):
-    """Страница управления ботами"""
-    bots = await BotModel.all().order_by("-id")
-    return templates.TemplateResponse("admin/bots.html", {
-        "request": request,
-        "bots": bots
-    })
+    """Страница управления ботами (из кэша страниц)"""
+    async def render():
+        return templates.get_template("admin/bots.html").render(
+            bots=await BotModel.all().order_by("-id"),
+            unread=await unread_totals(),
+            default_retention=RETENTION_DAYS
+        )
+    
+    page = await page_cache.get("admin_bots", ("bots", "unread"), render)
+    return page_response(request, page)
 
 @app.post("/admin/bots")
 async def add_bot(
@@ -230,22 +199,24 @@ async def add_bot(
     name: str = Form(...),
     bot_type: str = Form(...)
 ):
-    """Добавление нового бота"""
-    # Проверка токена
-    if not await verify_token(token):
+    """Добавление нового бота (getMe - в фоне: бот с отклонённым токеном будет отключён)"""
+    # Без обращения к Telegram: вид токена и уже известный отказ
+    if not token_format_ok(token) or token_checker.cached(token) is False:
         return templates.TemplateResponse("admin/bots.html", {
             "request": request,
             "error": "Invalid bot token",
-            "bots": await BotModel.all()
+            "bots": await BotModel.all(),
+            "unread": await unread_totals()
         })
     
     # Проверяем, не существует ли уже бота с таким токеном
-    existing_bot = await BotModel.get_or_none(token=token)
+    existing_bot = await bot_registry.get_by_token(token)
     if existing_bot:
         return templates.TemplateResponse("admin/bots.html", {
             "request": request,
             "error": "Bot with this token already exists",
-            "bots": await BotModel.all()
+            "bots": await BotModel.all(),
+            "unread": await unread_totals()
         })
     
     # Создаем нового бота
@@ -255,9 +226,13 @@ async def add_bot(
         bot_type=bot_type,
         is_active=True
     )
+    bot_registry.invalidate(bot.id)
     
-    # Запускаем бота
-    await bot_manager.start_bot(bot)
+    # Запускаем бота в фоне (в режиме шардирования - на воркере-владельце)
+    if shard_coordinator:
+        shard_coordinator.wake()
+    else:
+        bot_manager.start_background([bot])
     
     return RedirectResponse(url="/admin/bots", status_code=303)
 
@@ -268,6 +243,14 @@ async def toggle_bot(bot_id: int):
     if not bot:
         raise HTTPException(status_code=404, detail="Bot not found")
     
+    if shard_coordinator:
+        # Состояние меняется в БД, бота запускает или останавливает воркер-владелец
+        bot.is_active = not bot.is_active
+        await bot.save()
+        bot_registry.invalidate(bot_id)
+        await shard_coordinator.reconcile()
+        return RedirectResponse(url="/admin/bots", status_code=303)
+    
     if bot.is_active:
         # Останавливаем бота
         await bot_manager.stop_bot(bot_id)
@@ -278,42 +261,262 @@ async def toggle_bot(bot_id: int):
         bot.is_active = True
     
     await bot.save()
+    bot_registry.invalidate(bot_id)
     return RedirectResponse(url="/admin/bots", status_code=303)
 
+@app.post("/admin/bots/{bot_id}/retention")
+async def set_retention(bot_id: int, retention_days: str = Form(""), auth: bool = Depends(require_auth)):
+    """Срок хранения сообщений бота в днях (пусто - общий RETENTION_DAYS, 0 - не архивировать)"""
+    if auth is not True:
+        return auth
+    try:
+        days = int(retention_days) if retention_days.strip() else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid retention")
+    if days is not None and days < 0:
+        raise HTTPException(status_code=400, detail="Invalid retention")
+    updated = await BotModel.filter(id=bot_id).update(retention_days=days)
+    if not updated:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    bot_registry.invalidate(bot_id)
+    return RedirectResponse(url="/admin/bots", status_code=303)
+
+async def render_rules(request: Request, bot_id: int, error: str = None):
+    bot = await BotModel.get_or_none(id=bot_id)
+    if not bot:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    return templates.TemplateResponse("admin/rules.html", {
+        "request": request,
+        "error": error,
+        "bot": bot,
+        "rules": await ReplyRule.filter(bot_id=bot_id).order_by("-priority", "id"),
+        "kinds": RULE_KINDS
+    }, status_code=400 if error else 200)
+
+async def rules_changed(bot_id: int, change):
+    """Изменение правил бота и отметка версии в одной транзакции, затем перестройка индекса"""
+    async with in_transaction(WRITE_CONNECTION) as conn:
+        result = await change(conn)
+        await bump_rules_version(bot_id, conn)
+    rule_router.reload(bot_id)
+    return result
+
+@app.get("/admin/bots/{bot_id}/rules", response_class=HTMLResponse)
+async def admin_rules(request: Request, bot_id: int, auth: bool = Depends(require_auth)):
+    """Автоответы бота"""
+    if auth is not True:
+        return auth
+    return await render_rules(request, bot_id)
+
+@app.post("/admin/bots/{bot_id}/rules")
+async def add_rules(
+    request: Request,
+    bot_id: int,
+    kind: str = Form(...),
+    patterns: str = Form(...),
+    reply: str = Form(...),
+    priority: int = Form(0),
+    auth: bool = Depends(require_auth)
+):
+    """Добавление правил: по одному на строку patterns, с общим ответом и приоритетом"""
+    if auth is not True:
+        return auth
+    items = [normalize_rule(kind, line) for line in patterns.splitlines() if line.strip()]
+    error = None if items else "Pattern is required"
+    for pattern in items:
+        error = error or validate_rule(kind, pattern)
+    if not reply.strip():
+        error = "Reply is required"
+    if error or not await BotModel.exists(id=bot_id):
+        return await render_rules(request, bot_id, error)
+    
+    await rules_changed(bot_id, lambda conn: ReplyRule.bulk_create([
+        ReplyRule(bot_id=bot_id, kind=kind, pattern=pattern, reply=reply.strip(), priority=priority)
+        for pattern in items
+    ], using_db=conn))
+    return RedirectResponse(url=f"/admin/bots/{bot_id}/rules", status_code=303)
+
+@app.post("/admin/bots/{bot_id}/rules/{rule_id}/toggle")
+async def toggle_rule(bot_id: int, rule_id: int, auth: bool = Depends(require_auth)):
+    """Включение/выключение правила"""
+    if auth is not True:
+        return auth
+    rule = await ReplyRule.get_or_none(id=rule_id, bot_id=bot_id)
+    if not rule:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    await rules_changed(bot_id, lambda conn: ReplyRule.filter(id=rule_id).using_db(conn).update(
+        is_active=not rule.is_active
+    ))
+    return RedirectResponse(url=f"/admin/bots/{bot_id}/rules", status_code=303)
+
+@app.post("/admin/bots/{bot_id}/rules/{rule_id}/delete")
+async def delete_rule(bot_id: int, rule_id: int, auth: bool = Depends(require_auth)):
+    """Удаление правила"""
+    if auth is not True:
+        return auth
+    deleted = await rules_changed(
+        bot_id, lambda conn: ReplyRule.filter(id=rule_id, bot_id=bot_id).using_db(conn).delete()
+    )
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    return RedirectResponse(url=f"/admin/bots/{bot_id}/rules", status_code=303)
+
 
 # Роуты для работы с чатами
+CHATS_PAGE_SIZE = 50
+
+def chat_cursor(chat) -> str:
+    """Ключ позиции в списке чатов: время последней активности и id"""
+    return f"{chat.updated.isoformat()}_{chat.id}"
+
+async def get_chats_page(bot_id: int, before: str = None, limit: int = CHATS_PAGE_SIZE) -> list:
+    """Страница списка чатов по последней активности (индекс bot_id, updated)"""
+    query = Chat.filter(bot_id=bot_id)
+    if before:
+        updated, _, chat_id = before.rpartition("_")
+        updated = datetime.fromisoformat(updated)
+        query = query.filter(Q(updated__lt=updated) | Q(updated=updated, id__lt=int(chat_id)))
+    with DB_QUERY_SECONDS.time("chats_page"):
+        return await query.order_by("-updated", "-id").limit(limit)
+
 @app.get("/chats", response_class=HTMLResponse)
-async def get_chats(request: Request, auth: bool = Depends(require_auth)):
-    """Список чатов"""
+async def get_chats(request: Request, before: str = None, auth: bool = Depends(require_auth)):
+    """Список чатов (из кэша страниц; новое сообщение или прочтение сбрасывает страницы бота)"""
+    if auth is not True:
+        return auth
     bot_id = request.session.get("bot_id")
-    bot = await BotModel.get(id=bot_id)
+    bot = await bot_registry.get(bot_id)
     
-    chats = await Chat.filter(bot=bot).order_by("-updated")
-    return templates.TemplateResponse("chats.html", {
-        "request": request,
-        "chats": chats,
-        "current_bot": bot
-    })
+    async def render():
+        try:
+            chats = await get_chats_page(bot.id, before)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        return templates.get_template("chats.html").render(
+            chats=chats,
+            current_bot=bot,
+            next_cursor=chat_cursor(chats[-1]) if len(chats) == CHATS_PAGE_SIZE else None
+        )
+    
+    page = await page_cache.get(("chats", bot.id, before), (("chats", bot.id),), render)
+    return page_response(request, page)
+
+# Размер страницы истории чата
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_PAGE_MAX = 200
+
+async def get_messages_page(bot_id: int, chat_id: int, before: int = None,
+                            after: int = None, limit: int = MESSAGES_PAGE_SIZE) -> list:
+    """Страница сообщений чата по ключу (bot_id, chat_id, id), от старых к новым"""
+    query = Message.filter(bot_id=bot_id, chat_id=chat_id)
+    if after is not None:
+        # Новые сообщения после известного id
+        query = query.filter(id__gt=after).order_by("id")
+    else:
+        if before is not None:
+            query = query.filter(id__lt=before)
+        query = query.order_by("-id")
+    with DB_QUERY_SECONDS.time("messages_page"):
+        rows = await query.limit(limit).values("id", "text", "direction", "timestamp", "status", "media_id")
+    if after is None:
+        rows.reverse()
+    return await attach_media(rows)
 
 @app.get("/chat/{chat_id}", response_class=HTMLResponse)
 async def get_chat(request: Request, chat_id: int, auth: bool = Depends(require_auth)):
-    """Просмотр чата"""
+    """Просмотр чата (последняя страница, более старые подгружаются через API)"""
+    if auth is not True:
+        return auth
     bot_id = request.session.get("bot_id")
-    bot = await BotModel.get(id=bot_id)
+    bot = await bot_registry.get(bot_id)
     
-    messages = await Message.filter(chat_id=chat_id, bot=bot).order_by("timestamp")
+    messages = await get_messages_page(bot.id, chat_id)
     chat = await Chat.get_or_none(id=chat_id, bot=bot)
     
-    if chat:
-        chat.unread = 0
-        await chat.save()
+    if chat and chat.unread:
+        await mark_chat_read(bot.id, chat_id)
     
     return templates.TemplateResponse("chat.html", {
         "request": request,
         "messages": messages,
+        "has_more": len(messages) == MESSAGES_PAGE_SIZE,
+        "has_archive": await asyncio.to_thread(has_archive, bot.id, chat_id),
         "chat": chat
     })
 
+@app.get("/api/chat/{chat_id}/messages")
+async def get_chat_messages(
+    request: Request,
+    chat_id: int,
+    before: int = None,
+    after: int = None,
+    limit: int = MESSAGES_PAGE_SIZE,
+    auth: bool = Depends(require_auth)
+):
+    """История чата страницами: ?before=<id> - более старые, ?after=<id> - новые"""
+    if auth is not True:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    
+    limit = max(1, min(limit, MESSAGES_PAGE_MAX))
+    rows = await get_messages_page(request.session["bot_id"], chat_id, before, after, limit)
+    messages = [{
+        "id": row["id"],
+        "text": row["text"],
+        "direction": row["direction"],
+        "status": row["status"],
+        "media": row["media"],
+        "timestamp": row["timestamp"].isoformat(),
+        "time": row["timestamp"].strftime('%H:%M')
+    } for row in rows]
+    
+    return {
+        "messages": messages,
+        "has_more": after is None and len(rows) == limit
+    }
+
+@app.get("/media/{media_id}")
+async def get_media(request: Request, media_id: int, auth: bool = Depends(require_auth)):
+    """Файл сообщения; Range - перемотка аудио и видео без загрузки файла целиком"""
+    if auth is not True:
+        return auth
+    media = await Media.get_or_none(id=media_id, bot_id=request.session["bot_id"], status=MEDIA_STORED)
+    if media is None:
+        raise HTTPException(status_code=404, detail="Media not found")
+    return await media_response(request, media, media_store)
+
+@app.get("/api/chat/{chat_id}/archive")
+async def get_chat_archive(
+    request: Request,
+    chat_id: int,
+    cursor: str = None,
+    limit: int = MESSAGES_PAGE_SIZE,
+    auth: bool = Depends(require_auth)
+):
+    """Архивная история чата (сообщения старше срока хранения), от новых страниц к старым"""
+    if auth is not True:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    
+    limit = max(1, min(limit, MESSAGES_PAGE_MAX))
+    try:
+        records, has_more = await asyncio.to_thread(
+            read_chat_archive, request.session["bot_id"], chat_id, cursor, limit
+        )
+    except ValueError:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=400)
+    messages = [{
+        "id": record["id"],
+        "text": record["text"],
+        "direction": record["direction"],
+        "status": record["status"],
+        "timestamp": record["timestamp"],
+        "time": datetime.fromisoformat(record["timestamp"]).strftime('%H:%M'),
+        "archived": True
+    } for record in records]
+    return {
+        "messages": messages,
+        "next_cursor": archive_cursor(records[0]) if has_more else None
+    }
+
 @app.post("/chat/{chat_id}")
 async def send_message(
     request: Request,
@@ -321,33 +524,220 @@ async def send_message(
     text: str = Form(...),
     auth: bool = Depends(require_auth)
 ):
-    """Отправка сообщения"""
+    """Отправка сообщения (в очередь outbox, запрос не ждёт Telegram)"""
+    if auth is not True:
+        return auth
     bot_id = request.session.get("bot_id")
-    bot_model = await BotModel.get(id=bot_id)
     
-    # Сохраняем исходящее сообщение
-    await Message.create(
-        chat_id=chat_id,
-        text=text,
-        direction='outgoing',
-        bot=bot_model
-    )
+    # Сохраняем исходящее сообщение со статусом queued
+    message = await outbox.enqueue(bot_id, chat_id, text)
     
     # Обновляем информацию о чате
-    chat = await Chat.get_or_none(id=chat_id, bot=bot_model)
-    if chat:
-        chat.last_message = text
-        chat.unread = 0
-        await chat.save()
+    await mark_chat_read(bot_id, chat_id, last_message=text)
+    publish_message(bot_id, chat_id, text, 'outgoing', message.timestamp)
     
-    # Отправляем сообщение через Telegram API
-    token = bot_model.token
-    async with aiohttp.ClientSession() as session:
-        async with session.post(
-            f"https://api.telegram.org/bot{token}/sendMessage",
-            json={"chat_id": chat_id, "text": text}
-        ) as response:
-            if response.status != 200:
-                logging.error(f"Failed to send message: {await response.text()}")
+    return RedirectResponse(url=f"/chat/{chat_id}", status_code=303)
+
+@app.post("/broadcast")
+async def broadcast(request: Request, text: str = Form(...), auth: bool = Depends(require_auth)):
+    """Рассылка во все чаты бота через outbox"""
+    if auth is not True:
+        return auth
+    await outbox.broadcast(request.session["bot_id"], text)
+    return RedirectResponse(url="/chats", status_code=303)
+
+
+# Поиск по сообщениям
+@app.get("/search", response_class=HTMLResponse)
+async def search_page(request: Request, q: str = "", cursor: str = None, auth: bool = Depends(require_auth)):
+    """Страница поиска по сообщениям бота"""
+    if auth is not True:
+        return auth
+    bot_id = request.session.get("bot_id")
+    bot = await bot_registry.get(bot_id)
     
-    return RedirectResponse(url=f"/chat/{chat_id}", status_code=303)
\ No newline at end of file
+    try:
+        results = await search_messages(bot.id, q, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return templates.TemplateResponse("search.html", {
+        "request": request,
+        "current_bot": bot,
+        "query": q,
+        "results": results,
+        "next_cursor": search_cursor(results[-1]) if len(results) == SEARCH_PAGE_SIZE else None
+    })
+
+@app.get("/api/search")
+async def search_api(
+    request: Request,
+    q: str,
+    cursor: str = None,
+    limit: int = SEARCH_PAGE_SIZE,
+    auth: bool = Depends(require_auth)
+):
+    """Поиск: результаты по релевантности, snippet - HTML с подсветкой <mark>"""
+    if auth is not True:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    
+    limit = max(1, min(limit, SEARCH_PAGE_MAX))
+    try:
+        results = await search_messages(request.session["bot_id"], q, cursor, limit)
+    except ValueError:
+        return JSONResponse({"error": "Invalid cursor"}, status_code=400)
+    return {
+        "results": results,
+        "next_cursor": search_cursor(results[-1]) if len(results) == limit else None
+    }
+
+
+# Выгрузка данных бота
+@app.get("/api/export/{kind}")
+async def export_data(
+    request: Request,
+    kind: str,
+    format: str = "ndjson",
+    since: str = None,
+    until: str = None,
+    chat_id: int = None,
+    auth: bool = Depends(require_auth)
+):
+    """Потоковая выгрузка чатов или сообщений бота (NDJSON или CSV); since/until - ISO 8601"""
+    if auth is not True:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    if kind not in EXPORT_TABLES or format not in EXPORT_FORMATS:
+        return JSONResponse({"error": "Unknown kind or format"}, status_code=400)
+    try:
+        since = parse_datetime(since) if since else None
+        until = parse_datetime(until) if until else None
+    except ValueError:
+        return JSONResponse({"error": "Invalid date"}, status_code=400)
+    
+    bot_id = request.session["bot_id"]
+    return StreamingResponse(
+        export_rows(bot_id, kind, format, since, until, chat_id),
+        media_type=EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="bot{bot_id}_{kind}.{format}"'}
+    )
+
+
+# Отправка событий в браузер (Server-Sent Events)
+def sse_response(*topics) -> StreamingResponse:
+    return StreamingResponse(
+        event_stream(hub, *topics),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/events/chats")
+async def chats_events(request: Request, auth: bool = Depends(require_auth)):
+    """Новые сообщения во всех чатах бота (для списка чатов)"""
+    if auth is not True:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    return sse_response(bot_topic(request.session["bot_id"]))
+
+@app.get("/api/events/chat/{chat_id}")
+async def chat_events(request: Request, chat_id: int, auth: bool = Depends(require_auth)):
+    """Новые сообщения одного чата"""
+    if auth is not True:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    return sse_response(chat_topic(request.session["bot_id"], chat_id))
+
+
+# Метрики в формате Prometheus; состояние компонентов снимается из их stats() при запросе
+INGEST_QUEUE = metrics.gauge("ingest_queue_depth", "Messages waiting to be written to the database")
+INGEST_MESSAGES = metrics.counter("ingest_messages_total", "Messages written by the ingestor")
+INGEST_BATCHES = metrics.counter("ingest_batches_total", "Ingestor write transactions")
+INGEST_DROPPED = metrics.counter("ingest_dropped_total", "Messages the ingestor could not write")
+OUTBOX_QUEUED = metrics.gauge("outbox_queued", "Outgoing messages taken into memory and waiting for rate limits")
+OUTBOX_IN_FLIGHT = metrics.gauge("outbox_in_flight", "sendMessage requests in flight")
+OUTBOX_MESSAGES = metrics.counter("outbox_messages_total", "Outgoing delivery attempts by result", ("result",))
+WEBHOOK_QUEUE = metrics.gauge("webhook_queue_depth", "Webhook updates waiting for a worker")
+WEBHOOK_UPDATES = metrics.counter("webhook_updates_total", "Webhook updates by result", ("result",))
+BOT_CACHE = metrics.counter("bot_cache_requests_total", "Bot registry lookups by result", ("result",))
+FSM_STATES = metrics.gauge("fsm_states_cached", "Bot FSM states held in memory")
+FSM_DIRTY = metrics.gauge("fsm_states_dirty", "Changed FSM states waiting to be written")
+FSM_CACHE = metrics.counter("fsm_cache_requests_total", "FSM storage lookups by result", ("result",))
+PAGE_CACHE = metrics.counter("page_cache_requests_total", "Admin page cache lookups by result", ("result",))
+EVENT_SUBSCRIBERS = metrics.gauge("event_subscribers", "Open server-sent event streams")
+ARCHIVED = metrics.counter("archived_messages_total", "Messages moved to the archive")
+MEDIA_QUEUED = metrics.gauge("media_queued", "Media files waiting for download or downloading")
+MEDIA_FILES = metrics.counter("media_files_total", "Media downloads by result", ("result",))
+MEDIA_DEDUPLICATED = metrics.counter("media_deduplicated_total", "Downloaded media files already in the store")
+MEDIA_BYTES = metrics.counter("media_downloaded_bytes_total", "Bytes of media downloaded from Telegram")
+PROCESSING_QUEUED = metrics.gauge("processing_queued", "Processing jobs waiting for a process")
+PROCESSING_JOBS = metrics.counter("processing_jobs_total", "Processing jobs by result", ("result",))
+PROCESSING_BATCHES = metrics.counter("processing_batches_total", "Job batches run in the process pool")
+REPLY_RULES = metrics.gauge("reply_rules_loaded", "Auto-reply rules compiled in this process")
+RULE_MATCHES = metrics.counter("reply_rule_matches_total", "Messages checked against auto-reply rules", ("result",))
+TOKEN_CHECKS = metrics.counter("token_checks_total", "Bot token checks via getMe by result", ("result",))
+BOT_UP = metrics.gauge("bot_up", "1 if the bot is polling (or has its webhook registered)", ("bot_id",))
+BOT_UPDATES = metrics.counter("bot_updates_total", "Telegram updates received", ("bot_id",))
+BOT_RESTARTS = metrics.counter("bot_restarts_total", "Polling restarts after a crash", ("bot_id",))
+BOT_LAST_UPDATE = metrics.gauge("bot_last_update_age_seconds", "Seconds since the last update", ("bot_id",))
+
+@metrics.collector
+def collect_app_stats():
+    INGEST_QUEUE.set(ingestor.queue.qsize())
+    INGEST_MESSAGES.set(ingestor.flushed)
+    INGEST_BATCHES.set(ingestor.batches)
+    INGEST_DROPPED.set(ingestor.dropped)
+    stats = outbox.stats()
+    OUTBOX_QUEUED.set(stats["queued"])
+    OUTBOX_IN_FLIGHT.set(stats["in_flight"])
+    for result in ("sent", "failed", "retried"):
+        OUTBOX_MESSAGES.set(stats[result], result)
+    WEBHOOK_QUEUE.set(webhook_dispatcher.queue.qsize())
+    WEBHOOK_UPDATES.set(webhook_dispatcher.processed, "processed")
+    WEBHOOK_UPDATES.set(webhook_dispatcher.rejected, "rejected")
+    stats = bot_registry.stats()
+    BOT_CACHE.set(stats["hits"], "hit")
+    BOT_CACHE.set(stats["misses"], "miss")
+    EVENT_SUBSCRIBERS.set(hub.subscribers_count())
+    stats = fsm_storage.stats()
+    FSM_STATES.set(stats["cached"])
+    FSM_DIRTY.set(stats["dirty"])
+    FSM_CACHE.set(stats["hits"], "hit")
+    FSM_CACHE.set(stats["misses"], "miss")
+    stats = page_cache.stats()
+    PAGE_CACHE.set(stats["hits"], "hit")
+    PAGE_CACHE.set(stats["misses"], "miss")
+    ARCHIVED.set(archiver.stats()["archived"])
+    stats = media_downloader.stats()
+    MEDIA_QUEUED.set(stats["queued"])
+    MEDIA_BYTES.set(stats["bytes"])
+    MEDIA_DEDUPLICATED.set(stats["deduplicated"])
+    for result in ("downloaded", "failed", "skipped"):
+        MEDIA_FILES.set(stats[result], result)
+    stats = processing_engine.stats()
+    PROCESSING_QUEUED.set(stats["queued"])
+    PROCESSING_JOBS.set(stats["completed"], "completed")
+    PROCESSING_JOBS.set(stats["failed"], "failed")
+    PROCESSING_BATCHES.set(stats["batches"])
+    stats = rule_router.stats()
+    REPLY_RULES.set(stats["rules"])
+    RULE_MATCHES.set(stats["matched"], "matched")
+    RULE_MATCHES.set(stats["unmatched"], "unmatched")
+    stats = token_checker.stats()
+    for result in ("accepted", "rejected", "failed"):
+        TOKEN_CHECKS.set(stats[result], result)
+
+    # Только боты этого процесса: остановленные пропадают из вывода
+    now = time.monotonic()
+    for metric in (BOT_UP, BOT_UPDATES, BOT_RESTARTS, BOT_LAST_UPDATE):
+        metric.clear()
+    for bot_id, health in bot_manager.health().items():
+        BOT_UP.set(int(health["running"]), bot_id)
+        BOT_UPDATES.set(health["updates"], bot_id)
+        BOT_RESTARTS.set(health["restarts"], bot_id)
+        if health["last_update"] is not None:
+            BOT_LAST_UPDATE.set(round(now - health["last_update"], 3), bot_id)
+
+@app.get("/metrics")
+async def metrics_endpoint(request: Request):
+    """Метрики процесса (у каждого воркера uvicorn - свои); METRICS_TOKEN - Bearer-токен"""
+    if METRICS_TOKEN and not hmac.compare_digest(
+        request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}"
+    ):
+        return PlainTextResponse("Unauthorized", status_code=401)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
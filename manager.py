@@ -0,0 +1,340 @@
+from aiogram.exceptions import TelegramUnauthorizedError, TelegramNotFound
+from aiogram.types import User
+from bot import BaseBot, ShopBot, ConsultationBot, TranscriptionBot
+from config import BOT_RESTART_DELAY, BOT_RESTART_MAX_DELAY, BOT_MODE, BOT_START_CONCURRENCY
+from webhook import webhook_dispatcher, webhook_url
+from registry import bot_registry
+from tokens import token_checker
+import asyncio
+import logging
+import time
+
+# Ответы Telegram, после которых токен недействителен и бот отключается; остальные ошибки
+# запуска (сеть, 5xx, 429) - временные, бот остаётся включённым и запуск повторяется
+REJECTED_ERRORS = (TelegramUnauthorizedError, TelegramNotFound)
+
+# Типы ботов, доступные в админке
+BOT_TYPES = {
+    'shop': ShopBot,
+    'consultation': ConsultationBot,
+    'transcription': TranscriptionBot,
+}
+
+
+class BotManager:
+    """Супервизор ботов: каждый бот работает как задача asyncio в цикле событий приложения.
+
+    В режиме webhook задачи поллинга не создаются: бот регистрирует вебхук,
+    а обновления принимает общий webhook_dispatcher.
+    """
+    def __init__(self, restart_delay: float = BOT_RESTART_DELAY,
+                 max_restart_delay: float = BOT_RESTART_MAX_DELAY, mode: str = BOT_MODE):
+        self.mode = mode
+        self.bots = {}  # bot_id -> bot_instance
+        self.tasks = {}  # bot_id -> asyncio.Task
+        self.restarts = {}  # bot_id -> количество перезапусков
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.locks = {}  # bot_id -> asyncio.Lock: запуск и остановка одного бота не пересекаются
+        self.starting = set()  # фоновые задачи запуска ботов
+        # bot_id -> (bot_instance, время последнего обновления): вебхуки ботов других воркеров,
+        # от давно не использованных к недавним
+        self.foreign = {}
+        logging.info("BotManager initialized")
+
+    def bot_lock(self, bot_id) -> asyncio.Lock:
+        lock = self.locks.get(bot_id)
+        if lock is None:
+            lock = self.locks[bot_id] = asyncio.Lock()
+        return lock
+
+    def create_bot(self, bot_db_instance) -> BaseBot:
+        """Создание экземпляра бота нужного типа"""
+        bot_class = BOT_TYPES.get(bot_db_instance.bot_type, BaseBot)
+        bot_instance = bot_class(bot_db_instance.token, bot_db_instance.id)
+        me = token_checker.me(bot_db_instance.token)
+        if me is not None:
+            # Поллинг aiogram начинается с getMe - ответ уже есть после проверки токена
+            bot_instance.bot._me = User.model_validate(me)
+        return bot_instance
+
+    def is_running(self, bot_id) -> bool:
+        """Проверка, запущена ли задача бота"""
+        if self.mode == "webhook":
+            return bot_id in self.bots
+        task = self.tasks.get(bot_id)
+        return task is not None and not task.done()
+
+    def health(self) -> dict:
+        """Состояние ботов процесса для /metrics: bot_id -> running, restarts, updates, last_update.
+
+        running - поллинг идёт сейчас (не ждёт перезапуска); в режиме webhook - вебхук
+        зарегистрирован (регистрация не повторяется в фоне).
+        last_update - time.monotonic() последнего обновления или None.
+        """
+        return {
+            bot_id: {
+                "running": self.is_running(bot_id) and (
+                    bot_id not in self.tasks if self.mode == "webhook" else bot_instance.running
+                ),
+                "restarts": self.restarts.get(bot_id, 0),
+                "updates": bot_instance.dp.updates,
+                "last_update": bot_instance.dp.last_update,
+            }
+            for bot_id, bot_instance in self.bots.items()
+        }
+
+    async def start_bot(self, bot_db_instance):
+        """Запуск бота как задачи в текущем цикле событий"""
+        try:
+            async with self.bot_lock(bot_db_instance.id):
+                bot_id = bot_db_instance.id
+
+                if self.is_running(bot_id):
+                    logging.warning(f"Bot {bot_id} already running")
+                    return self.bots[bot_id]
+
+                # Логируем запуск
+                logging.info(
+                    f"Starting bot: ID={bot_id}, Type={bot_db_instance.bot_type}, "
+                    f"Token={bot_db_instance.token[:5]}..."
+                )
+
+                bot_instance = self.create_bot(bot_db_instance)
+                if self.mode == "webhook":
+                    try:
+                        await bot_instance.set_webhook(webhook_url(bot_id, bot_db_instance.token))
+                    except REJECTED_ERRORS:
+                        await bot_instance.stop()
+                        raise
+                    except Exception as e:
+                        # Telegram недоступен: бот остаётся включённым, регистрация - в фоне с повторами
+                        logging.error(f"Bot {bot_id} webhook registration failed: {e}")
+                        self.bots[bot_id] = bot_instance
+                        self.restarts[bot_id] = 0
+                        self.tasks[bot_id] = asyncio.create_task(
+                            self.retry_webhook(bot_instance, bot_db_instance),
+                            name=f"bot-{bot_id}-webhook"
+                        )
+                        return bot_instance
+                    webhook_dispatcher.register(bot_instance)
+                    self.bots[bot_id] = bot_instance
+                    logging.info(f"Bot {bot_id} webhook registered")
+                    return bot_instance
+
+                self.bots[bot_id] = bot_instance
+                self.restarts[bot_id] = 0
+                self.tasks[bot_id] = asyncio.create_task(
+                    self.run_bot(bot_instance, bot_db_instance),
+                    name=f"bot-{bot_id}"
+                )
+                logging.info(f"Bot {bot_id} started successfully")
+                return bot_instance
+
+        except REJECTED_ERRORS:
+            logging.error(f"Bot {bot_db_instance.id} token rejected by Telegram, deactivating")
+            token_checker.reject(bot_db_instance.token)
+            await self.deactivate(bot_db_instance)
+            raise
+        except Exception as e:
+            # Бот остаётся включённым: запуск повторится при следующем распределении или рестарте
+            logging.error(f"Failed to start bot {bot_db_instance.id}: {e}", exc_info=True)
+            raise
+
+    async def start_bots(self, bots, concurrency: int = BOT_START_CONCURRENCY) -> dict:
+        """Запуск ботов параллельно (не больше concurrency одновременно) с проверкой токенов.
+
+        Отклонённый токен или ошибка запуска одного бота не мешают остальным.
+        Возвращает bot_id -> запущен ли бот.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        started = time.perf_counter()
+
+        async def start(bot_db_instance) -> bool:
+            async with semaphore:
+                if await token_checker.check(bot_db_instance.token) is False:
+                    logging.error(f"Bot {bot_db_instance.id} token rejected by Telegram, deactivating")
+                    await self.deactivate(bot_db_instance)
+                    return False
+                try:
+                    await self.start_bot(bot_db_instance)
+                except Exception:
+                    # Уже записано в лог (и бот с отклонённым токеном деактивирован) в start_bot
+                    return False
+                return True
+
+        results = await asyncio.gather(*(start(bot) for bot in bots))
+        if bots:
+            logging.info(f"Started {sum(results)} of {len(bots)} bots in {time.perf_counter() - started:.1f}s")
+        return {bot.id: result for bot, result in zip(bots, results)}
+
+    def start_background(self, bots) -> asyncio.Task:
+        """Запуск ботов в фоне: приложение отвечает сразу, боты подключаются по мере запуска"""
+        task = asyncio.create_task(self.start_bots(bots), name="bot-startup")
+        self.starting.add(task)
+        task.add_done_callback(self.starting.discard)
+        return task
+
+    async def retry_webhook(self, bot_instance, bot_db_instance):
+        """Регистрация вебхука с повторами (экспоненциальная задержка), пока Telegram недоступен"""
+        bot_id = bot_instance.bot_id
+        delay = self.restart_delay
+        try:
+            while True:
+                logging.info(f"Retrying bot {bot_id} webhook registration in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_restart_delay)
+                self.restarts[bot_id] = self.restarts.get(bot_id, 0) + 1
+                try:
+                    await bot_instance.set_webhook(webhook_url(bot_id, bot_db_instance.token))
+                except REJECTED_ERRORS:
+                    logging.error(f"Bot {bot_id} token rejected by Telegram, deactivating")
+                    token_checker.reject(bot_db_instance.token)
+                    self.bots.pop(bot_id, None)
+                    await bot_instance.stop()
+                    await self.deactivate(bot_db_instance)
+                    return
+                except Exception as e:
+                    logging.error(f"Bot {bot_id} webhook registration failed: {e}")
+                    continue
+                webhook_dispatcher.register(bot_instance)
+                logging.info(f"Bot {bot_id} webhook registered")
+                return
+        finally:
+            if self.tasks.get(bot_id) is asyncio.current_task():
+                del self.tasks[bot_id]
+
+    async def deactivate(self, bot_db_instance):
+        """Отключение бота в БД: токен отклонён или бот не запускается"""
+        bot_db_instance.is_active = False
+        await bot_db_instance.save()
+        bot_registry.invalidate(bot_db_instance.id)
+        await self.drop_foreign([bot_db_instance.id])
+
+    async def run_bot(self, bot_instance, bot_db_instance):
+        """Поллинг бота с перезапуском после падения (экспоненциальная задержка)"""
+        bot_id = bot_instance.bot_id
+        loop = asyncio.get_running_loop()
+        delay = self.restart_delay
+        try:
+            while True:
+                started = loop.time()
+                try:
+                    await bot_instance.start()
+                    logging.warning(f"Bot {bot_id} polling exited unexpectedly")
+                except REJECTED_ERRORS:
+                    # Токен отозван или неверен - перезапуск не поможет
+                    logging.error(f"Bot {bot_id} token rejected by Telegram, deactivating")
+                    token_checker.reject(bot_db_instance.token)
+                    await self.deactivate(bot_db_instance)
+                    return
+                except Exception as e:
+                    logging.error(f"Bot {bot_id} crashed: {e}", exc_info=True)
+
+                # Если бот проработал дольше максимальной задержки, начинаем отсчёт заново
+                if loop.time() - started >= self.max_restart_delay:
+                    delay = self.restart_delay
+
+                self.restarts[bot_id] = self.restarts.get(bot_id, 0) + 1
+                logging.info(f"Restarting bot {bot_id} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_restart_delay)
+        finally:
+            await bot_instance.stop()
+            # Удаляем бота из реестра, если за это время его не перезапустили
+            if self.tasks.get(bot_id) is asyncio.current_task():
+                del self.tasks[bot_id]
+                del self.bots[bot_id]
+
+    async def _cancel(self, bot_id):
+        """Отмена задачи бота и ожидание её завершения (вызывается под блокировкой бота)"""
+        if self.mode == "webhook":
+            retry = self.tasks.pop(bot_id, None)
+            if retry is not None:
+                retry.cancel()
+                await asyncio.gather(retry, return_exceptions=True)
+            bot_instance = self.bots.pop(bot_id, None)
+            if bot_instance is None:
+                return
+            webhook_dispatcher.unregister(bot_id)
+            try:
+                await bot_instance.delete_webhook()
+            except Exception as e:
+                logging.error(f"Failed to delete webhook for bot {bot_id}: {e}")
+            await bot_instance.stop()
+            logging.info(f"Bot {bot_id} stopped")
+            return
+        task = self.tasks.get(bot_id)
+        if task is None:
+            return
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logging.error(f"Bot {bot_id} failed while stopping: {e}", exc_info=True)
+        self.tasks.pop(bot_id, None)
+        self.bots.pop(bot_id, None)
+        logging.info(f"Bot {bot_id} stopped")
+
+    async def webhook_bot(self, bot_id):
+        """Экземпляр бота для обработки вебхука, когда ботом владеет другой воркер (шардирование).
+
+        Экземпляр переиспользуется, пока бот включён: строка бота каждый раз берётся из
+        реестра, поэтому отключённый бот перестаёт принимать обновления не позже TTL реестра.
+        Экземпляры, которым обновления не приходили дольше TTL, останавливаются.
+        """
+        await self.drop_foreign(self.idle_foreign())
+        bot_db_instance = await bot_registry.get(bot_id)
+        # Между pop и записью нет await: одновременный вызов для того же бота не создаст второй экземпляр
+        entry = self.foreign.pop(bot_id, None)
+        bot_instance = entry[0] if entry is not None else None
+        stale = None
+        if bot_db_instance is None or not bot_db_instance.is_active:
+            stale, bot_instance = bot_instance, None
+        elif bot_instance is None or bot_instance.token != bot_db_instance.token:
+            stale, bot_instance = bot_instance, self.create_bot(bot_db_instance)
+        if bot_instance is not None:
+            self.foreign[bot_id] = (bot_instance, time.monotonic())
+        if stale is not None:
+            await stale.stop()
+        return bot_instance
+
+    def idle_foreign(self) -> list:
+        """Чужие боты, которым обновления не приходили дольше TTL реестра"""
+        deadline = time.monotonic() - bot_registry.ttl
+        idle = []
+        for bot_id, (_, used_at) in self.foreign.items():
+            if used_at > deadline:
+                break
+            idle.append(bot_id)
+        return idle
+
+    async def drop_foreign(self, bot_ids):
+        """Остановка экземпляров вебхуков чужих ботов"""
+        instances = [self.foreign.pop(bot_id)[0] for bot_id in bot_ids if bot_id in self.foreign]
+        await asyncio.gather(*(bot_instance.stop() for bot_instance in instances), return_exceptions=True)
+
+    async def stop_bot(self, bot_id):
+        """Остановка бота"""
+        async with self.bot_lock(bot_id):
+            await self._cancel(bot_id)
+        await self.drop_foreign([bot_id])
+
+    async def restart_bot(self, bot_db_instance):
+        """Перезапуск бота"""
+        await self.stop_bot(bot_db_instance.id)
+        return await self.start_bot(bot_db_instance)
+
+    async def stop_bots(self, bot_ids):
+        """Остановка нескольких ботов параллельно: каждый может ждать окончания long-poll"""
+        await asyncio.gather(*(self.stop_bot(bot_id) for bot_id in bot_ids))
+
+    async def stop_all(self):
+        """Остановка всех ботов (параллельно), в том числе ещё не запущенных из фона"""
+        for task in list(self.starting):
+            task.cancel()
+        await asyncio.gather(*self.starting, return_exceptions=True)
+        await self.stop_bots(list(self.bots))
+        await self.drop_foreign(list(self.foreign))
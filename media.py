@@ -0,0 +1,395 @@
+from dataclasses import dataclass
+from urllib.parse import quote
+from fastapi import Request, HTTPException
+from fastapi.responses import Response, StreamingResponse
+from models import Media
+from registry import bot_registry
+from telegram_client import telegram_client
+from metrics import DB_QUERY_SECONDS, TELEGRAM_REQUEST_SECONDS
+from config import (
+    MEDIA_DIR, MEDIA_WORKERS, MEDIA_MAX_SIZE, MEDIA_CHUNK_SIZE, MEDIA_QUEUE_SIZE,
+    MEDIA_MAX_ATTEMPTS, MEDIA_RETRY_DELAY, TELEGRAM_HTTP_TIMEOUT
+)
+import aiohttp
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+
+# Статусы строки media
+PENDING = "pending"
+STORED = "stored"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+# Вложения aiogram Message с файлом; у фото - список размеров, берётся наибольший
+MEDIA_KINDS = ("photo", "voice", "audio", "video", "video_note", "animation", "document", "sticker")
+# Временный файл загрузки старше стольких секунд брошен упавшим процессом (загрузка
+# файла до MEDIA_MAX_SIZE занимает секунды)
+TEMPORARY_MAX_AGE = 3600
+# Тип содержимого, если Telegram его не сообщает
+DEFAULT_MIME_TYPES = {"photo": "image/jpeg", "video_note": "video/mp4"}
+# Типы, которые браузер показывает в странице чата. Тип сообщает отправитель: остальное
+# (text/html, image/svg+xml и т. п. выполнились бы как скрипт админки) - только скачиванием
+INLINE_MIME_TYPES = {
+    "image/jpeg", "image/png", "image/gif", "image/webp",
+    "audio/mpeg", "audio/ogg", "audio/mp4", "audio/aac", "audio/wav", "audio/x-wav", "audio/webm", "audio/flac",
+    "video/mp4", "video/webm", "video/quicktime", "video/ogg",
+}
+
+
+@dataclass
+class MediaInfo:
+    """Файл входящего сообщения до записи в БД"""
+    kind: str
+    file_id: str
+    file_unique_id: str
+    mime_type: str = None
+    file_name: str = None
+    size: int = None
+
+
+def media_info(message) -> MediaInfo:
+    """Файл из сообщения aiogram (None - сообщение без файла)"""
+    for kind in MEDIA_KINDS:
+        attachment = getattr(message, kind, None)
+        if not attachment:
+            continue
+        if kind == "photo":
+            attachment = attachment[-1]
+        mime_type = getattr(attachment, "mime_type", None)
+        if kind == "sticker":
+            mime_type = "video/webm" if attachment.is_video else \
+                "application/x-tgsticker" if attachment.is_animated else "image/webp"
+        return MediaInfo(
+            kind=kind,
+            file_id=attachment.file_id,
+            file_unique_id=attachment.file_unique_id,
+            mime_type=mime_type or DEFAULT_MIME_TYPES.get(kind),
+            file_name=getattr(attachment, "file_name", None),
+            size=attachment.file_size,
+        )
+    return None
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class MediaStore:
+    """Файлы по содержимому: путь - sha256, одинаковые файлы хранятся один раз.
+
+    Файл пишется во временный и переносится на место атомарно, поэтому по адресу sha256
+    лежит либо весь файл, либо ничего.
+    """
+    def __init__(self, root: str = MEDIA_DIR):
+        self.root = root
+        self.temporary_dir = os.path.join(root, "tmp")
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def cleanup(self, max_age: float = TEMPORARY_MAX_AGE):
+        """Удаление недописанных файлов упавших запусков.
+
+        Каталог общий для всех воркеров с этим MEDIA_DIR: свежие файлы могут писаться другим
+        процессом прямо сейчас, поэтому удаляются только файлы старше max_age секунд.
+        """
+        os.makedirs(self.temporary_dir, exist_ok=True)
+        expired = time.time() - max_age
+        for name in os.listdir(self.temporary_dir):
+            path = os.path.join(self.temporary_dir, name)
+            try:
+                if os.path.getmtime(path) < expired:
+                    os.unlink(path)
+            except FileNotFoundError:
+                # Другой процесс успел перенести или удалить файл
+                pass
+
+    async def save(self, chunks, max_size: int = MEDIA_MAX_SIZE) -> tuple:
+        """Запись потока блоков: (sha256, размер, был ли такой файл уже в хранилище).
+
+        Хэширование и запись идут в потоке, цикл событий ждёт только сеть.
+        """
+        os.makedirs(self.temporary_dir, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=self.temporary_dir)
+        file = os.fdopen(fd, "wb")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_size:
+                    raise MediaTooLarge(f"File is larger than {max_size} bytes")
+                await asyncio.to_thread(write_chunk, file, digest, chunk)
+            await asyncio.to_thread(file.close)
+            sha256 = digest.hexdigest()
+            existed = await asyncio.to_thread(self.commit, temporary, sha256)
+        except BaseException:
+            file.close()
+            try:
+                os.unlink(temporary)
+            except FileNotFoundError:
+                pass
+            raise
+        return sha256, size, existed
+
+    def commit(self, temporary: str, sha256: str) -> bool:
+        path = self.path(sha256)
+        if os.path.exists(path):
+            os.unlink(temporary)
+            return True
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temporary, path)
+        return False
+
+
+def write_chunk(file, digest, chunk: bytes):
+    digest.update(chunk)
+    file.write(chunk)
+
+
+class MediaDownloader:
+    """Загрузка файлов из Telegram в хранилище: очередь и ограниченный пул задач.
+
+    Обработчик бота файл не скачивает: ingestor записывает строку media и ставит её
+    в очередь после транзакции. Файл читается из Telegram потоком блоками, в памяти
+    не больше блока на загрузку. Не скачанные (очередь переполнена, ошибка, остановка)
+    остаются pending и подбираются периодической проверкой, до max_attempts попыток.
+    """
+    def __init__(self, store: MediaStore, workers: int = MEDIA_WORKERS, queue_size: int = MEDIA_QUEUE_SIZE,
+                 max_size: int = MEDIA_MAX_SIZE, chunk_size: int = MEDIA_CHUNK_SIZE,
+                 max_attempts: int = MEDIA_MAX_ATTEMPTS, retry_delay: float = MEDIA_RETRY_DELAY):
+        self.store = store
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.queued = set()  # id в очереди или в работе
+        self.owned = None  # функция -> id ботов процесса (шардирование); None - все боты
+        self.tasks = []
+        self.downloaded = 0
+        self.deduplicated = 0  # скачаны, но такой файл уже был в хранилище
+        self.failed = 0
+        self.skipped = 0
+        self.bytes = 0
+
+    def enqueue(self, media_ids):
+        """Постановка в очередь; не ждёт - не поместившиеся подберёт проверка pending"""
+        for media_id in media_ids:
+            if media_id in self.queued:
+                continue
+            try:
+                self.queue.put_nowait(media_id)
+            except asyncio.QueueFull:
+                return
+            self.queued.add(media_id)
+
+    def start(self):
+        """Запуск пула загрузки и периодической проверки pending"""
+        if not self.tasks:
+            self.store.cleanup()
+            self.tasks = [asyncio.create_task(self.rescan(), name="media-rescan")] + [
+                asyncio.create_task(self.worker(), name=f"media-worker-{i}") for i in range(self.workers)
+            ]
+            logging.info(f"Media downloader started: {self.workers} workers, store {self.store.root}")
+
+    async def stop(self):
+        """Остановка: начатые загрузки прерываются и останутся pending до следующего запуска"""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def rescan(self):
+        """pending из БД в очередь: после запуска, при переполнении очереди и для повторов"""
+        while True:
+            if self.queue.empty():
+                try:
+                    query = Media.filter(status=PENDING)
+                    if self.owned is not None:
+                        query = query.filter(bot_id__in=list(self.owned()))
+                    self.enqueue(await query.order_by("id").limit(self.queue.maxsize).values_list("id", flat=True))
+                except Exception as e:
+                    logging.error(f"Media rescan failed: {e}", exc_info=True)
+            await asyncio.sleep(self.retry_delay)
+
+    async def worker(self):
+        while True:
+            media_id = await self.queue.get()
+            try:
+                await self.download(media_id)
+            except Exception as e:
+                logging.error(f"Media {media_id} download crashed: {e}", exc_info=True)
+            finally:
+                self.queued.discard(media_id)
+                self.queue.task_done()
+
+    async def download(self, media_id: int):
+        media = await Media.get_or_none(id=media_id)
+        if media is None or media.status != PENDING:
+            return
+        bot = await bot_registry.get(media.bot_id)
+        if bot is None:
+            return
+        try:
+            if media.size and media.size > self.max_size:
+                raise MediaTooLarge(f"File is larger than {self.max_size} bytes")
+            sha256, size, existed = await self.fetch(bot.token, media)
+        except MediaTooLarge as e:
+            self.skipped += 1
+            await Media.filter(id=media_id).update(status=SKIPPED, error=str(e))
+            return
+        except Exception as e:
+            attempts = media.attempts + 1
+            status = FAILED if attempts >= self.max_attempts else PENDING
+            if status == FAILED:
+                self.failed += 1
+            logging.warning(f"Media {media_id} download failed (attempt {attempts}): {e}")
+            await Media.filter(id=media_id).update(status=status, attempts=attempts, error=str(e)[:255])
+            return
+        await Media.filter(id=media_id).update(status=STORED, sha256=sha256, size=size, error=None)
+        self.downloaded += 1
+        self.deduplicated += existed
+        self.bytes += size
+
+    async def fetch(self, token: str, media: Media) -> tuple:
+        """getFile и потоковое чтение файла в хранилище"""
+        data = await telegram_client.call(token, "getFile", file_id=media.file_id)
+        if not data.get("ok"):
+            raise RuntimeError(f"getFile: {data.get('description')}")
+        result = data["result"]
+        if (result.get("file_size") or 0) > self.max_size:
+            raise MediaTooLarge(f"File is larger than {self.max_size} bytes")
+        session = await telegram_client.get_session()
+        url = f"{telegram_client.api_url}/file/bot{token}/{result['file_path']}"
+        # Общий таймаут сессии рассчитан на вызовы API; файл ограничиваем паузами чтения
+        timeout = aiohttp.ClientTimeout(total=None, connect=5, sock_read=TELEGRAM_HTTP_TIMEOUT)
+        started = time.perf_counter()
+        async with session.get(url, timeout=timeout) as response:
+            if response.status != 200:
+                raise RuntimeError(f"File download: HTTP {response.status}")
+            stored = await self.store.save(response.content.iter_chunked(self.chunk_size), self.max_size)
+        TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started, "file")
+        return stored
+
+    def stats(self) -> dict:
+        return {
+            "queued": len(self.queued),
+            "downloaded": self.downloaded,
+            "deduplicated": self.deduplicated,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "bytes": self.bytes,
+        }
+
+
+async def attach_media(rows: list) -> list:
+    """Файлы сообщений страницы одним запросом: row["media"] - dict или None"""
+    ids = {row["media_id"] for row in rows if row.get("media_id")}
+    media = {}
+    if ids:
+        with DB_QUERY_SECONDS.time("media_page"):
+            items = await Media.filter(id__in=ids).values("id", "kind", "mime_type", "file_name", "size", "status")
+        for item in items:
+            item["url"] = f"/media/{item['id']}"
+            media[item["id"]] = item
+    for row in rows:
+        row["media"] = media.get(row.get("media_id"))
+    return rows
+
+
+def parse_range(header: str, size: int):
+    """Диапазон (start, end) из Range: bytes=a-b, bytes=a-, bytes=-n.
+
+    None - заголовок не разобран или диапазонов несколько: отдаётся весь файл;
+    ValueError - диапазон вне файла (416).
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, last = (part.strip() for part in spec.partition("-")[::2])
+    if not all(part.isdigit() for part in (first, last) if part) or not (first or last):
+        return None
+    if not first:
+        # Последние n байт
+        if int(last) == 0 or size == 0:
+            raise ValueError("Range not satisfiable")
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+async def read_file(path: str, start: int, length: int, chunk_size: int = MEDIA_CHUNK_SIZE):
+    """Чтение части файла блоками в потоке"""
+    file = await asyncio.to_thread(open, path, "rb")
+    try:
+        await asyncio.to_thread(file.seek, start)
+        while length > 0:
+            chunk = await asyncio.to_thread(file.read, min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+async def media_response(request: Request, media: Media, store: MediaStore) -> Response:
+    """Файл из хранилища: 304 по ETag (sha256), 206 по Range - перемотка аудио и видео, докачка"""
+    path = store.path(media.sha256)
+    try:
+        size = await asyncio.to_thread(os.path.getsize, path)
+    except FileNotFoundError:
+        # Строка stored, а файла нет: каталог очищен или не смонтирован на этом хосте
+        logging.warning(f"Media {media.id} file {media.sha256} is missing from the store")
+        raise HTTPException(status_code=404, detail="Media not found")
+    etag = f'"{media.sha256}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        # Содержимое по этому адресу не меняется
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "X-Content-Type-Options": "nosniff",
+    }
+    media_type = (media.mime_type or "").split(";")[0].strip().lower()
+    if media_type in INLINE_MIME_TYPES:
+        disposition = "inline"
+    else:
+        media_type, disposition = "application/octet-stream", "attachment"
+    headers["Content-Disposition"] = disposition
+    if media.file_name:
+        headers["Content-Disposition"] += f"; filename*=UTF-8''{quote(media.file_name)}"
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    start, end, status_code = 0, size - 1, 200
+    range_header = request.headers.get("range")
+    if range_header and request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            status_code = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        read_file(path, start, end - start + 1), status_code=status_code, headers=headers,
+        media_type=media_type
+    )
+
+
+# Общие хранилище и загрузчик процесса
+media_store = MediaStore()
+media_downloader = MediaDownloader(media_store)
@@ -0,0 +1,233 @@
+from bisect import bisect_left
+from config import LOG_SAMPLE_RATE
+import json
+import logging
+import math
+import random
+import time
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_value(value) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + "}"
+
+
+class Metric:
+    """Метрика с метками; значения меток передаются позиционно в порядке labels.
+
+    Без блокировок: всё обновляется из одного цикла событий, а один вызов inc/observe -
+    это несколько операций со словарём (сотни наносекунд).
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # значения меток -> значение
+
+    def clear(self):
+        self.values.clear()
+
+    def set(self, value: float, *labels):
+        """Значение целиком: для gauge и для счётчиков, которые ведёт сам компонент (stats())"""
+        self.values[labels] = value
+
+    def samples(self):
+        """[(имя, имена меток, значения меток, значение)] для вывода"""
+        for labels, value in self.values.items():
+            yield self.name, self.labels, labels, value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, label_names, label_values, value in self.samples():
+            lines.append(f"{name}{format_labels(label_names, label_values)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        values = self.values
+        values[labels] = values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+
+class Timer:
+    """Контекстный менеджер: длительность блока в гистограмму"""
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: "Histogram", labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        # Счётчики по корзинам (последняя - +Inf) и сумма; накопительные - при выводе
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def time(self, *labels) -> Timer:
+        return Timer(self, labels)
+
+    def samples(self):
+        label_names = self.labels + ("le",)
+        for labels, series in self.values.items():
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), series):
+                total += count
+                yield f"{self.name}_bucket", label_names, labels + (format_value(bound),), total
+            yield f"{self.name}_sum", self.labels, labels, series[-1]
+            yield f"{self.name}_count", self.labels, labels, total
+
+
+class Registry:
+    """Метрики процесса и функции, обновляющие gauge перед выводом"""
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, function):
+        """Функция без аргументов, вызываемая перед каждым выводом (можно как декоратор)"""
+        self.collectors.append(function)
+        return function
+
+    def render(self) -> str:
+        """Текстовый формат Prometheus (text/plain; version=0.0.4)"""
+        for function in self.collectors:
+            try:
+                function()
+            except Exception as e:
+                logging.error(f"Metrics collector {function.__name__} failed: {e}", exc_info=True)
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Метрики процесса
+metrics = Registry()
+
+DB_QUERY_SECONDS = metrics.histogram("db_query_seconds", "Database operation latency", ("query",))
+DB_LOCK_WAIT_SECONDS = metrics.histogram(
+    "db_lock_wait_seconds", "Time spent waiting for a SQLite connection busy with another query or transaction",
+    ("role",), buckets=(0.0001, 0.0005) + DEFAULT_BUCKETS
+)
+TELEGRAM_REQUEST_SECONDS = metrics.histogram(
+    "telegram_request_seconds", "Telegram Bot API request latency", ("method",)
+)
+TELEGRAM_RESPONSES = metrics.counter(
+    "telegram_responses_total", "Telegram Bot API responses by HTTP status or error", ("method", "code")
+)
+PROCESSING_JOB_SECONDS = metrics.histogram(
+    "processing_job_seconds", "Processing job latency from submit to result", ("processor",)
+)
+HTTP_REQUEST_SECONDS = metrics.histogram(
+    "http_request_seconds", "Web interface response time (until response headers)", ("method", "route", "status")
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware: время ответа по шаблону маршрута (/chat/{chat_id}, а не каждый id).
+
+    Время считается до заголовков ответа, иначе потоковые ответы (SSE, выгрузка)
+    учитывались бы на всю длительность соединения.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        recorded = False
+
+        def record(status):
+            nonlocal recorded
+            recorded = True
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started, scope["method"], route.path if route else "other", status
+            )
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            if not recorded:
+                record(500)
+            raise
+
+
+def sampled(sample_rate: float = LOG_SAMPLE_RATE) -> bool:
+    """Попадает ли событие в выборку лога; проверяется до вызова log_event, чтобы
+    на горячем пути не собирать поля для записей, которые не будут написаны"""
+    return random.random() < sample_rate
+
+
+def log_event(event: str, sample_rate: float = 1.0, level: int = logging.INFO, **fields):
+    """Структурированная запись лога (event=... key=value).
+
+    sample_rate - доля событий, прошедших sampled(); поле sample позволяет пересчитать объём.
+    """
+    if not logging.root.isEnabledFor(level):
+        return
+    parts = [f"event={event}", f"sample={sample_rate:g}"]
+    parts.extend(
+        f"{key}={json.dumps(value, ensure_ascii=False) if isinstance(value, str) else value}"
+        for key, value in fields.items()
+    )
+    logging.log(level, " ".join(parts))
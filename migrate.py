@@ -0,0 +1,18 @@
+# migrate.py
+from tortoise import Tortoise, run_async
+from db import TORTOISE_CONFIG, apply_migrations, load_migrations
+
+
+async def migrate():
+    """Применение новых миграций к базе из конфигурации (DATABASE_URL или DB_PATH)"""
+    await Tortoise.init(config=TORTOISE_CONFIG)
+    applied = await apply_migrations()
+    if applied:
+        print("Applied migrations:")
+        for version in applied:
+            print(f"- {version}")
+    else:
+        print(f"Database is up to date ({len(load_migrations())} migrations)")
+
+if __name__ == "__main__":
+    run_async(migrate())
@@ -0,0 +1,73 @@
+"""Начальная схема: боты, чаты, сообщения и счётчики непрочитанных.
+
+Совпадает со схемой, которую создавал generate_schemas, поэтому существующие базы SQLite
+принимают её без изменений (IF NOT EXISTS).
+"""
+
+UPGRADE = {
+    "sqlite": [
+        '''CREATE TABLE IF NOT EXISTS "bots" (
+            "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            "token" VARCHAR(100) NOT NULL UNIQUE,
+            "name" VARCHAR(100) NOT NULL,
+            "bot_type" VARCHAR(50) NOT NULL,
+            "is_active" INT NOT NULL DEFAULT 1,
+            "created_at" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS "bot_stats" (
+            "unread" INT NOT NULL DEFAULT 0,
+            "bot_id" INT NOT NULL PRIMARY KEY REFERENCES "bots" ("id") ON DELETE CASCADE
+        )''',
+        '''CREATE TABLE IF NOT EXISTS "chats" (
+            "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            "title" VARCHAR(100) NOT NULL,
+            "last_message" TEXT NOT NULL,
+            "unread" INT NOT NULL DEFAULT 0,
+            "updated" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            "bot_id" INT NOT NULL REFERENCES "bots" ("id") ON DELETE CASCADE
+        )''',
+        'CREATE INDEX IF NOT EXISTS "idx_chats_bot_id_f78889" ON "chats" ("bot_id", "updated")',
+        '''CREATE TABLE IF NOT EXISTS "messages" (
+            "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            "chat_id" BIGINT NOT NULL,
+            "text" TEXT NOT NULL,
+            "direction" VARCHAR(10) NOT NULL,
+            "timestamp" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            "bot_id" INT NOT NULL REFERENCES "bots" ("id") ON DELETE CASCADE
+        )''',
+        'CREATE INDEX IF NOT EXISTS "idx_messages_bot_id_f40575" ON "messages" ("bot_id", "chat_id", "id")',
+    ],
+    "postgres": [
+        '''CREATE TABLE IF NOT EXISTS "bots" (
+            "id" SERIAL NOT NULL PRIMARY KEY,
+            "token" VARCHAR(100) NOT NULL UNIQUE,
+            "name" VARCHAR(100) NOT NULL,
+            "bot_type" VARCHAR(50) NOT NULL,
+            "is_active" BOOL NOT NULL DEFAULT True,
+            "created_at" TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS "bot_stats" (
+            "unread" INT NOT NULL DEFAULT 0,
+            "bot_id" INT NOT NULL PRIMARY KEY REFERENCES "bots" ("id") ON DELETE CASCADE
+        )''',
+        # id чата задаёт Telegram (в группах - отрицательные 64-битные), поэтому без sequence
+        '''CREATE TABLE IF NOT EXISTS "chats" (
+            "id" BIGINT NOT NULL PRIMARY KEY,
+            "title" VARCHAR(100) NOT NULL,
+            "last_message" TEXT NOT NULL,
+            "unread" INT NOT NULL DEFAULT 0,
+            "updated" TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            "bot_id" INT NOT NULL REFERENCES "bots" ("id") ON DELETE CASCADE
+        )''',
+        'CREATE INDEX IF NOT EXISTS "idx_chats_bot_id_f78889" ON "chats" ("bot_id", "updated")',
+        '''CREATE TABLE IF NOT EXISTS "messages" (
+            "id" SERIAL NOT NULL PRIMARY KEY,
+            "chat_id" BIGINT NOT NULL,
+            "text" TEXT NOT NULL,
+            "direction" VARCHAR(10) NOT NULL,
+            "timestamp" TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            "bot_id" INT NOT NULL REFERENCES "bots" ("id") ON DELETE CASCADE
+        )''',
+        'CREATE INDEX IF NOT EXISTS "idx_messages_bot_id_f40575" ON "messages" ("bot_id", "chat_id", "id")',
+    ],
+}
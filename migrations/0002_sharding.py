@@ -0,0 +1,30 @@
+"""Воркеры и аренды ботов для режима шардирования (BOT_SHARDING)"""
+
+UPGRADE = {
+    "sqlite": [
+        '''CREATE TABLE IF NOT EXISTS "workers" (
+            "id" VARCHAR(100) NOT NULL PRIMARY KEY,
+            "heartbeat" TIMESTAMP NOT NULL,
+            "started" TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS "bot_leases" (
+            "worker_id" VARCHAR(100) NOT NULL,
+            "expires" TIMESTAMP NOT NULL,
+            "bot_id" INT NOT NULL PRIMARY KEY REFERENCES "bots" ("id") ON DELETE CASCADE
+        )''',
+        'CREATE INDEX IF NOT EXISTS "idx_bot_leases_worker__c10a36" ON "bot_leases" ("worker_id")',
+    ],
+    "postgres": [
+        '''CREATE TABLE IF NOT EXISTS "workers" (
+            "id" VARCHAR(100) NOT NULL PRIMARY KEY,
+            "heartbeat" TIMESTAMPTZ NOT NULL,
+            "started" TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS "bot_leases" (
+            "worker_id" VARCHAR(100) NOT NULL,
+            "expires" TIMESTAMPTZ NOT NULL,
+            "bot_id" INT NOT NULL PRIMARY KEY REFERENCES "bots" ("id") ON DELETE CASCADE
+        )''',
+        'CREATE INDEX IF NOT EXISTS "idx_bot_leases_worker__c10a36" ON "bot_leases" ("worker_id")',
+    ],
+}
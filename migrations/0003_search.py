@@ -0,0 +1,41 @@
+"""Полнотекстовый поиск по сообщениям.
+
+SQLite: таблица FTS5 поверх messages, которую поддерживают триггеры. Сообщения, уже
+лежавшие в базе на момент миграции (id <= upto), индексирует python index_search.py
+пачками; триггеры удаления и изменения трогают только проиндексированные строки.
+
+PostgreSQL: вычисляемая колонка tsvector и GIN-индекс, индексируются сразу все строки.
+"""
+
+# Строка уже есть в индексе FTS5: новее отметки upto или обработана index_search.py
+INDEXED = (
+    '(old."id" > (SELECT "upto" FROM "search_backfill") '
+    'OR old."id" <= (SELECT "done" FROM "search_backfill"))'
+)
+
+UPGRADE = {
+    "sqlite": [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS "messages_fts" USING fts5(
+            "text", content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+        )''',
+        'CREATE TABLE IF NOT EXISTS "search_backfill" ("upto" INT NOT NULL, "done" INT NOT NULL)',
+        'INSERT INTO "search_backfill" ("upto", "done") SELECT COALESCE(MAX("id"), 0), 0 FROM "messages"',
+        '''CREATE TRIGGER IF NOT EXISTS "messages_fts_insert" AFTER INSERT ON "messages" BEGIN
+            INSERT INTO "messages_fts" (rowid, "text") VALUES (new."id", new."text");
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS "messages_fts_delete" AFTER DELETE ON "messages"
+        WHEN {INDEXED} BEGIN
+            INSERT INTO "messages_fts" ("messages_fts", rowid, "text") VALUES ('delete', old."id", old."text");
+        END''',
+        f'''CREATE TRIGGER IF NOT EXISTS "messages_fts_update" AFTER UPDATE OF "text" ON "messages"
+        WHEN {INDEXED} BEGIN
+            INSERT INTO "messages_fts" ("messages_fts", rowid, "text") VALUES ('delete', old."id", old."text");
+            INSERT INTO "messages_fts" (rowid, "text") VALUES (new."id", new."text");
+        END''',
+    ],
+    "postgres": [
+        '''ALTER TABLE "messages" ADD COLUMN IF NOT EXISTS "search" tsvector
+            GENERATED ALWAYS AS (to_tsvector('simple', "text")) STORED''',
+        'CREATE INDEX IF NOT EXISTS "idx_messages_search" ON "messages" USING GIN ("search")',
+    ],
+}
@@ -0,0 +1,26 @@
+"""Очередь исходящих сообщений: статус доставки прямо в строке messages.
+
+Исходящее сообщение записывается со статусом queued и отправляется фоновым outbox;
+после отправки статус sent, после исчерпания попыток или отказа Telegram - failed.
+У входящих и старых исходящих сообщений статус пустой.
+"""
+
+UPGRADE = {
+    "sqlite": [
+        'ALTER TABLE "messages" ADD COLUMN "status" VARCHAR(10)',
+        'ALTER TABLE "messages" ADD COLUMN "attempts" INT NOT NULL DEFAULT 0',
+        'ALTER TABLE "messages" ADD COLUMN "next_attempt" TIMESTAMP',
+        'ALTER TABLE "messages" ADD COLUMN "error" VARCHAR(255)',
+        # Частичный индекс: в нём только неотправленные сообщения, он остаётся маленьким
+        '''CREATE INDEX IF NOT EXISTS "idx_messages_outbox" ON "messages" ("next_attempt")
+            WHERE "status" = 'queued' ''',
+    ],
+    "postgres": [
+        'ALTER TABLE "messages" ADD COLUMN IF NOT EXISTS "status" VARCHAR(10)',
+        'ALTER TABLE "messages" ADD COLUMN IF NOT EXISTS "attempts" INT NOT NULL DEFAULT 0',
+        'ALTER TABLE "messages" ADD COLUMN IF NOT EXISTS "next_attempt" TIMESTAMPTZ',
+        'ALTER TABLE "messages" ADD COLUMN IF NOT EXISTS "error" VARCHAR(255)',
+        '''CREATE INDEX IF NOT EXISTS "idx_messages_outbox" ON "messages" ("next_attempt")
+            WHERE "status" = 'queued' ''',
+    ],
+}
@@ -0,0 +1,17 @@
+"""Срок хранения сообщений бота и индекс для выборки старых сообщений.
+
+retention_days - свой срок бота в днях (NULL - общий RETENTION_DAYS, 0 - хранить всё).
+Индекс (bot_id, timestamp) нужен фоновому архиватору: без него поиск сообщений старше
+срока обходил бы всю историю бота.
+"""
+
+UPGRADE = {
+    "sqlite": [
+        'ALTER TABLE "bots" ADD COLUMN "retention_days" INT',
+        'CREATE INDEX IF NOT EXISTS "idx_messages_bot_timestamp" ON "messages" ("bot_id", "timestamp")',
+    ],
+    "postgres": [
+        'ALTER TABLE "bots" ADD COLUMN IF NOT EXISTS "retention_days" INT',
+        'CREATE INDEX IF NOT EXISTS "idx_messages_bot_timestamp" ON "messages" ("bot_id", "timestamp")',
+    ],
+}
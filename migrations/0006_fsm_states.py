@@ -0,0 +1,26 @@
+"""Состояния FSM ботов (вместо MemoryStorage в каждом боте).
+
+key - bot_id:chat_id:user_id[...] из StorageKey aiogram; data - JSON. Индекс по updated
+нужен для удаления состояний без изменений дольше FSM_STATE_TTL_DAYS.
+"""
+
+UPGRADE = {
+    "sqlite": [
+        '''CREATE TABLE IF NOT EXISTS "fsm_states" (
+            "key" VARCHAR(255) NOT NULL PRIMARY KEY,
+            "state" VARCHAR(255),
+            "data" TEXT NOT NULL,
+            "updated" TIMESTAMP NOT NULL
+        ) WITHOUT ROWID''',
+        'CREATE INDEX IF NOT EXISTS "idx_fsm_states_updated" ON "fsm_states" ("updated")',
+    ],
+    "postgres": [
+        '''CREATE TABLE IF NOT EXISTS "fsm_states" (
+            "key" VARCHAR(255) NOT NULL PRIMARY KEY,
+            "state" VARCHAR(255),
+            "data" TEXT NOT NULL,
+            "updated" TIMESTAMPTZ NOT NULL
+        )''',
+        'CREATE INDEX IF NOT EXISTS "idx_fsm_states_updated" ON "fsm_states" ("updated")',
+    ],
+}
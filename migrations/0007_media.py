@@ -0,0 +1,50 @@
+"""Медиафайлы сообщений (фото, голосовые, документы...).
+
+media - метаданные файла Telegram и его sha256 в хранилище media.py; одинаковые файлы
+хранятся на диске один раз. Строка на (бот, file_unique_id): повторная пересылка того же
+файла боту не скачивает его заново. messages.media_id - файл сообщения.
+"""
+
+UPGRADE = {
+    "sqlite": [
+        '''CREATE TABLE IF NOT EXISTS "media" (
+            "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            "file_unique_id" VARCHAR(64) NOT NULL,
+            "file_id" VARCHAR(255) NOT NULL,
+            "kind" VARCHAR(20) NOT NULL,
+            "mime_type" VARCHAR(100),
+            "file_name" VARCHAR(255),
+            "size" BIGINT,
+            "sha256" VARCHAR(64),
+            "status" VARCHAR(10) NOT NULL DEFAULT 'pending',
+            "attempts" INT NOT NULL DEFAULT 0,
+            "error" VARCHAR(255),
+            "created" TIMESTAMP NOT NULL,
+            "bot_id" INT NOT NULL REFERENCES "bots" ("id") ON DELETE CASCADE
+        )''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS "uidx_media_bot_file" ON "media" ("bot_id", "file_unique_id")',
+        # Частичный индекс очереди загрузки: только файлы, которые ещё не скачаны
+        '''CREATE INDEX IF NOT EXISTS "idx_media_pending" ON "media" ("id") WHERE "status" = 'pending' ''',
+        'ALTER TABLE "messages" ADD COLUMN "media_id" INT REFERENCES "media" ("id") ON DELETE SET NULL',
+    ],
+    "postgres": [
+        '''CREATE TABLE IF NOT EXISTS "media" (
+            "id" SERIAL NOT NULL PRIMARY KEY,
+            "file_unique_id" VARCHAR(64) NOT NULL,
+            "file_id" VARCHAR(255) NOT NULL,
+            "kind" VARCHAR(20) NOT NULL,
+            "mime_type" VARCHAR(100),
+            "file_name" VARCHAR(255),
+            "size" BIGINT,
+            "sha256" VARCHAR(64),
+            "status" VARCHAR(10) NOT NULL DEFAULT 'pending',
+            "attempts" INT NOT NULL DEFAULT 0,
+            "error" VARCHAR(255),
+            "created" TIMESTAMPTZ NOT NULL,
+            "bot_id" INT NOT NULL REFERENCES "bots" ("id") ON DELETE CASCADE
+        )''',
+        'CREATE UNIQUE INDEX IF NOT EXISTS "uidx_media_bot_file" ON "media" ("bot_id", "file_unique_id")',
+        '''CREATE INDEX IF NOT EXISTS "idx_media_pending" ON "media" ("id") WHERE "status" = 'pending' ''',
+        'ALTER TABLE "messages" ADD COLUMN IF NOT EXISTS "media_id" INT REFERENCES "media" ("id") ON DELETE SET NULL',
+    ],
+}
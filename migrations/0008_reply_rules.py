@@ -0,0 +1,37 @@
+"""Автоответы ботов, настраиваемые в админке (rules.py).
+
+reply_rules - правило бота: команда, ключевое слово или регулярное выражение и текст ответа.
+bots.rules_version увеличивается при каждом изменении правил бота: по нему процессы узнают,
+что скомпилированный индекс правил устарел, не перечитывая сами правила.
+"""
+
+UPGRADE = {
+    "sqlite": [
+        '''CREATE TABLE IF NOT EXISTS "reply_rules" (
+            "id" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            "kind" VARCHAR(10) NOT NULL,
+            "pattern" VARCHAR(255) NOT NULL,
+            "reply" TEXT NOT NULL,
+            "priority" INT NOT NULL DEFAULT 0,
+            "is_active" INT NOT NULL DEFAULT 1,
+            "created" TIMESTAMP NOT NULL,
+            "bot_id" INT NOT NULL REFERENCES "bots" ("id") ON DELETE CASCADE
+        )''',
+        'CREATE INDEX IF NOT EXISTS "idx_reply_rules_bot" ON "reply_rules" ("bot_id")',
+        'ALTER TABLE "bots" ADD COLUMN "rules_version" INT NOT NULL DEFAULT 0',
+    ],
+    "postgres": [
+        '''CREATE TABLE IF NOT EXISTS "reply_rules" (
+            "id" SERIAL NOT NULL PRIMARY KEY,
+            "kind" VARCHAR(10) NOT NULL,
+            "pattern" VARCHAR(255) NOT NULL,
+            "reply" TEXT NOT NULL,
+            "priority" INT NOT NULL DEFAULT 0,
+            "is_active" BOOL NOT NULL DEFAULT TRUE,
+            "created" TIMESTAMPTZ NOT NULL,
+            "bot_id" INT NOT NULL REFERENCES "bots" ("id") ON DELETE CASCADE
+        )''',
+        'CREATE INDEX IF NOT EXISTS "idx_reply_rules_bot" ON "reply_rules" ("bot_id")',
+        'ALTER TABLE "bots" ADD COLUMN IF NOT EXISTS "rules_version" INT NOT NULL DEFAULT 0',
+    ],
+}
@@ -7,6 +7,10 @@ class Bot(models.Model):
     bot_type = fields.CharField(max_length=50)
     is_active = fields.BooleanField(default=True)
     created_at = fields.DatetimeField(auto_now_add=True)
+    # Срок хранения сообщений в днях: None - общий RETENTION_DAYS, 0 - без архивации
+    retention_days = fields.IntField(null=True)
+    # Растёт при каждом изменении автоответов бота (ReplyRule)
+    rules_version = fields.IntField(default=0)
     
     class Meta:
         table = "bots"
@@ -18,12 +22,23 @@ class Message(models.Model):
     direction = fields.CharField(max_length=10)
     timestamp = fields.DatetimeField(auto_now_add=True)
     bot = fields.ForeignKeyField('models.Bot', related_name='messages')
+    # Доставка исходящих через outbox: queued, sent или failed (у входящих - None)
+    status = fields.CharField(max_length=10, null=True)
+    attempts = fields.IntField(default=0)
+    next_attempt = fields.DatetimeField(null=True)
+    error = fields.CharField(max_length=255, null=True)
+    # Фото, голосовое, документ и т.п. (text - подпись к нему)
+    media = fields.ForeignKeyField('models.Media', related_name='messages', null=True,
+                                   on_delete=fields.SET_NULL)
     
     class Meta:
         table = "messages"
+        indexes = [
+            ("bot", "chat_id", "id")
+        ]
 
 class Chat(models.Model):
-    id = fields.BigIntField(pk=True)
+    id = fields.BigIntField(pk=True, generated=False)  # id чата в Telegram
     title = fields.CharField(max_length=100)
     last_message = fields.TextField()
     unread = fields.IntField(default=0)
@@ -34,4 +49,77 @@ class Chat(models.Model):
         table = "chats"
         indexes = [
             ("bot", "updated")
-        ]
\ No newline at end of file
+        ]
+class BotStats(models.Model):
+    bot = fields.OneToOneField('models.Bot', related_name='stats', pk=True)
+    unread = fields.IntField(default=0)
+    
+    class Meta:
+        table = "bot_stats"
+
+# Процесс приложения в режиме шардирования; heartbeat обновляется периодически
+class Worker(models.Model):
+    id = fields.CharField(max_length=100, pk=True)
+    heartbeat = fields.DatetimeField()
+    started = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "workers"
+
+# Аренда бота воркером: бот работает только в процессе, который держит аренду
+class BotLease(models.Model):
+    bot = fields.OneToOneField('models.Bot', related_name='lease', pk=True)
+    worker_id = fields.CharField(max_length=100)
+    expires = fields.DatetimeField()
+
+    class Meta:
+        table = "bot_leases"
+        indexes = [
+            ("worker_id",)
+        ]
+
+# Состояние FSM пользователя бота (fsm_storage.py); data - JSON
+class FsmState(models.Model):
+    key = fields.CharField(max_length=255, pk=True)
+    state = fields.CharField(max_length=255, null=True)
+    data = fields.TextField()
+    updated = fields.DatetimeField()
+
+    class Meta:
+        table = "fsm_states"
+
+# Файл из сообщения: метаданные Telegram и sha256 содержимого в хранилище (media.py)
+class Media(models.Model):
+    id = fields.IntField(pk=True)
+    bot = fields.ForeignKeyField('models.Bot', related_name='media')
+    file_unique_id = fields.CharField(max_length=64)
+    file_id = fields.CharField(max_length=255)
+    kind = fields.CharField(max_length=20)  # photo, voice, audio, video, document...
+    mime_type = fields.CharField(max_length=100, null=True)
+    file_name = fields.CharField(max_length=255, null=True)
+    size = fields.BigIntField(null=True)
+    sha256 = fields.CharField(max_length=64, null=True)
+    # pending - ждёт загрузки, stored - в хранилище, failed - не скачался, skipped - больше MEDIA_MAX_SIZE
+    status = fields.CharField(max_length=10, default="pending")
+    attempts = fields.IntField(default=0)
+    error = fields.CharField(max_length=255, null=True)
+    created = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "media"
+        unique_together = (("bot", "file_unique_id"),)
+
+# Автоответ бота (rules.py): команда, ключевое слово или регулярное выражение
+class ReplyRule(models.Model):
+    id = fields.IntField(pk=True)
+    bot = fields.ForeignKeyField('models.Bot', related_name='reply_rules')
+    kind = fields.CharField(max_length=10)  # command, keyword, regex
+    pattern = fields.CharField(max_length=255)
+    reply = fields.TextField()
+    # Из нескольких подходящих правил отвечает правило с большим приоритетом
+    priority = fields.IntField(default=0)
+    is_active = fields.BooleanField(default=True)
+    created = fields.DatetimeField(auto_now_add=True)
+
+    class Meta:
+        table = "reply_rules"
@@ -0,0 +1,359 @@
+from collections import Counter, deque
+from datetime import timedelta
+from tortoise import timezone
+from tortoise.transactions import in_transaction
+from db import WRITE_CONNECTION, dialect_sql, db_datetime
+from models import Message, Chat
+from registry import bot_registry
+from telegram_client import telegram_client
+from metrics import DB_QUERY_SECONDS
+from pages import page_cache
+from config import (
+    OUTBOX_BOT_RATE, OUTBOX_CHAT_RATE, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_DELAY,
+    OUTBOX_POLL_INTERVAL, OUTBOX_PREFETCH, OUTBOX_CLAIM_TTL
+)
+import asyncio
+import logging
+import time
+
+# Статусы доставки исходящего сообщения
+QUEUED = "queued"
+SENT = "sent"
+FAILED = "failed"
+
+# Итог попытки отправки
+RESULT_SQL = 'UPDATE "messages" SET "status" = ?, "attempts" = ?, "next_attempt" = ?, "error" = ? WHERE "id" = ?'
+
+# Сколько строк забирать из БД за один опрос и сколько чатов обновлять одним запросом
+FETCH_LIMIT = 1000
+BROADCAST_CHUNK = 500
+
+
+class TokenBucket:
+    """Ограничение частоты: rate событий в секунду, всплеск до capacity.
+
+    По умолчанию без всплесков - события идут равномерно, как того ждёт Telegram.
+    """
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Сколько секунд ждать свободного токена (0 - можно сейчас)"""
+        self.refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self):
+        self.refill()
+        self.tokens -= 1
+
+    async def acquire(self):
+        while (delay := self.delay()) > 0:
+            await asyncio.sleep(delay)
+        self.take()
+
+    def pause(self, seconds: float):
+        """Ни одного токена ближайшие seconds секунд (ответ 429 с retry_after)"""
+        self.refill()
+        self.tokens = min(self.tokens, 1 - self.rate * seconds)
+
+    def idle(self) -> bool:
+        self.refill()
+        return self.tokens >= self.capacity
+
+
+class Outbox:
+    """Очередь исходящих сообщений с лимитами Telegram.
+
+    Очередь - это сами строки messages со статусом queued, поэтому веб-запрос только
+    записывает сообщение, а неотправленное переживает перезапуск. Фоновый цикл забирает
+    строки, срок которых подошёл, и откладывает их на claim_ttl секунд (если процесс
+    упадёт, их отправит следующий). Для каждого бота работает отправитель с лимитами
+    на бота и на чат; 429 откладывает сообщение на retry_after, ошибки сети и 5xx - с
+    экспоненциальной задержкой. Итоги попыток пишутся в БД пачкой.
+    """
+    def __init__(self, bot_rate: float = OUTBOX_BOT_RATE, chat_rate: float = OUTBOX_CHAT_RATE,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, retry_delay: float = OUTBOX_RETRY_DELAY,
+                 poll_interval: float = OUTBOX_POLL_INTERVAL, prefetch: int = OUTBOX_PREFETCH,
+                 claim_ttl: float = OUTBOX_CLAIM_TTL):
+        self.bot_rate = bot_rate
+        self.chat_rate = chat_rate
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.prefetch = prefetch
+        # Сообщений одного чата в памяти: примерно на 10 секунд отправки
+        self.chat_prefetch = max(1, int(chat_rate * 10))
+        self.claim_ttl = claim_ttl
+        # Функция -> id ботов этого процесса (шардирование); None - отправляем за всех
+        self.owned = None
+        self.queues = {}  # bot_id -> deque строк, взятых из БД
+        self.claimed = set()  # id сообщений в памяти, в отправке или с незаписанным итогом
+        self.senders = {}  # bot_id -> asyncio.Task отправителя
+        self.deliveries = set()  # запросы sendMessage в полёте
+        self.bot_buckets = {}  # bot_id -> TokenBucket
+        self.chat_buckets = {}  # bot_id -> {chat_id -> TokenBucket}
+        self.results = []  # [status, attempts, next_attempt, error, id] для RESULT_SQL
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def start(self):
+        """Запуск фоновой отправки"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run(), name="outbox")
+            logging.info(
+                f"Outbox started: {self.bot_rate}/s per bot, {self.chat_rate}/s per chat, "
+                f"{self.max_attempts} attempts"
+            )
+
+    async def stop(self):
+        """Остановка: ждём запросы в полёте, записываем итоги, взятые строки возвращаем в очередь"""
+        tasks = [task for task in [self.task, *self.senders.values()] if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.task = None
+        self.senders.clear()
+        await asyncio.gather(*self.deliveries, return_exceptions=True)
+        await self.flush()
+        for bot_id in list(self.queues):
+            await self.release(bot_id)
+        logging.info(f"Outbox stopped: {self.sent} sent, {self.failed} failed, {self.retried} retried")
+
+    def wake(self):
+        """Новые сообщения в очереди - не ждать следующего опроса"""
+        self.wakeup.set()
+
+    async def enqueue(self, bot_id: int, chat_id: int, text: str) -> Message:
+        """Постановка сообщения в очередь; отправка - в фоне"""
+        with DB_QUERY_SECONDS.time("outbox_enqueue"):
+            message = await Message.create(
+                chat_id=chat_id, text=text, direction='outgoing', bot_id=bot_id,
+                status=QUEUED, next_attempt=timezone.now()
+            )
+        self.wake()
+        return message
+
+    async def broadcast(self, bot_id: int, text: str, chat_ids: list = None) -> int:
+        """Рассылка одного текста в несколько чатов (по умолчанию во все чаты бота).
+
+        Возвращает число поставленных в очередь сообщений.
+        """
+        if chat_ids is None:
+            chat_ids = await Chat.filter(bot_id=bot_id).values_list("id", flat=True)
+        chat_ids = list(dict.fromkeys(chat_ids))
+        now = timezone.now()
+        async with in_transaction(WRITE_CONNECTION) as conn:
+            for start in range(0, len(chat_ids), BROADCAST_CHUNK):
+                chunk = chat_ids[start:start + BROADCAST_CHUNK]
+                await Message.bulk_create([
+                    Message(chat_id=chat_id, text=text, direction='outgoing', bot_id=bot_id,
+                            status=QUEUED, next_attempt=now)
+                    for chat_id in chunk
+                ], using_db=conn)
+                await Chat.filter(bot_id=bot_id, id__in=chunk).using_db(conn).update(
+                    last_message=text, updated=now
+                )
+        page_cache.bump(("chats", bot_id))
+        self.wake()
+        logging.info(f"Broadcast from bot {bot_id}: {len(chat_ids)} messages queued")
+        return len(chat_ids)
+
+    async def run(self):
+        """Фоновый цикл: запись итогов и выборка новых сообщений из БД"""
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            try:
+                await self.flush()
+                await self.fill()
+            except Exception as e:
+                logging.error(f"Outbox failed: {e}", exc_info=True)
+
+    async def fill(self):
+        """Выборка сообщений, срок отправки которых подошёл, в очереди ботов"""
+        now = timezone.now()
+        query = Message.filter(status=QUEUED, next_attempt__lte=now)
+        if self.owned is not None:
+            owned = list(self.owned())
+            if not owned:
+                return
+            query = query.filter(bot_id__in=owned)
+        full = [bot_id for bot_id, queue in self.queues.items() if len(queue) >= self.prefetch]
+        if full:
+            query = query.exclude(bot_id__in=full)
+        with DB_QUERY_SECONDS.time("outbox_fill"):
+            rows = await query.order_by("next_attempt", "id").limit(FETCH_LIMIT).values(
+                "id", "bot_id", "chat_id", "text", "attempts"
+            )
+
+        per_chat = Counter((bot_id, row["chat_id"]) for bot_id, queue in self.queues.items() for row in queue)
+        claims = []
+        for row in rows:
+            bot_id, chat_id = row["bot_id"], row["chat_id"]
+            if (row["id"] in self.claimed or len(self.queues.get(bot_id, ())) >= self.prefetch
+                    or per_chat[(bot_id, chat_id)] >= self.chat_prefetch):
+                continue
+            self.queues.setdefault(bot_id, deque()).append(row)
+            per_chat[(bot_id, chat_id)] += 1
+            self.claimed.add(row["id"])
+            claims.append(row["id"])
+        if not claims:
+            return
+
+        # Взятые строки не выбираются повторно, пока не истечёт claim_ttl
+        await Message.filter(id__in=claims).update(next_attempt=now + timedelta(seconds=self.claim_ttl))
+        for bot_id, queue in self.queues.items():
+            sender = self.senders.get(bot_id)
+            if queue and (sender is None or sender.done()):
+                self.senders[bot_id] = asyncio.create_task(self.send_loop(bot_id), name=f"outbox-{bot_id}")
+
+    def bot_bucket(self, bot_id: int) -> TokenBucket:
+        if bot_id not in self.bot_buckets:
+            self.bot_buckets[bot_id] = TokenBucket(self.bot_rate)
+        return self.bot_buckets[bot_id]
+
+    def chat_bucket(self, bot_id: int, chat_id: int) -> TokenBucket:
+        buckets = self.chat_buckets.setdefault(bot_id, {})
+        if chat_id not in buckets:
+            buckets[chat_id] = TokenBucket(self.chat_rate)
+        return buckets[chat_id]
+
+    async def send_loop(self, bot_id: int):
+        """Отправитель бота: следующее сообщение, чат которого не упирается в лимит"""
+        queue = self.queues[bot_id]
+        bucket = self.bot_bucket(bot_id)
+        try:
+            while queue:
+                if self.owned is not None and bot_id not in self.owned():
+                    # Бот переехал на другой воркер - отправлять будет он
+                    await self.release(bot_id)
+                    return
+                # Первое в очереди сообщение свободного чата (порядок внутри чата сохраняется)
+                wait = None
+                for index, row in enumerate(queue):
+                    delay = self.chat_bucket(bot_id, row["chat_id"]).delay()
+                    if delay == 0:
+                        break
+                    wait = delay if wait is None else min(wait, delay)
+                else:
+                    await asyncio.sleep(wait)
+                    continue
+                del queue[index]
+                try:
+                    await bucket.acquire()
+                except asyncio.CancelledError:
+                    queue.appendleft(row)
+                    raise
+                self.chat_bucket(bot_id, row["chat_id"]).take()
+                delivery = asyncio.create_task(self.deliver(bot_id, row))
+                self.deliveries.add(delivery)
+                delivery.add_done_callback(self.deliveries.discard)
+        finally:
+            if self.senders.get(bot_id) is asyncio.current_task():
+                del self.senders[bot_id]
+            if not queue and self.queues.get(bot_id) is queue:
+                del self.queues[bot_id]
+            # Полные корзины чатов ничего не ограничивают - не держим их в памяти
+            buckets = self.chat_buckets.get(bot_id, {})
+            for chat_id in [chat_id for chat_id, chat_bucket in buckets.items() if chat_bucket.idle()]:
+                del buckets[chat_id]
+
+    async def deliver(self, bot_id: int, row: dict):
+        """Одна попытка sendMessage; итог откладывается до следующей записи пачкой"""
+        data, error = None, None
+        bot = await bot_registry.get(bot_id)
+        if bot is None:
+            error = "Bot not found"
+        else:
+            try:
+                data = await telegram_client.call(
+                    bot.token, "sendMessage", retries=1, chat_id=row["chat_id"], text=row["text"]
+                )
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            if data is not None:
+                error = data.get("description")
+
+        attempts = row["attempts"] + 1
+        now = timezone.now()
+        code = None if data is None else data.get("error_code", 500)
+        if data is not None and data.get("ok"):
+            self.sent += 1
+            result = [SENT, attempts, None, None]
+        elif code == 429:
+            # Flood control касается всего бота; попыткой это не считается
+            retry_after = (data.get("parameters") or {}).get("retry_after", 1)
+            self.bot_bucket(bot_id).pause(retry_after)
+            self.retried += 1
+            result = [QUEUED, row["attempts"], now + timedelta(seconds=retry_after), error]
+        elif bot is None or code is not None and code < 500 or attempts >= self.max_attempts:
+            # Чат не найден, бот заблокирован и т.п. - повтор не поможет
+            self.failed += 1
+            result = [FAILED, attempts, None, error]
+            logging.error(f"Failed to send message {row['id']} from bot {bot_id} (attempt {attempts}): {error}")
+        else:
+            self.retried += 1
+            delay = self.retry_delay * 2 ** (attempts - 1)
+            result = [QUEUED, attempts, now + timedelta(seconds=delay), error]
+            logging.warning(f"Message {row['id']} from bot {bot_id} not sent ({error}), retry in {delay:.1f}s")
+        if result[3]:
+            result[3] = result[3][:255]
+        self.results.append(result + [row["id"]])
+        if result[0] == QUEUED and result[2] - now < timedelta(seconds=self.poll_interval):
+            self.wake()
+
+    async def flush(self):
+        """Запись итогов попыток одной транзакцией"""
+        if not self.results:
+            return
+        results, self.results = self.results, []
+        try:
+            with DB_QUERY_SECONDS.time("outbox_results"):
+                async with in_transaction(WRITE_CONNECTION) as conn:
+                    await conn.execute_many(dialect_sql(conn, RESULT_SQL), [
+                        [status, attempts, db_datetime(conn, next_attempt) if next_attempt else None, error, message_id]
+                        for status, attempts, next_attempt, error, message_id in results
+                    ])
+        except Exception:
+            # Вернём итоги в очередь записи, иначе после claim_ttl сообщения уйдут повторно
+            self.results = results + self.results
+            raise
+        self.claimed.difference_update(result[-1] for result in results)
+
+    async def release(self, bot_id: int):
+        """Возврат взятых в память, но не отправленных сообщений бота в очередь БД"""
+        queue = self.queues.pop(bot_id, None) or []
+        ids = [row["id"] for row in queue]
+        if not ids:
+            return
+        now = timezone.now()
+        for start in range(0, len(ids), BROADCAST_CHUNK):
+            await Message.filter(id__in=ids[start:start + BROADCAST_CHUNK], status=QUEUED).update(next_attempt=now)
+        self.claimed.difference_update(ids)
+
+    def stats(self) -> dict:
+        return {
+            "queued": sum(len(queue) for queue in self.queues.values()),
+            "in_flight": len(self.deliveries),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
+
+# Общая очередь исходящих процесса
+outbox = Outbox()
@@ -0,0 +1,189 @@
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import Request
+from fastapi.responses import HTMLResponse, Response
+from fastapi.staticfiles import StaticFiles
+from config import PAGE_CACHE_TTL, PAGE_CACHE_SIZE, COMPRESS_MIN_SIZE, STATIC_MAX_AGE
+import asyncio
+import gzip
+import hashlib
+import os
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Page:
+    """Отрисованная страница: тело, ETag по содержимому и сжатые варианты (по требованию)"""
+    def __init__(self, body: bytes, version: tuple, last_modified: float = None):
+        self.body = body
+        self.version = version
+        self.loaded = time.monotonic()
+        self.etag = f'W/"{hashlib.sha256(body).hexdigest()[:20]}"'
+        self.last_modified = last_modified or time.time()
+        self.encoded = {}  # content-encoding -> тело
+
+    def encode(self, encoding: str) -> bytes:
+        body = self.encoded.get(encoding)
+        if body is None:
+            if encoding == "br":
+                body = brotli.compress(self.body, quality=5)
+            else:
+                body = gzip.compress(self.body, compresslevel=6, mtime=0)
+            self.encoded[encoding] = body
+        return body
+
+
+class PageCache:
+    """Кэш страниц админки, зависящих только от данных (список ботов, список чатов).
+
+    Страница привязана к версиям областей данных ("bots", "unread", ("chats", bot_id)):
+    код, меняющий данные, вызывает bump(), и следующий запрос отрисует страницу заново.
+    Изменения из других процессов (воркеры, import) версии не меняют - их покрывает ttl.
+    Одновременные промахи по одной странице ждут одну отрисовку. ttl=0 - без кэша.
+    """
+    def __init__(self, ttl: float = PAGE_CACHE_TTL, max_size: int = PAGE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()  # ключ страницы -> Page
+        self.versions = {}  # область данных -> номер версии
+        self.pending = {}  # (ключ, версия) -> задача отрисовки
+        self.hits = 0
+        self.misses = 0
+
+    def bump(self, *scopes):
+        """Данные областей изменились"""
+        for scope in scopes:
+            self.versions[scope] = self.versions.get(scope, 0) + 1
+
+    def version(self, scopes: tuple) -> tuple:
+        return tuple(self.versions.get(scope, 0) for scope in scopes)
+
+    async def get(self, key, scopes: tuple, render) -> Page:
+        """Страница из кэша или результат await render() (строка HTML)"""
+        if self.ttl <= 0:
+            return Page((await render()).encode(), ())
+        version = self.version(scopes)
+        page = self.entries.get(key)
+        if page is not None and page.version == version and time.monotonic() - page.loaded < self.ttl:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return page
+        self.misses += 1
+        task = self.pending.get((key, version))
+        if task is None:
+            task = self.pending[(key, version)] = asyncio.create_task(self.load(key, version, render))
+        # Отключившийся клиент не отменяет отрисовку, которую ждут другие
+        return await asyncio.shield(task)
+
+    async def load(self, key, version: tuple, render) -> Page:
+        try:
+            page = Page((await render()).encode(), version)
+        finally:
+            del self.pending[(key, version)]
+        previous = self.entries.pop(key, None)
+        if previous is not None and previous.etag == page.etag:
+            # Содержимое не изменилось - дата изменения и сжатые варианты остаются прежними
+            page.last_modified = previous.last_modified
+            page.encoded = previous.encoded
+        self.entries[key] = page
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        return page
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+def accepted_encodings(header: str) -> set:
+    """Кодировки из Accept-Encoding (без q=0)"""
+    encodings = set()
+    for item in header.split(","):
+        name, _, params = item.partition(";")
+        quality = params.replace(" ", "").removeprefix("q=")
+        try:
+            if params and float(quality) == 0:
+                continue
+        except ValueError:
+            pass
+        encodings.add(name.strip().lower())
+    return encodings
+
+
+def not_modified(request: Request, page: Page) -> bool:
+    """Условный запрос: If-None-Match, а без него - If-Modified-Since"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or page.etag.removeprefix("W/") in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(page.last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def page_response(request: Request, page: Page, cache_control: str = "private, no-cache") -> Response:
+    """Ответ со страницей из кэша: 304 по ETag/Last-Modified, сжатие brotli или gzip.
+
+    no-cache - браузер хранит страницу, но перед показом проверяет её условным запросом.
+    """
+    headers = {
+        "ETag": page.etag,
+        "Last-Modified": formatdate(page.last_modified, usegmt=True),
+        "Cache-Control": cache_control,
+        "Vary": "Accept-Encoding",
+    }
+    if not_modified(request, page):
+        return Response(status_code=304, headers=headers)
+    body = page.body
+    if len(body) >= COMPRESS_MIN_SIZE:
+        encodings = accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = "br" if brotli is not None and "br" in encodings else "gzip" if "gzip" in encodings else None
+        if encoding:
+            body = page.encode(encoding)
+            headers["Content-Encoding"] = encoding
+    return HTMLResponse(body, headers=headers)
+
+
+class HashedStaticFiles(StaticFiles):
+    """Статика с хэшем содержимого в адресе (url() -> /static/css/style.css?v=<hash>).
+
+    Адрес с актуальным хэшем браузер кэширует на max_age без проверок: после
+    изменения файла шаблоны ссылаются на новый адрес. Без хэша - обычная проверка по ETag.
+    """
+    def __init__(self, *args, max_age: int = STATIC_MAX_AGE, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_age = max_age
+        self.hashes = {}  # путь -> (mtime, хэш)
+
+    def content_hash(self, path: str) -> str:
+        full_path = os.path.join(self.directory, path)
+        mtime = os.stat(full_path).st_mtime_ns
+        cached = self.hashes.get(path)
+        if cached is None or cached[0] != mtime:
+            with open(full_path, "rb") as file:
+                cached = self.hashes[path] = (mtime, hashlib.sha256(file.read()).hexdigest()[:12])
+        return cached[1]
+
+    def url(self, path: str) -> str:
+        """Адрес файла для шаблонов"""
+        return f"/static/{path}?v={self.content_hash(path)}"
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        path = os.path.relpath(full_path, self.directory)
+        if scope["query_string"] == f"v={self.content_hash(path)}".encode():
+            response.headers["Cache-Control"] = f"public, max-age={self.max_age}, immutable"
+        else:
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
+
+# Общий кэш страниц процесса
+page_cache = PageCache()
@@ -0,0 +1,219 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from metrics import PROCESSING_JOB_SECONDS
+from config import PROCESSING_WORKERS, PROCESSING_QUEUE_SIZE, PROCESSING_BATCH_SIZE
+import asyncio
+import logging
+import multiprocessing
+import time
+
+# Приоритеты заданий: меньше - раньше
+HIGH = 0
+NORMAL = 1
+LOW = 2
+PRIORITIES = (HIGH, NORMAL, LOW)
+
+
+def transcribe(texts: list) -> list:
+    """Транскрибация пачки сообщений одного чата (выполняется в процессе пула)"""
+    # Здесь будет распознавание речи и нормализация текста
+    return [text.upper() for text in texts]
+
+
+@dataclass
+class Job:
+    """Задание обработки: данные для процессора и будущий результат"""
+    bot_id: int
+    chat_id: int
+    processor: object
+    payload: object
+    future: asyncio.Future
+    deliver: object = None  # корутина-функция(result), вызывается после выполнения
+    created: float = field(default_factory=time.perf_counter)
+
+
+class ProcessingEngine:
+    """Тяжёлая для CPU обработка (декодирование аудио, распознавание речи, нормализация текста)
+    в пуле процессов, чтобы не останавливать цикл событий с поллингом всех ботов.
+
+    Процессор - функция уровня модуля (в процесс передаётся по имени): список данных ->
+    список результатов того же размера. Задания выбираются по приоритету, внутри приоритета
+    боты и их чаты обслуживаются по кругу: бот с тысячей заданий не задерживает остальных.
+    Накопившиеся задания одного чата с одним процессором уходят в процесс одной пачкой;
+    следующая пачка чата - только после предыдущей, поэтому ответы идут по порядку.
+    В пул одновременно отдаётся не больше workers пачек - очередь и приоритеты здесь, а не
+    в FIFO executor'а.
+    """
+    def __init__(self, workers: int = PROCESSING_WORKERS, max_queue: int = PROCESSING_QUEUE_SIZE,
+                 batch_size: int = PROCESSING_BATCH_SIZE):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.capacity = asyncio.Semaphore(max_queue)  # заданий в очереди и в работе
+        self.slots = asyncio.Semaphore(workers)
+        self.wakeup = asyncio.Event()
+        # Приоритет -> bot_id -> (chat_id, процессор) -> задания
+        self.levels = {priority: OrderedDict() for priority in PRIORITIES}
+        self.busy = set()  # (bot_id, chat_id, процессор), чья пачка сейчас в процессе
+        self.queued = 0
+        self.pool = None
+        self.task = None
+        self.running = set()
+        self.completed = 0
+        self.failed = 0
+        self.batches = 0
+
+    def start(self):
+        """Запуск раздачи заданий. Пул процессов - в prepare(), когда появляется бот, которому
+        нужна обработка: процессу (и каждому воркеру uvicorn) без таких ботов он не нужен"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run(), name="processing-engine")
+            logging.info(f"Processing engine started: up to {self.workers} processes, batch={self.batch_size}")
+
+    def prepare(self):
+        """Создание пула заранее: бот, которому нужна обработка, запущен - процессы стартуют
+        сейчас, а не на первом сообщении"""
+        if self.pool is None:
+            self.pool = self.create_pool()
+            self.pool.submit(int)
+
+    def create_pool(self) -> ProcessPoolExecutor:
+        # spawn: fork процесса с работающим циклом событий и потоками aiohttp небезопасен.
+        # Процесс пула импортирует __main__ запускающего скрипта - запуск в нём только под
+        # if __name__ == "__main__" (uvicorn так и делает)
+        logging.info(f"Processing pool created: {self.workers} processes")
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    async def stop(self):
+        """Остановка: выполняемые пачки дожидаются, ожидающие в очереди задания отменяются"""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await asyncio.gather(*self.running, return_exceptions=True)
+        cancelled = 0
+        for queue in self.levels.values():
+            for groups in queue.values():
+                for jobs in groups.values():
+                    for job in jobs:
+                        job.future.cancel()
+                        self.capacity.release()
+                        cancelled += 1
+            queue.clear()
+        self.queued = 0
+        if self.pool is not None:
+            await asyncio.to_thread(self.pool.shutdown)
+            self.pool = None
+        logging.info(f"Processing engine stopped: {self.completed} jobs done, {cancelled} cancelled")
+
+    async def submit(self, bot_id: int, chat_id: int, processor, payload, priority: int = NORMAL,
+                     deliver=None) -> asyncio.Future:
+        """Постановка задания; ждёт, если очередь заполнена (backpressure).
+
+        Возвращает future с результатом; deliver(result), если передан, вызывается движком
+        после выполнения - обработчику сообщения не нужно ждать результат.
+        """
+        await self.capacity.acquire()
+        self.prepare()
+        job = Job(bot_id, chat_id, processor, payload, asyncio.get_running_loop().create_future(), deliver)
+        groups = self.levels[priority].setdefault(bot_id, OrderedDict())
+        groups.setdefault((chat_id, processor), deque()).append(job)
+        self.queued += 1
+        self.wakeup.set()
+        return job.future
+
+    def take(self) -> list:
+        """Следующая пачка: первый по кругу бот и его первый чат, не занятый пачкой в процессе"""
+        for queue in self.levels.values():
+            for bot_id, groups in queue.items():
+                for key, jobs in groups.items():
+                    if (bot_id, *key) in self.busy:
+                        continue
+                    batch = [jobs.popleft() for _ in range(min(self.batch_size, len(jobs)))]
+                    if jobs:
+                        groups.move_to_end(key)
+                    else:
+                        del groups[key]
+                    if groups:
+                        queue.move_to_end(bot_id)
+                    else:
+                        del queue[bot_id]
+                    self.queued -= len(batch)
+                    return batch
+        return None
+
+    async def run(self):
+        """Раздача пачек в пул по мере освобождения процессов"""
+        while True:
+            await self.slots.acquire()
+            batch = self.take()
+            while batch is None:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                batch = self.take()
+            # Чат занят сразу, а не когда задача запустится: иначе следующий take отдал бы
+            # его следующую пачку в другой процесс
+            self.busy.add((batch[0].bot_id, batch[0].chat_id, batch[0].processor))
+            task = asyncio.create_task(self.execute(batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def execute(self, batch: list):
+        first = batch[0]
+        key = (first.bot_id, first.chat_id, first.processor)
+        pool = self.pool
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                pool, first.processor, [job.payload for job in batch]
+            )
+            if len(results) != len(batch):
+                raise ValueError(f"{first.processor.__name__} returned {len(results)} results for {len(batch)} jobs")
+        except Exception as e:
+            logging.error(f"Processing batch of {len(batch)} jobs failed ({first.processor.__name__}): {e}")
+            if isinstance(e, BrokenProcessPool) and self.pool is pool:
+                # Процесс пула упал (память, сигнал) - следующие задания идут в новый пул.
+                # Остальные пачки упавшего пула получат ту же ошибку, но пул заменит только первая
+                pool.shutdown(wait=False)
+                self.pool = self.create_pool()
+            results = None
+            self.failed += len(batch)
+            for job in batch:
+                if not job.future.done():
+                    job.future.set_exception(e)
+                    if job.deliver is not None:
+                        # Результат ждёт deliver, а не future - ошибка уже в логе
+                        job.future.exception()
+        finally:
+            self.busy.discard(key)
+            self.slots.release()
+            self.wakeup.set()
+            for _ in batch:
+                self.capacity.release()
+        if results is None:
+            return
+        self.batches += 1
+        self.completed += len(batch)
+        now = time.perf_counter()
+        for job, result in zip(batch, results):
+            PROCESSING_JOB_SECONDS.observe(now - job.created, first.processor.__name__)
+            if not job.future.done():
+                job.future.set_result(result)
+            if job.deliver is not None:
+                try:
+                    await job.deliver(result)
+                except Exception as e:
+                    logging.error(f"Processing result delivery failed: {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.queued,
+            "in_flight": len(self.busy),
+            "completed": self.completed,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+
+# Общий пул обработки процесса
+processing_engine = ProcessingEngine()
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from models import Bot as BotModel
+from metrics import DB_QUERY_SECONDS
+from pages import page_cache
+from config import BOT_CACHE_TTL, BOT_CACHE_SIZE
+import time
+
+
+class BotRegistry:
+    """Кэш строк Bot в памяти процесса: поиск по id и токену, TTL и вытеснение LRU"""
+    def __init__(self, ttl: float = BOT_CACHE_TTL, max_size: int = BOT_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()  # bot_id -> (bot, время загрузки)
+        self.tokens = {}  # token -> bot_id
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, bot_id):
+        """Запись из кэша, если она есть и не устарела"""
+        entry = self.entries.get(bot_id)
+        if entry is None:
+            return None
+        bot, loaded_at = entry
+        if time.monotonic() - loaded_at > self.ttl:
+            self._drop(bot_id)
+            return None
+        self.entries.move_to_end(bot_id)
+        return bot
+
+    def _store(self, bot):
+        """Добавление строки в кэш с вытеснением давно не использованных"""
+        self._drop(bot.id)
+        self.entries[bot.id] = (bot, time.monotonic())
+        self.tokens[bot.token] = bot.id
+        while len(self.entries) > self.max_size:
+            old_id, (old_bot, _) = self.entries.popitem(last=False)
+            self.tokens.pop(old_bot.token, None)
+
+    async def get(self, bot_id):
+        """Бот по id (None, если не найден)"""
+        bot = self._lookup(bot_id)
+        if bot is not None:
+            self.hits += 1
+            return bot
+        self.misses += 1
+        with DB_QUERY_SECONDS.time("bot_lookup"):
+            bot = await BotModel.get_or_none(id=bot_id)
+        if bot is not None:
+            self._store(bot)
+        return bot
+
+    async def get_by_token(self, token: str):
+        """Бот по токену (None, если не найден)"""
+        bot_id = self.tokens.get(token)
+        bot = self._lookup(bot_id) if bot_id is not None else None
+        if bot is not None:
+            self.hits += 1
+            return bot
+        self.misses += 1
+        with DB_QUERY_SECONDS.time("bot_lookup"):
+            bot = await BotModel.get_or_none(token=token)
+        if bot is not None:
+            self._store(bot)
+        return bot
+
+    def _drop(self, bot_id):
+        entry = self.entries.pop(bot_id, None)
+        if entry is not None:
+            self.tokens.pop(entry[0].token, None)
+
+    def invalidate(self, bot_id=None):
+        """Строка бота изменилась: сброс записи бота или всего кэша (bot_id=None) и страниц со списком ботов"""
+        page_cache.bump("bots")
+        if bot_id is None:
+            self.entries.clear()
+            self.tokens.clear()
+            return
+        self._drop(bot_id)
+
+    def stats(self) -> dict:
+        """Счётчики попаданий и промахов"""
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+# Общий кэш ботов процесса
+bot_registry = BotRegistry()
@@ -0,0 +1,494 @@
+from collections import deque
+from dataclasses import dataclass
+from tortoise.expressions import F
+from models import ReplyRule, Bot as BotModel
+from metrics import DB_QUERY_SECONDS
+from config import RULES_CHECK_INTERVAL
+import asyncio
+import logging
+import re
+import time
+
+try:
+    from re import _parser as sre_parse, _compiler as sre_compile  # Python 3.11+
+except ImportError:
+    import sre_parse
+    import sre_compile
+
+COMMAND = "command"
+KEYWORD = "keyword"
+REGEX = "regex"
+KINDS = (COMMAND, KEYWORD, REGEX)
+# При равном приоритете: команда, затем ключевое слово, затем регулярное выражение
+KIND_RANK = {COMMAND: 2, KEYWORD: 1, REGEX: 0}
+
+@dataclass
+class Rule:
+    """Правило автоответа в том виде, в каком его проверяет индекс"""
+    id: int
+    kind: str
+    pattern: str
+    reply: str
+    priority: int = 0
+
+    @property
+    def rank(self) -> tuple:
+        return self.priority, KIND_RANK[self.kind], -self.id
+
+
+def better(rule: Rule, other: Rule) -> Rule:
+    """Правило, которое отвечает, если подходят оба"""
+    if rule is None:
+        return other
+    if other is None or rule.rank >= other.rank:
+        return rule
+    return other
+
+
+def normalize(kind: str, pattern: str) -> str:
+    """Вид шаблона, в котором он хранится и сравнивается"""
+    pattern = pattern.strip()
+    if kind == COMMAND:
+        return pattern.lstrip("/").lower()
+    if kind == KEYWORD:
+        return pattern.casefold()
+    return pattern
+
+
+def nested_repeat(items, outer: tuple = None) -> bool:
+    """Есть ли в выражении повтор внутри повтора, хотя бы один из которых без предела: (a+)+,
+    (a{1,3})*. На строке, которая почти совпадает, re перебирает все разбиения - время
+    растёт экспоненциально, а выражения проверяются в цикле событий на каждом сообщении.
+    """
+    for op, value in items:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            _, high, body = value
+            if high > 1:
+                if outer is not None and sre_parse.MAXREPEAT in (high, outer[1]):
+                    return True
+                if nested_repeat(body, value):
+                    return True
+            elif nested_repeat(body, outer):
+                return True
+        elif op is sre_parse.SUBPATTERN:
+            if nested_repeat(value[-1], outer):
+                return True
+        elif op is sre_parse.BRANCH:
+            if any(nested_repeat(branch, outer) for branch in value[1]):
+                return True
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            if nested_repeat(value[1], outer):
+                return True
+    return False
+
+
+def first_chars(items) -> tuple:
+    """С чего может начинаться совпадение: (символы, может ли оно быть пустым).
+
+    Символ - строка из одного символа, скомпилированный класс ([a-z], [^x], .) или None -
+    любой символ (обратные ссылки и прочее, что не разбираем).
+    """
+    starts = []
+    for op, value in items:
+        if op is sre_parse.LITERAL:
+            return starts + [chr(value)], False
+        if op in (sre_parse.NOT_LITERAL, sre_parse.IN, sre_parse.ANY):
+            pattern = sre_parse.SubPattern(sre_parse.State(), [(op, value)])
+            return starts + [sre_compile.compile(pattern, re.IGNORECASE)], False
+        if op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            # Нулевой ширины - совпадение начинается со следующего элемента
+            continue
+        if op is sre_parse.SUBPATTERN:
+            chars, empty = first_chars(value[-1])
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            chars, empty = first_chars(value[2])
+            empty = empty or value[0] == 0
+        elif op is sre_parse.BRANCH:
+            chars, empty = [], False
+            for branch in value[1]:
+                branch_chars, branch_empty = first_chars(branch)
+                chars += branch_chars
+                empty = empty or branch_empty
+        else:
+            return starts + [None], False
+        starts += chars
+        if not empty:
+            return starts, False
+    return starts, True
+
+
+def same_char(char, other) -> bool:
+    """Могут ли два первых символа из first_chars совпасть с одним и тем же символом текста"""
+    if char is None or other is None:
+        return True
+    if isinstance(char, str) and isinstance(other, str):
+        return char.casefold() == other.casefold()
+    if isinstance(char, str):
+        return other.fullmatch(char) is not None
+    if isinstance(other, str):
+        return char.fullmatch(other) is not None
+    # Два класса сравнить дороже, чем отказать
+    return True
+
+
+def ambiguous_branch(items) -> bool:
+    """Есть ли в выражении альтернатива, ветви которой могут начаться с одного символа
+    или совпасть с пустой строкой: (a|aa) - после разбора a(|a), (a|a?), (ab|a.)"""
+    for op, value in items:
+        if op is sre_parse.BRANCH:
+            starts = [first_chars(branch) for branch in value[1]]
+            if any(empty for _, empty in starts):
+                return True
+            for number, (chars, _) in enumerate(starts):
+                for other, _ in starts[number + 1:]:
+                    if any(same_char(char, other_char) for char in chars for other_char in other):
+                        return True
+            if any(ambiguous_branch(branch) for branch in value[1]):
+                return True
+        elif op is sre_parse.SUBPATTERN:
+            if ambiguous_branch(value[-1]):
+                return True
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            if ambiguous_branch(value[2]):
+                return True
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            if ambiguous_branch(value[1]):
+                return True
+    return False
+
+
+def ambiguous_repeat(items) -> bool:
+    """Есть ли в выражении повтор без предела над неоднозначной альтернативой: (a|aa)+$.
+    Каждое повторение можно пройти несколькими ветвями - как и у (a+)+, на почти
+    совпадающей строке re перебирает экспоненциальное число вариантов.
+    """
+    for op, value in items:
+        if op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            if value[1] == sre_parse.MAXREPEAT and ambiguous_branch(value[2]):
+                return True
+            if ambiguous_repeat(value[2]):
+                return True
+        elif op is sre_parse.SUBPATTERN:
+            if ambiguous_repeat(value[-1]):
+                return True
+        elif op is sre_parse.BRANCH:
+            if any(ambiguous_repeat(branch) for branch in value[1]):
+                return True
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            if ambiguous_repeat(value[1]):
+                return True
+    return False
+
+
+def validate_rule(kind: str, pattern: str) -> str:
+    """Ошибка в правиле для админки (None - правило можно сохранить)"""
+    if kind not in KINDS:
+        return "Unknown rule type"
+    if not pattern or len(pattern) > 255:
+        return "Pattern must be 1 to 255 characters"
+    if kind == COMMAND and not re.fullmatch(r"[a-z0-9_]{1,32}", pattern):
+        return "Command must be 1-32 latin letters, digits or underscores"
+    if kind == REGEX:
+        try:
+            parsed = sre_parse.parse(pattern)
+        except re.error as e:
+            return f"Invalid regular expression: {e}"
+        if nested_repeat(parsed):
+            return "Nested quantifiers such as (a+)+ are not allowed: they can take exponential time"
+        if ambiguous_repeat(parsed):
+            return ("Repeated alternatives that can match the same text, such as (a|aa)+, "
+                    "are not allowed: they can take exponential time")
+        try:
+            re.compile(pattern)
+        except re.error as e:
+            return f"Invalid regular expression: {e}"
+    return None
+
+
+def split_command(text: str) -> tuple:
+    """Команда и упоминание бота из /command@bot args (None - текст не команда)"""
+    if not text.startswith("/"):
+        return None, None
+    words = text[1:].split(maxsplit=1)
+    command, _, mention = words[0].partition("@") if words else ("", "", "")
+    return command.lower(), mention.lower() or None
+
+
+def required_literal(pattern: str) -> str:
+    """Самая длинная подстрока, без которой выражение не совпадёт (None - такой нет).
+
+    Разбор - парсером модуля re: подряд идущие символы вне альтернатив и необязательных
+    частей. Строка приводится к casefold, как текст при поиске ключевых слов.
+    """
+    best = ""
+
+    def walk(items):
+        nonlocal best
+        run = []
+        for op, value in list(items) + [(None, None)]:
+            if op is sre_parse.LITERAL:
+                run.append(chr(value))
+                continue
+            if len(run) > len(best):
+                best = "".join(run)
+            run = []
+            if op is sre_parse.SUBPATTERN:
+                walk(value[-1])
+            elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and value[0] >= 1:
+                walk(value[2])
+
+    try:
+        walk(sre_parse.parse(pattern))
+    except re.error:
+        return None
+    return best.casefold() or None
+
+
+class Automaton:
+    """Автомат Ахо-Корасик: все вхождения набора строк за один проход по тексту,
+    сколько бы ни было строк. ends[node] - номера строк, которые заканчиваются в узле,
+    включая более короткие суффиксы (по ссылкам неудач).
+    """
+    def __init__(self, words: list):
+        self.goto = [{}]
+        self.fail = [0]
+        self.ends = [[]]
+        for number, word in enumerate(words):
+            node = 0
+            for char in word:
+                child = self.goto[node].get(char)
+                if child is None:
+                    child = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.ends.append([])
+                    self.goto[node][char] = child
+                node = child
+            self.ends[node].append(number)
+        # Ссылки неудач - обходом в ширину: у узла глубины d ссылка ведёт на меньшую глубину
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                if self.ends[self.fail[child]]:
+                    self.ends[child] = self.ends[child] + self.ends[self.fail[child]]
+
+    def nodes(self, text: str):
+        """Узлы, в которых заканчивается хотя бы одна строка, по ходу текста"""
+        goto, fail, ends = self.goto, self.fail, self.ends
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if ends[node]:
+                yield node
+
+
+class KeywordIndex:
+    """Ключевые слова на автомате: в каждом узле заранее выбрано лучшее правило среди слов,
+    которые в нём заканчиваются, поэтому проход только сравнивает встреченные узлы"""
+    def __init__(self, rules: list):
+        self.automaton = Automaton([rule.pattern for rule in rules])
+        self.best = [None] * len(self.automaton.ends)
+        for node, ends in enumerate(self.automaton.ends):
+            for number in ends:
+                self.best[node] = better(self.best[node], rules[number])
+
+    def match(self, text: str) -> Rule:
+        found = None
+        for node in self.automaton.nodes(text):
+            found = better(found, self.best[node])
+        return found
+
+
+class RegexIndex:
+    """Регулярные выражения с отбором по обязательной подстроке.
+
+    re - движок с возвратами: одно общее выражение из тысяч вариантов пробует каждый
+    вариант в каждой позиции текста и медленнее проверки по одному. Поэтому из каждого
+    выражения берётся подстрока, без которой оно не совпадёт; подстроки ищутся тем же
+    автоматом, и запускаются только выражения, чья подстрока есть в тексте (и немногие
+    выражения без такой подстроки) - по убыванию приоритета до первого совпадения.
+    """
+    def __init__(self, rules: list):
+        rules = sorted(rules, key=lambda rule: rule.rank, reverse=True)
+        self.compiled = [re.compile(rule.pattern, re.IGNORECASE) for rule in rules]
+        self.rules = rules
+        literals = [required_literal(rule.pattern) for rule in rules]
+        self.always = [number for number, literal in enumerate(literals) if literal is None]
+        indexed = [number for number, literal in enumerate(literals) if literal is not None]
+        self.automaton = Automaton([literals[number] for number in indexed])
+        self.indexed = indexed
+
+    def match(self, text: str) -> Rule:
+        candidates = set(self.always)
+        folded = None
+        if self.indexed:
+            folded = text.casefold()
+            for node in self.automaton.nodes(folded):
+                candidates.update(self.indexed[number] for number in self.automaton.ends[node])
+        # Номера - по убыванию приоритета: первое совпадение и есть лучшее
+        for number in sorted(candidates):
+            if self.compiled[number].search(text):
+                return self.rules[number]
+        return None
+
+
+class RuleIndex:
+    """Скомпилированные правила бота: команды - словарь, ключевые слова - автомат
+    Ахо-Корасик, регулярные выражения - автомат по их обязательным подстрокам.
+
+    Проверка сообщения не перебирает правила: поиск команды в словаре и проход
+    по тексту автоматами; выражения запускаются только те, что могут совпасть.
+    """
+    def __init__(self, rules: list):
+        self.size = len(rules)
+        self.commands = {}
+        keywords = []
+        expressions = []
+        for rule in rules:
+            if rule.kind == COMMAND:
+                self.commands[rule.pattern] = better(self.commands.get(rule.pattern), rule)
+            elif rule.kind == KEYWORD:
+                keywords.append(rule)
+            elif rule.kind == REGEX:
+                # Правила, сохранённые до появления проверки, тоже не должны остановить цикл событий
+                error = validate_rule(REGEX, rule.pattern)
+                if error:
+                    logging.warning(f"Skipping reply rule {rule.id}: {error}")
+                    continue
+                expressions.append(rule)
+        self.keywords = KeywordIndex(keywords) if keywords else None
+        self.expressions = RegexIndex(expressions) if expressions else None
+
+    def match(self, text: str, username: str = None) -> Rule:
+        """Лучшее подходящее правило (None - ни одно не подошло)"""
+        found = None
+        if self.commands:
+            command, mention = split_command(text)
+            # Команда другому боту в группе (/start@other_bot) - не нам
+            if command and (mention is None or username is None or mention == username.lower()):
+                found = self.commands.get(command)
+        if self.keywords is not None:
+            found = better(found, self.keywords.match(text.casefold()))
+        if self.expressions is not None:
+            found = better(found, self.expressions.match(text))
+        return found
+
+
+class RuleRouter:
+    """Индексы автоответов ботов процесса с горячей перезагрузкой.
+
+    Индекс бота строится при первом сообщении (в потоке: тысячи правил компилируются
+    заметное время) и заменяется целиком, когда правила меняются. Изменения в этом
+    процессе (админка) применяются сразу через reload, в других процессах - по
+    bots.rules_version, который проверяется раз в check_interval одним запросом.
+    Пока новый индекс строится, сообщения проверяет прежний.
+    """
+    def __init__(self, check_interval: float = RULES_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.indexes = {}  # bot_id -> (rules_version, RuleIndex)
+        self.loading = {}  # bot_id -> задача загрузки
+        self.task = None
+        self.matched = 0
+        self.unmatched = 0
+        self.reloads = 0
+
+    def start(self):
+        """Запуск проверки изменений правил"""
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run(), name="rule-router")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await asyncio.gather(*self.loading.values(), return_exceptions=True)
+
+    async def match(self, bot_id: int, text: str, defaults: RuleIndex = None, username: str = None) -> str:
+        """Ответ на сообщение: правила бота из БД, затем правила типа бота по умолчанию"""
+        entry = self.indexes.get(bot_id)
+        if entry is None:
+            entry = await self.load(bot_id)
+        rule = entry[1].match(text, username)
+        if rule is None and defaults is not None:
+            rule = defaults.match(text, username)
+        if rule is None:
+            self.unmatched += 1
+            return None
+        self.matched += 1
+        return rule.reply
+
+    async def load(self, bot_id: int) -> tuple:
+        """Загрузка индекса бота; одновременные запросы ждут одну загрузку"""
+        task = self.loading.get(bot_id)
+        if task is None:
+            task = self.loading[bot_id] = asyncio.create_task(self.build(bot_id))
+            task.add_done_callback(lambda _: self.loading.pop(bot_id, None))
+        return await asyncio.shield(task)
+
+    def reload(self, bot_id: int):
+        """Правила бота изменились в этом процессе: перестраиваем индекс в фоне"""
+        if bot_id in self.indexes and bot_id not in self.loading:
+            self.loading[bot_id] = task = asyncio.create_task(self.build(bot_id))
+            task.add_done_callback(lambda _: self.loading.pop(bot_id, None))
+
+    async def build(self, bot_id: int) -> tuple:
+        started = time.perf_counter()
+        with DB_QUERY_SECONDS.time("reply_rules"):
+            # Версия - до правил: изменение между запросами заметит следующая проверка
+            version = await BotModel.filter(id=bot_id).values_list("rules_version", flat=True)
+            rows = await ReplyRule.filter(bot_id=bot_id, is_active=True).values(
+                "id", "kind", "pattern", "reply", "priority"
+            )
+        rules = [Rule(**row) for row in rows]
+        index = await asyncio.to_thread(RuleIndex, rules) if rules else RuleIndex([])
+        entry = self.indexes[bot_id] = (version[0] if version else 0, index)
+        self.reloads += 1
+        if rules:
+            logging.info(f"Reply rules for bot {bot_id}: {len(rules)} compiled in {time.perf_counter() - started:.3f}s")
+        return entry
+
+    async def run(self):
+        """Проверка bots.rules_version загруженных ботов: изменения из других процессов"""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            if not self.indexes:
+                continue
+            try:
+                versions = dict(
+                    await BotModel.filter(id__in=list(self.indexes)).values_list("id", "rules_version")
+                )
+                for bot_id, (version, _) in list(self.indexes.items()):
+                    if bot_id not in versions:
+                        # Бот удалён
+                        del self.indexes[bot_id]
+                    elif versions[bot_id] != version:
+                        self.reload(bot_id)
+            except Exception as e:
+                logging.error(f"Reply rules check failed: {e}", exc_info=True)
+
+    def stats(self) -> dict:
+        return {
+            "bots": len(self.indexes),
+            "rules": sum(index.size for _, index in self.indexes.values()),
+            "matched": self.matched,
+            "unmatched": self.unmatched,
+            "reloads": self.reloads,
+        }
+
+
+async def bump_rules_version(bot_id: int, conn=None):
+    """Отметка изменения правил бота для других процессов (в транзакции изменения)"""
+    await BotModel.filter(id=bot_id).using_db(conn).update(rules_version=F("rules_version") + 1)
+
+
+# Общий маршрутизатор автоответов процесса
+rule_router = RuleRouter()
@@ -0,0 +1,143 @@
+from datetime import datetime
+from tortoise import connections
+from tortoise.transactions import in_transaction
+from db import WRITE_CONNECTION, read_connection, is_postgres, dialect_sql
+from metrics import DB_QUERY_SECONDS
+import html
+import re
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX = 100
+
+# Маркеры подсветки в snippet: после экранирования HTML заменяются на <mark>
+MARK_START = "\x02"
+MARK_END = "\x03"
+
+# Слова запроса; всё остальное (кавычки, операторы FTS) отбрасывается
+TERM_RE = re.compile(r"\w+")
+MAX_TERMS = 10
+
+# SQLite: ранжирование bm25 (меньше - лучше), ключ страницы (rank, id)
+SQLITE_SEARCH_SQL = '''
+SELECT m."id", m."chat_id", m."direction", m."timestamp", c."title" AS "chat_title",
+       snippet("messages_fts", 0, ?, ?, '…', 16) AS "snippet", "messages_fts".rank AS "rank"
+FROM "messages_fts"
+JOIN "messages" m ON m."id" = "messages_fts".rowid
+LEFT JOIN "chats" c ON c."id" = m."chat_id"
+WHERE "messages_fts" MATCH ? AND m."bot_id" = ? {after}
+ORDER BY "messages_fts".rank, m."id"
+LIMIT ?
+'''
+SQLITE_AFTER = 'AND ("messages_fts".rank > ? OR ("messages_fts".rank = ? AND m."id" > ?))'
+
+# PostgreSQL: ts_rank со знаком минус, чтобы порядок и курсор совпадали с SQLite
+POSTGRES_SEARCH_SQL = '''
+SELECT s."id", s."chat_id", s."direction", s."timestamp", c."title" AS "chat_title",
+       ts_headline('simple', s."text", to_tsquery('simple', ?),
+                   'StartSel=' || chr(2) || ', StopSel=' || chr(3) || ', MaxWords=20, MinWords=8') AS "snippet",
+       s."rank"
+FROM (
+    SELECT m."id", m."chat_id", m."direction", m."timestamp", m."text",
+           -ts_rank(m."search", to_tsquery('simple', ?)) AS "rank"
+    FROM "messages" m
+    WHERE m."search" @@ to_tsquery('simple', ?) AND m."bot_id" = ?
+) s
+LEFT JOIN "chats" c ON c."id" = s."chat_id"
+WHERE TRUE {after}
+ORDER BY s."rank", s."id"
+LIMIT ?
+'''
+POSTGRES_AFTER = 'AND (s."rank" > ? OR (s."rank" = ? AND s."id" > ?))'
+
+
+def search_terms(query: str) -> list:
+    return TERM_RE.findall(query.lower())[:MAX_TERMS]
+
+
+def fts5_query(terms: list) -> str:
+    """Все слова обязательны, последнее - как префикс (поиск по мере набора)"""
+    return " ".join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+
+
+def tsquery(terms: list) -> str:
+    return " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+
+
+def search_cursor(row: dict) -> str:
+    """Ключ позиции в результатах: ранг и id сообщения"""
+    return f"{row['rank']!r}_{row['id']}"
+
+
+def highlight(snippet: str) -> str:
+    """Фрагмент сообщения для вывода в HTML: текст экранирован, совпадения в <mark>"""
+    return html.escape(snippet or "").replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+async def search_messages(bot_id: int, query: str, cursor: str = None,
+                          limit: int = SEARCH_PAGE_SIZE) -> list:
+    """Страница результатов поиска по сообщениям бота, лучшие совпадения первыми.
+
+    ValueError - некорректный курсор.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    connection = read_connection()
+    if is_postgres(connection):
+        match = tsquery(terms)
+        sql, after_sql, params = POSTGRES_SEARCH_SQL, POSTGRES_AFTER, [match, match, match, bot_id]
+    else:
+        sql, after_sql, params = SQLITE_SEARCH_SQL, SQLITE_AFTER, [MARK_START, MARK_END, fts5_query(terms), bot_id]
+    if cursor:
+        rank, _, message_id = cursor.rpartition("_")
+        rank, message_id = float(rank), int(message_id)
+        params += [rank, rank, message_id]
+    sql = sql.format(after=after_sql if cursor else "")
+    with DB_QUERY_SECONDS.time("search"):
+        _, rows = await connection.execute_query(dialect_sql(connection, sql), params + [limit])
+
+    results = []
+    for row in rows:
+        timestamp = row["timestamp"]
+        if isinstance(timestamp, str):
+            timestamp = datetime.fromisoformat(timestamp)
+        results.append({
+            "id": row["id"],
+            "chat_id": row["chat_id"],
+            "chat_title": row["chat_title"],
+            "direction": row["direction"],
+            "timestamp": timestamp.isoformat(),
+            "time": timestamp.strftime('%d.%m.%Y %H:%M'),
+            "snippet": highlight(row["snippet"]),
+            "rank": row["rank"],
+        })
+    return results
+
+
+async def backfill_pending() -> int:
+    """Сколько старых сообщений (до миграции поиска) ещё не проиндексировано"""
+    connection = connections.get(WRITE_CONNECTION)
+    if is_postgres(connection):
+        return 0
+    _, rows = await connection.execute_query('SELECT "upto", "done" FROM "search_backfill"')
+    return sum(row["upto"] - row["done"] for row in rows)
+
+
+async def backfill_index(batch_size: int = 10000):
+    """Индексация старых сообщений пачками; каждая пачка - своя транзакция, можно прерывать.
+
+    Генератор: после каждой пачки отдаёт (done, upto).
+    """
+    while True:
+        async with in_transaction(WRITE_CONNECTION) as conn:
+            _, rows = await conn.execute_query('SELECT "upto", "done" FROM "search_backfill"')
+            upto, done = rows[0]["upto"], rows[0]["done"]
+            if done >= upto:
+                return
+            end = min(done + batch_size, upto)
+            await conn.execute_query(
+                'INSERT INTO "messages_fts" (rowid, "text") '
+                'SELECT "id", "text" FROM "messages" WHERE "id" > ? AND "id" <= ?', [done, end]
+            )
+            await conn.execute_query('UPDATE "search_backfill" SET "done" = ?', [end])
+        yield end, upto
@@ -0,0 +1,205 @@
+from datetime import timedelta
+from tortoise import timezone
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import Q
+from models import Bot as BotModel, Worker, BotLease
+from config import SHARD_HEARTBEAT, SHARD_LEASE_TTL, SHARD_VNODES
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import secrets
+import socket
+
+
+def ring_hash(key: str) -> int:
+    """Хэш, одинаковый во всех процессах (встроенный hash() зависит от PYTHONHASHSEED)"""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Консистентное хэширование: при смене состава воркеров переезжает ~1/N ботов"""
+    def __init__(self, nodes, vnodes: int = SHARD_VNODES):
+        self.nodes = sorted(nodes)
+        points = sorted((ring_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self.keys = [point for point, _ in points]
+        self.owners = [node for _, node in points]
+
+    def owner(self, bot_id: int):
+        """Воркер, которому принадлежит бот (None, если воркеров нет)"""
+        if not self.keys:
+            return None
+        index = bisect.bisect(self.keys, ring_hash(f"bot:{bot_id}")) % len(self.keys)
+        return self.owners[index]
+
+
+class ShardCoordinator:
+    """Распределение ботов между процессами через таблицы workers и bot_leases.
+
+    Каждый воркер периодически обновляет heartbeat, строит кольцо из живых воркеров
+    и запускает только те активные боты, которые попали на него и аренду которых он
+    получил. Аренда продлевается вместе с heartbeat; если воркер умер, его аренды
+    истекают через lease_ttl и боты подхватывают новые владельцы.
+
+    Heartbeat и продление аренд - отдельный цикл, а боты запускаются в фоне: запуск
+    сотен ботов (getMe, setWebhook при медленном Bot API) не должен выглядеть для
+    других воркеров как смерть этого.
+    """
+    def __init__(self, manager, heartbeat: float = SHARD_HEARTBEAT,
+                 lease_ttl: float = SHARD_LEASE_TTL, vnodes: int = SHARD_VNODES):
+        self.manager = manager
+        self.heartbeat = heartbeat
+        self.lease_ttl = lease_ttl
+        self.vnodes = vnodes
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+        self.ring = HashRing([], vnodes)
+        self.lock = asyncio.Lock()
+        self.closing = asyncio.Event()
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.keepalive_task = None
+        self.starting = set()  # bot_id, которые запускаются в фоне
+        self.start_tasks = set()
+
+    async def start(self):
+        """Запуск фонового цикла: регистрация воркера и первое распределение - в нём,
+        приложение принимает запросы, пока боты запускаются"""
+        self.task = asyncio.create_task(self.run(), name="shard-coordinator")
+        self.keepalive_task = asyncio.create_task(self.keepalive(), name="shard-heartbeat")
+        logging.info(f"Shard coordinator started: worker {self.worker_id}")
+
+    def wake(self):
+        """Внеочередное распределение в фоне (бот добавлен в админке)"""
+        self.wakeup.set()
+
+    async def stop(self):
+        """Остановка своих ботов и немедленное освобождение аренд для других воркеров"""
+        self.closing.set()
+        if self.task is not None:
+            await self.task
+            self.task = None
+        if self.keepalive_task is not None:
+            await self.keepalive_task
+            self.keepalive_task = None
+        async with self.lock:
+            await self.manager.stop_all()
+            await asyncio.gather(*self.start_tasks, return_exceptions=True)
+            await BotLease.filter(worker_id=self.worker_id).delete()
+            await Worker.filter(id=self.worker_id).delete()
+        logging.info(f"Shard coordinator stopped: worker {self.worker_id}")
+
+    async def run(self):
+        """Фоновый цикл: heartbeat, продление аренд и перераспределение"""
+        while not self.closing.is_set():
+            self.wakeup.clear()
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logging.error(f"Shard reconcile failed: {e}", exc_info=True)
+            closing = asyncio.ensure_future(self.closing.wait())
+            wakeup = asyncio.ensure_future(self.wakeup.wait())
+            await asyncio.wait((closing, wakeup), timeout=self.heartbeat, return_when=asyncio.FIRST_COMPLETED)
+            closing.cancel()
+            wakeup.cancel()
+
+    async def keepalive(self):
+        """Фоновый цикл heartbeat и продления аренд: не ждёт ни reconcile, ни запуска ботов"""
+        while not self.closing.is_set():
+            try:
+                await self.renew(timezone.now())
+            except Exception as e:
+                logging.error(f"Shard heartbeat failed: {e}", exc_info=True)
+            try:
+                await asyncio.wait_for(self.closing.wait(), self.heartbeat)
+            except asyncio.TimeoutError:
+                pass
+
+    async def renew(self, now):
+        """Heartbeat воркера и продление всех его аренд"""
+        if not await Worker.filter(id=self.worker_id).update(heartbeat=now):
+            try:
+                await Worker.create(id=self.worker_id, heartbeat=now)
+            except IntegrityError:
+                # Первая регистрация одновременно из keepalive и reconcile
+                pass
+        await BotLease.filter(worker_id=self.worker_id).update(expires=now + timedelta(seconds=self.lease_ttl))
+
+    def owns(self, bot_id: int) -> bool:
+        return self.ring.owner(bot_id) == self.worker_id
+
+    async def acquire(self, bot_id: int, now) -> bool:
+        """Захват аренды бота: свободной, истёкшей или уже своей"""
+        expires = now + timedelta(seconds=self.lease_ttl)
+        taken = await BotLease.filter(
+            Q(bot_id=bot_id) & (Q(expires__lt=now) | Q(worker_id=self.worker_id))
+        ).update(worker_id=self.worker_id, expires=expires)
+        if taken:
+            return True
+        try:
+            await BotLease.create(bot_id=bot_id, worker_id=self.worker_id, expires=expires)
+            return True
+        except IntegrityError:
+            # Аренду держит другой воркер (или бот удалён)
+            return False
+
+    async def reconcile(self):
+        """Приведение запущенных ботов процесса к распределению по кольцу.
+
+        Вызывается по таймеру, по wake() (add_bot) и сразу после изменения бота в админке (toggle_bot):
+        если бот принадлежит этому воркеру, изменение применяется немедленно, иначе -
+        владельцем на его следующем шаге (не позже heartbeat секунд).
+        """
+        async with self.lock:
+            now = timezone.now()
+            await self.renew(now)
+            alive_since = now - timedelta(seconds=self.lease_ttl)
+            workers = await Worker.filter(heartbeat__gte=alive_since).values_list("id", flat=True)
+            if sorted(workers) != self.ring.nodes:
+                self.ring = HashRing(workers, self.vnodes)
+                logging.info(f"Shard ring changed: {len(workers)} workers")
+
+            held = set(await BotLease.filter(worker_id=self.worker_id).values_list("bot_id", flat=True))
+            desired = {bot.id: bot for bot in await BotModel.filter(is_active=True) if self.owns(bot.id)}
+
+            # Сначала останавливаем чужие, выключенные и потерявшие аренду боты,
+            # и только потом отдаём аренды, чтобы новый владелец не запустил бота параллельно.
+            # Аренды запускаемых в фоне ботов держим: лишних остановит следующий шаг
+            await self.manager.stop_bots(set(self.manager.bots) - (set(desired) & held))
+            released = held - set(desired) - self.starting
+            if released:
+                await BotLease.filter(worker_id=self.worker_id, bot_id__in=list(released)).delete()
+
+            starting = [
+                bot for bot_id, bot in desired.items()
+                if bot_id not in self.starting and not self.manager.is_running(bot_id)
+                and await self.acquire(bot_id, now)
+            ]
+            if starting:
+                self.starting.update(bot.id for bot in starting)
+                task = asyncio.create_task(self.start_owned(starting), name="shard-bot-startup")
+                self.start_tasks.add(task)
+                task.add_done_callback(self.start_tasks.discard)
+
+            # Записи давно умерших воркеров больше не нужны
+            await Worker.filter(heartbeat__lt=now - timedelta(seconds=self.lease_ttl * 10)).delete()
+
+    async def start_owned(self, bots: list):
+        """Запуск полученных ботов вне блокировки; аренды тем временем продлевает keepalive"""
+        try:
+            started = await self.manager.start_background(bots)
+        finally:
+            self.starting.difference_update(bot.id for bot in bots)
+        failed = [bot_id for bot_id, ok in started.items() if not ok]
+        if failed:
+            await BotLease.filter(worker_id=self.worker_id, bot_id__in=failed).delete()
+        # Пока боты запускались, кольцо или боты могли измениться - проверяем сразу
+        self.wake()
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "workers": len(self.ring.nodes),
+            "bots": len(self.manager.bots),
+            "starting": len(self.starting),
+        }
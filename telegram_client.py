@@ -0,0 +1,156 @@
+from aiogram import exceptions
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from config import (
+    TELEGRAM_API_URL, TELEGRAM_HTTP_LIMIT, TELEGRAM_HTTP_TIMEOUT,
+    TELEGRAM_DNS_CACHE_TTL, TELEGRAM_RETRIES
+)
+from metrics import TELEGRAM_REQUEST_SECONDS, TELEGRAM_RESPONSES
+import aiohttp
+import asyncio
+import logging
+import time
+
+# Код ответа для метрик по исключению aiogram (подклассы проверяются раньше базовых)
+AIOGRAM_ERROR_CODES = [
+    (exceptions.TelegramEntityTooLarge, 413),
+    (exceptions.TelegramNetworkError, "network_error"),
+    (exceptions.TelegramRetryAfter, 429),
+    (exceptions.TelegramMigrateToChat, 400),
+    (exceptions.TelegramBadRequest, 400),
+    (exceptions.TelegramUnauthorizedError, 401),
+    (exceptions.TelegramForbiddenError, 403),
+    (exceptions.TelegramNotFound, 404),
+    (exceptions.TelegramConflictError, 409),
+    (exceptions.TelegramServerError, 500),
+]
+
+
+def error_code(error: Exception):
+    for error_class, code in AIOGRAM_ERROR_CODES:
+        if isinstance(error, error_class):
+            return code
+    return "error"
+
+
+class TelegramClient:
+    """Общий HTTP-клиент приложения для запросов к Telegram Bot API (keep-alive, кэш DNS)"""
+    def __init__(self, api_url: str = TELEGRAM_API_URL, limit: int = TELEGRAM_HTTP_LIMIT,
+                 timeout: float = TELEGRAM_HTTP_TIMEOUT, retries: int = TELEGRAM_RETRIES):
+        self.api_url = api_url
+        self.limit = limit
+        self.timeout = timeout
+        self.retries = retries
+        self.session = None
+        self.shared_bot_session = None
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Общая сессия; создаётся при первом обращении"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit,
+                ttl_dns_cache=TELEGRAM_DNS_CACHE_TTL,
+                keepalive_timeout=60
+            )
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout, connect=5)
+            )
+        return self.session
+
+    async def start(self):
+        """Создание сессии при запуске приложения"""
+        await self.get_session()
+        logging.info(f"Telegram HTTP client started: {self.api_url}, limit={self.limit}")
+
+    async def close(self):
+        """Закрытие сессии и всех соединений"""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def call(self, token: str, method: str, retries: int = None, **params) -> dict:
+        """Вызов метода Bot API; ответ Telegram в виде dict.
+
+        Повторяет запрос при 429 (с учётом retry_after), 5xx и ошибке подключения;
+        retries=1 - без повторов (их планирует вызывающий, как outbox).
+        """
+        session = await self.get_session()
+        url = f"{self.api_url}/bot{token}/{method}"
+        retries = retries or self.retries
+        delay = 0.5
+        for attempt in range(1, retries + 1):
+            last_attempt = attempt == retries
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=params) as response:
+                    data = await response.json(content_type=None)
+            except aiohttp.ClientConnectorError as e:
+                TELEGRAM_RESPONSES.inc(method, "connection_error")
+                # Запрос не ушёл - повтор безопасен
+                if last_attempt:
+                    raise
+                logging.warning(f"Telegram {method}: connection failed ({e}), retry in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay *= 2
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                TELEGRAM_RESPONSES.inc(method, "network_error")
+                raise
+            TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started, method)
+            TELEGRAM_RESPONSES.inc(method, response.status)
+
+            if response.status == 429 and not last_attempt:
+                retry_after = (data.get("parameters") or {}).get("retry_after", 1)
+                logging.warning(f"Telegram {method}: flood control, retry in {retry_after}s")
+                await asyncio.sleep(retry_after)
+                continue
+            if response.status >= 500 and not last_attempt:
+                logging.warning(f"Telegram {method}: HTTP {response.status}, retry in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                delay *= 2
+                continue
+            return data
+
+    def bot_session(self) -> "SharedAiohttpSession":
+        """Сессия для aiogram Bot, работающая через общий пул соединений.
+
+        Одна на всех ботов: бот передаётся в каждый запрос, а создание AiohttpSession
+        загружает сертификаты в новый SSL-контекст (~25 мс на бота при запуске).
+        """
+        if self.shared_bot_session is None:
+            self.shared_bot_session = SharedAiohttpSession(self)
+        return self.shared_bot_session
+
+
+class SharedAiohttpSession(AiohttpSession):
+    """Сессия aiogram поверх общего TelegramClient: боты не держат свои пулы соединений"""
+    def __init__(self, client: TelegramClient, **kwargs):
+        super().__init__(api=TelegramAPIServer.from_base(client.api_url), **kwargs)
+        self.client = client
+
+    async def create_session(self) -> aiohttp.ClientSession:
+        return await self.client.get_session()
+
+    async def make_request(self, bot, method, timeout=None):
+        """Запрос aiogram (getUpdates, setWebhook и т.п.) с учётом в метриках"""
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            result = await super().make_request(bot, method, timeout)
+        except exceptions.TelegramAPIError as e:
+            TELEGRAM_RESPONSES.inc(name, error_code(e))
+            raise
+        finally:
+            TELEGRAM_REQUEST_SECONDS.observe(time.perf_counter() - started, name)
+        TELEGRAM_RESPONSES.inc(name, 200)
+        return result
+
+    async def close(self) -> None:
+        # Общая сессия закрывается в shutdown приложения
+        pass
+
+
+# Общий клиент процесса
+telegram_client = TelegramClient()
@@ -0,0 +1,97 @@
+from telegram_client import telegram_client
+from config import TOKEN_CHECK_TTL, TOKEN_CHECK_CONCURRENCY
+import asyncio
+import logging
+import re
+import time
+
+# Токен Bot API: <id бота>:<секрет>
+TOKEN_PATTERN = re.compile(r"^\d+:[A-Za-z0-9_-]{30,}$")
+# Ответы getMe, после которых токен считается недействительным (404 - токен неверного вида)
+REJECTED_CODES = {401, 404}
+
+
+def token_format_ok(token: str) -> bool:
+    """Проверка вида токена без обращения к Telegram"""
+    return TOKEN_PATTERN.match(token) is not None
+
+
+class TokenChecker:
+    """Проверка токенов ботов через getMe с кэшем результатов.
+
+    Результат: True - токен принят, False - отклонён Telegram, None - проверить не удалось
+    (сеть, 5xx, 429); None не запоминается. Одновременные проверки одного токена ждут
+    один запрос, всего запросов одновременно - не больше concurrency.
+    """
+    def __init__(self, ttl: float = TOKEN_CHECK_TTL, concurrency: int = TOKEN_CHECK_CONCURRENCY):
+        self.ttl = ttl
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.results = {}  # token -> (результат, время проверки, ответ getMe)
+        self.pending = {}  # token -> задача проверки
+        self.accepted = 0
+        self.rejected = 0
+        self.failed = 0  # проверить не удалось
+
+    def cached(self, token: str):
+        """Результат проверки из кэша (None, если токен не проверялся или результат устарел)"""
+        entry = self.results.get(token)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def me(self, token: str):
+        """Ответ getMe (dict пользователя-бота) из последней успешной проверки"""
+        entry = self.results.get(token)
+        return entry[2] if entry is not None else None
+
+    def reject(self, token: str):
+        """Telegram отклонил токен вне проверки (например, при поллинге)"""
+        self.results[token] = (False, time.monotonic(), None)
+
+    async def check(self, token: str):
+        """Проверка токена: из кэша или через getMe"""
+        if not token_format_ok(token):
+            return False
+        result = self.cached(token)
+        if result is not None:
+            return result
+        task = self.pending.get(token)
+        if task is None:
+            task = self.pending[token] = asyncio.create_task(self.request(token))
+        # Отмена одного ожидающего не отменяет запрос, который ждут другие
+        return await asyncio.shield(task)
+
+    async def request(self, token: str):
+        try:
+            async with self.semaphore:
+                data = await telegram_client.call(token, "getMe")
+        except Exception as e:
+            logging.warning(f"Token check failed for {token[:5]}...: {e}")
+            self.failed += 1
+            return None
+        finally:
+            del self.pending[token]
+        if data.get("ok"):
+            result = True
+            self.accepted += 1
+        elif data.get("error_code") in REJECTED_CODES:
+            result = False
+            self.rejected += 1
+        else:
+            logging.warning(f"Token check for {token[:5]}... inconclusive: {data.get('description')}")
+            self.failed += 1
+            return None
+        self.results[token] = (result, time.monotonic(), data.get("result"))
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self.results),
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "failed": self.failed,
+        }
+
+
+# Общий кэш проверок процесса
+token_checker = TokenChecker()
@@ -0,0 +1,99 @@
+from fastapi import APIRouter, Request, Response
+from config import WEBHOOK_BASE_URL, WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS
+import asyncio
+import hashlib
+import hmac
+import logging
+
+
+def webhook_secret(token: str) -> str:
+    """Секретная часть URL вебхука: стабильна между перезапусками и воркерами"""
+    return hmac.new(WEBHOOK_SECRET.encode(), token.encode(), hashlib.sha256).hexdigest()[:32]
+
+
+def webhook_url(bot_id: int, token: str) -> str:
+    return f"{WEBHOOK_BASE_URL}/tg/{bot_id}/{webhook_secret(token)}"
+
+
+def check_config():
+    """Настройки режима webhook: без адреса Telegram получил бы относительный URL,
+    без ключа секрет URL может вычислить любой, кто знает токен"""
+    missing = [name for name, value in (("WEBHOOK_BASE_URL", WEBHOOK_BASE_URL), ("WEBHOOK_SECRET", WEBHOOK_SECRET))
+               if not value]
+    if missing:
+        raise RuntimeError(f"BOT_MODE=webhook requires {' and '.join(missing)} to be set")
+
+
+class WebhookDispatcher:
+    """Общий приём обновлений от Telegram для всех ботов: очередь и пул обработчиков"""
+    def __init__(self, queue_size: int = WEBHOOK_QUEUE_SIZE, workers: int = WEBHOOK_WORKERS):
+        self.bots = {}  # bot_id -> bot_instance, зарегистрированные в режиме вебхука
+        self.resolver = None  # async bot_id -> bot_instance для ботов, которых нет в self.bots
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.workers = workers
+        self.tasks = []
+        self.processed = 0
+        self.rejected = 0
+
+    def register(self, bot_instance):
+        self.bots[bot_instance.bot_id] = bot_instance
+
+    def unregister(self, bot_id):
+        self.bots.pop(bot_id, None)
+
+    def start(self):
+        """Запуск обработчиков очереди"""
+        if not self.tasks:
+            self.tasks = [
+                asyncio.create_task(self.worker(), name=f"webhook-worker-{i}")
+                for i in range(self.workers)
+            ]
+            logging.info(f"Webhook dispatcher started: {self.workers} workers")
+
+    async def stop(self):
+        """Обработка оставшихся обновлений и остановка"""
+        await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def enqueue(self, bot_id: int, secret: str, update: dict) -> int:
+        """Постановка обновления в очередь; HTTP-статус ответа Telegram"""
+        bot_instance = self.bots.get(bot_id)
+        if bot_instance is None and self.resolver is not None:
+            bot_instance = await self.resolver(bot_id)
+        if bot_instance is None or not hmac.compare_digest(secret, webhook_secret(bot_instance.token)):
+            return 404
+        try:
+            self.queue.put_nowait((bot_instance, update))
+        except asyncio.QueueFull:
+            # Telegram повторит доставку позже
+            self.rejected += 1
+            return 503
+        return 200
+
+    async def worker(self):
+        while True:
+            bot_instance, update = await self.queue.get()
+            try:
+                # Обновление обрабатывают обработчики того же класса бота, что и при поллинге
+                await bot_instance.dp.feed_raw_update(bot_instance.bot, update)
+                self.processed += 1
+            except Exception as e:
+                logging.error(f"Webhook update failed for bot {bot_instance.bot_id}: {e}", exc_info=True)
+            finally:
+                self.queue.task_done()
+
+
+# Общий диспетчер вебхуков процесса
+webhook_dispatcher = WebhookDispatcher()
+
+router = APIRouter()
+
+
+@router.post("/tg/{bot_id}/{secret}")
+async def telegram_webhook(request: Request, bot_id: int, secret: str):
+    """Приём обновления: только постановка в очередь, ответ сразу"""
+    update = await request.json()
+    return Response(status_code=await webhook_dispatcher.enqueue(bot_id, secret, update))